@@ -12,7 +12,8 @@ from django.contrib.gis.measure import D
 
 from django_tinsel.exceptions import HttpBadRequestException
 
-from treemap.lib.map_feature import context_dict_for_plot
+from treemap.lib.map_feature import (context_dict_for_plot,
+                                     context_dicts_for_plots)
 from treemap.views.map_feature import update_map_feature
 
 from treemap.models import Plot
@@ -42,10 +43,7 @@ def plots_closest_to_point(request, instance, lat, lng):
                         .filter(geom__distance_lte=(point, D(m=distance)))\
                         .order_by('distance')[0:max_plots]
 
-    def ctxt_for_plot(plot):
-        return context_dict_for_plot(request, plot)
-
-    return [ctxt_for_plot(plot) for plot in plots]
+    return context_dicts_for_plots(request, plots)
 
 
 def get_plot(request, instance, plot_id):
@@ -20,7 +20,8 @@ from django_tinsel.decorators import route, json_api_call
 
 from treemap.models import Plot, Tree, User
 from treemap.views.misc import species_list
-from treemap.lib.map_feature import context_dict_for_plot
+from treemap.lib.map_feature import (context_dict_for_plot,
+                                     context_dicts_for_plots)
 from treemap.lib.tree import add_tree_photo_helper
 from treemap.lib.photo import context_dict_for_photo
 from treemap.lib.dates import DATETIME_FORMAT
@@ -185,10 +186,7 @@ def get_plot_list(request, instance):
     plots = Plot.objects.filter(instance=instance)\
                         .order_by('id')[start:end]
 
-    def ctxt_for_plot(plot):
-        return context_dict_for_plot(request, plot)
-
-    return [ctxt_for_plot(plot) for plot in plots]
+    return context_dicts_for_plots(request, plots)
 
 
 def _approve_or_reject_pending_edit(
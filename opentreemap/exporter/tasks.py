@@ -7,10 +7,12 @@ import csv
 
 from contextlib import contextmanager
 from functools import wraps
+from itertools import islice
 from celery import task
 from tempfile import TemporaryFile
 
 from django.core.files import File
+from django.db.models.query import ValuesQuerySet
 from treemap.lib.object_caches import permissions
 
 from treemap.search import Filter
@@ -18,6 +20,7 @@ from treemap.models import Species, Tree
 from treemap.util import safe_get_model_class
 from treemap.audit import model_hasattr, FieldPermission
 from treemap.udf import UserDefinedCollectionValue, UDFC_NAMES
+from treemap.units import get_conversion_table, get_converted_values
 
 from treemap.lib.object_caches import udf_defs
 
@@ -29,6 +32,10 @@ from exporter.util import sanitize_unicode_record
 
 _UDFC_FIELDS = tuple(['udf:' + name for name in UDFC_NAMES])
 
+# The number of exported rows whose values are converted to display units
+# at once
+_CONVERSION_BATCH_SIZE = 1000
+
 
 @contextmanager
 def _job_transaction_manager(job_pk):
@@ -106,6 +113,50 @@ def extra_select_and_values_for_model(
     return (extra_select, prefixed_names)
 
 
+class _DisplayUnitsValuesQuerySet(ValuesQuerySet):
+    """
+    Yields rows whose convertible values are in the instance's display
+    units, converting a batch of rows at a time. Created by
+    _in_display_units.
+    """
+    def iterator(self):
+        rows = super(_DisplayUnitsValuesQuerySet, self).iterator()
+        while True:
+            batch = list(islice(rows, _CONVERSION_BATCH_SIZE))
+            if not batch:
+                return
+
+            for column, (category, value_name) in \
+                    self.conversions.iteritems():
+                values = get_converted_values(
+                    self.instance, category, value_name,
+                    [row[column] for row in batch])
+                for row, value in zip(batch, values):
+                    row[column] = value
+
+            for row in batch:
+                yield row
+
+
+def _in_display_units(values_qs, instance, categories_by_prefix):
+    """
+    Returns values_qs with its convertible columns in display units.
+    categories_by_prefix maps the prefix of each column's name (e.g.
+    'plot' for 'plot__width') to its units category (e.g. 'plot').
+    """
+    table = get_conversion_table(instance)
+    conversions = {}
+    for column in values_qs.field_names:
+        prefix, __, value_name = column.rpartition('__')
+        category = categories_by_prefix.get(prefix)
+        conversion = table.get(category, {}).get(value_name)
+        if conversion and conversion.units:
+            conversions[column] = (category, value_name)
+
+    return values_qs._clone(klass=_DisplayUnitsValuesQuerySet,
+                            instance=instance, conversions=conversions)
+
+
 @task
 @_job_transaction
 def async_users_export(job, data_format):
@@ -178,6 +229,8 @@ def async_csv_export(job, model, query, display_filters):
         if ordered_fields:
             limited_qs = initial_qs.extra(select=extra_select)\
                                    .values(*ordered_fields)
+            limited_qs = _in_display_units(
+                limited_qs, instance, {'': 'tree', 'plot': 'plot'})
         else:
             limited_qs = initial_qs.none()
 
@@ -8,6 +8,7 @@ import json
 
 from treemap.udf import UserDefinedFieldDefinition
 from treemap.lib.dates import DATETIME_FORMAT
+from treemap.json_field import set_attr_on_json_field
 from treemap.tests.test_views import LocalMediaTestCase, media_dir
 from treemap.tests import (make_instance, make_commander_user, make_request,
                            set_write_permissions, make_commander_role,
@@ -137,6 +138,14 @@ class ExportTreeTaskTest(AsyncCSVTestCase):
                                 'udf:Test int': '4',
                                 'plot__udf:Test choice': 'a'})
 
+    @media_dir
+    def test_tree_task_uses_display_units(self):
+        set_attr_on_json_field(
+            self.instance, 'config.value_display.tree.diameter.units', 'cm')
+        self.instance.save()
+
+        self.assertTaskProducesCSV(self.user, 'tree', {'diameter': '5.08'})
+
     @media_dir
     @override_settings(FEATURE_BACKEND_FUNCTION=None)
     def test_export_view_permission_failure(self):
@@ -8,7 +8,7 @@ from django.contrib.gis.db import models
 from django.db import transaction
 from django.utils.translation import ugettext as _
 
-from treemap.ecobenefits import has_itree_code, all_itree_codes
+from treemap.lib.itree_codes import has_itree_code, all_itree_codes
 from treemap.models import (Species, ITreeCodeOverride, ITreeRegion, User)
 from treemap.species import species_for_scientific_name
 from treemap.species.codes import all_itree_region_codes
@@ -10,6 +10,7 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
 
 from treemap.models import Species
+from treemap.lib import benefit_aggregates
 
 from importer.models.base import GenericImportEvent, GenericImportRow
 from importer.models.species import SpeciesImportEvent, SpeciesImportRow
@@ -148,8 +149,10 @@ def commit_import_event(import_type, import_event_id):
 def _commit_rows(import_type, import_event_id, i):
     ie = _get_import_event(import_type, import_event_id)
 
-    for row in ie.rows()[i:(i + BLOCK_SIZE)]:
-        row.commit_row()
+    # Update the instance's eco benefit totals once per block of rows
+    with benefit_aggregates.batched_updates():
+        for row in ie.rows()[i:(i + BLOCK_SIZE)]:
+            row.commit_row()
 
 
 @task()
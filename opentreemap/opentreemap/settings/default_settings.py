@@ -20,6 +20,105 @@ SYSTEM_USER_ID = -1
 #
 ECO_SERVICE_URL = 'http://localhost:13000'
 
+#
+# Ecoservice client settings (see treemap/ecobackend.py)
+#
+# Up to ECO_SERVICE_POOL_SIZE idle connections are kept open in each
+# process. Timeouts are in seconds.
+#
+# After ECO_SERVICE_FAILURE_THRESHOLD consecutive failed calls, calls fail
+# immediately for ECO_SERVICE_RESET_TIMEOUT seconds, then a single call is
+# tried to see if the service has recovered.
+#
+# ECO_SERVICE_LATENCY_BUCKETS are the upper bounds (in seconds) of the
+# buckets of the per-endpoint latency histograms
+#
+ECO_SERVICE_POOL_SIZE = 10
+ECO_SERVICE_CONNECT_TIMEOUT = 2
+ECO_SERVICE_READ_TIMEOUT = 60
+ECO_SERVICE_FAILURE_THRESHOLD = 5
+ECO_SERVICE_RESET_TIMEOUT = 30
+ECO_SERVICE_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                               1, 2.5, 5, 10, 30, 60)
+
+#
+# The i-Tree codes known to the ecoservice are cached in this file, which
+# is shared by all processes and refreshed in the background after
+# ITREE_CODES_CACHE_TTL seconds (see treemap/lib/itree_codes.py). Its
+# directory is created if it doesn't exist, and should only be writable
+# by the user the app runs as.
+#
+ITREE_CODES_CACHE_FILE = '/usr/local/otm/var/itree-codes.json'
+ITREE_CODES_CACHE_TTL = 60 * 60 * 24
+
+#
+# Engine used to compute eco benefits. Either 'ecoservice', which
+# makes HTTP requests to ECO_SERVICE_URL, or 'local', which computes
+# benefits in-process from the i-Tree lookup tables stored as JSON
+# files in ECO_LOCAL_ENGINE_DATA_DIR (see treemap/ecoengine.py)
+#
+# The tables are generated from the ecoservice, which also checks them
+# against it between the breakpoints, with:
+#
+#   python manage.py export_eco_tables <ECO_LOCAL_ENGINE_DATA_DIR>
+#
+ECO_BENEFITS_ENGINE = 'ecoservice'
+ECO_LOCAL_ENGINE_DATA_DIR = None
+
+#
+# When an instance intersects several i-Tree regions, summaries from the
+# ecoservice are computed with one request per region, made in parallel
+# by up to this many threads. 0 sends a single request with the location
+# of every tree instead.
+#
+ECO_REGION_FAN_OUT_WORKERS = 4
+
+#
+# Eco benefit caching (see treemap/lib/benefit_caches.py)
+#
+# ECO_TREE_CACHE_SIZE is the number of per-tree results kept in each
+# process (0 disables the cache). Diameters are rounded to
+# ECO_TREE_CACHE_DIAMETER_DIGITS decimal places before computing
+# benefits, so that nearby diameters share an entry.
+#
+# ECO_FILTER_CACHE_SIZE is the number of search summaries kept in each
+# process (0 disables the cache)
+#
+# ECO_SHARED_CACHE is the name of a cache in CACHES shared by all
+# processes (e.g. memcached), or None to only cache in-process
+#
+ECO_TREE_CACHE_SIZE = 10000
+ECO_TREE_CACHE_DIAMETER_DIGITS = 1
+ECO_FILTER_CACHE_SIZE = 1000
+ECO_SHARED_CACHE = None
+ECO_SHARED_CACHE_TIMEOUT = 60 * 60 * 24
+
+#
+# Answer unfiltered and single boundary eco benefit summaries from
+# incrementally maintained totals (see treemap/lib/benefit_aggregates.py)
+#
+ECO_BENEFIT_AGGREGATES = True
+
+#
+# Eco benefit summaries of searches matching more than
+# ECO_SAMPLING_THRESHOLD trees are estimated from a sample of about
+# ECO_SAMPLE_SIZE trees, stratified by species and by diameter classes
+# ECO_SAMPLING_DIAMETER_CLASS_WIDTH wide (see
+# treemap/lib/benefit_sampling.py). None always computes every tree.
+#
+ECO_SAMPLING_THRESHOLD = None
+ECO_SAMPLE_SIZE = 5000
+ECO_SAMPLING_DIAMETER_CLASS_WIDTH = 6
+
+#
+# When True, the map page has eco benefit summaries of searches computed
+# by a celery worker and polls for the result, rather than waiting for it
+# in a web request. Pending summaries are abandoned after
+# ECO_ASYNC_SUMMARY_TIMEOUT seconds.
+#
+ECO_ASYNC_SUMMARIES = False
+ECO_ASYNC_SUMMARY_TIMEOUT = 60 * 10
+
 # This should be the google analytics id without
 # the 'GTM-' prefix
 GOOGLE_ANALYTICS_ID = None
@@ -171,6 +270,7 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'opentreemap.middleware.InternetExplorerRedirectMiddleware',
+    'treemap.lib.request_memo.RequestMemoMiddleware',
     # Uncomment the next line for simple clickjacking protection:
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
@@ -304,4 +404,57 @@ IE_VERSION_UNSUPPORTED_REDIRECT_PATH = '/unsupported'
 
 USE_OBJECT_CACHES = True
 
+#
+# Adjunct object caching (see treemap/lib/object_caches.py)
+#
+# OBJECT_CACHES_SHARED_CACHE is the name of a cache in CACHES shared by
+# all processes (e.g. memcached) which holds each instance's roles, field
+# permissions and UDF definitions, or None to only cache them in-process
+#
+OBJECT_CACHES_SHARED_CACHE = None
+OBJECT_CACHES_SHARED_CACHE_TIMEOUT = 60 * 60 * 24
+
+# OBJECT_CACHES_MAX_INSTANCES is the number of instances whose adjuncts are
+# cached in each process
+OBJECT_CACHES_MAX_INSTANCES = 200
+
+# OBJECT_CACHES_NOTIFY_CHANNEL is the name of a PostgreSQL channel used to
+# notify every process when an instance's adjuncts or an i-Tree region
+# change, or None to rely on each request's Instance to detect changes.
+# Without it, a changed i-Tree region is only seen by the process that
+# changed it, so set it when running more than one process.
+OBJECT_CACHES_NOTIFY_CHANNEL = None
+
+# OBJECT_CACHES_STATS_INTERVAL is how often (in seconds) each process
+# publishes its adjunct cache statistics to OBJECT_CACHES_SHARED_CACHE for
+# the adjunct_cache_stats command, from a background thread, 0 disables
+# publishing
+OBJECT_CACHES_STATS_INTERVAL = 60
+
+#
+# The number of parsed search filters kept in each process (see
+# create_filter in treemap/search.py), 0 disables the cache
+#
+SEARCH_FILTER_CACHE_SIZE = 500
+
+#
+# Rewrite parsed search filters into equivalent, cheaper queries (see the
+# optimizer in treemap/search.py)
+#
+SEARCH_OPTIMIZE_FILTERS = True
+
+#
+# Search result caching (see treemap/lib/search_results.py)
+#
+# SEARCH_RESULT_CACHE_SIZE is the number of searches whose result counts
+# are kept in each process (0 disables the cache)
+#
+SEARCH_RESULT_CACHE_SIZE = 100
+
+#
+# Create an index for searching each numeric, date and choice scalar UDF
+# (see treemap/lib/udf_indexes.py)
+#
+UDF_SEARCH_INDEXES = True
+
 BING_API_KEY = None
@@ -11,7 +11,8 @@ from django.contrib import admin
 from treemap import routes
 from treemap.instance import URL_NAME_PATTERN
 from treemap.urls import USERNAME_PATTERN
-from treemap.ecobenefits import within_itree_regions_view
+from treemap.ecobenefits import (within_itree_regions_view,
+                                 eco_service_stats_view)
 
 from registration_backend.views import RegistrationView
 
@@ -62,6 +63,8 @@ urlpatterns = patterns(
     url(r'^main\.css$', routes.compile_scss, name='scss'),
     url(r'^eco/benefit/within_itree_regions/$', within_itree_regions_view,
         name='within_itree_regions'),
+    url(r'^eco/benefit/stats/$', eco_service_stats_view,
+        name='eco_service_stats'),
     url(r'^instances/$', routes.instances_geojson),
     url(instance_pattern + r'/accounts/register/$',
         RegistrationView.as_view(),
@@ -25,7 +25,36 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "opentreemap.settings")
 # file. This includes Django's development server, if the WSGI_APPLICATION
 # setting points here.
 from django.core.wsgi import get_wsgi_application
-application = get_wsgi_application()
+django_application = get_wsgi_application()
+
+from treemap.lib import itree_codes, object_caches
+
+# The process which has started its background threads. This module may be
+# imported before the server forks its workers (e.g. by gunicorn --preload),
+# and threads don't survive a fork, so each worker starts its own on its
+# first request.
+_started_pid = None
+
+
+def _start_process():
+    global _started_pid
+    _started_pid = os.getpid()
+
+    # Load the i-Tree codes known to the ecoservice in the background, so
+    # that requests don't wait on the ecoservice for them
+    itree_codes.warm_up()
+
+    # Evict cached adjunct objects as soon as any process changes them
+    object_caches.start_invalidation_listener()
+
+    # Publish adjunct cache statistics without slowing any request
+    object_caches.start_stats_publisher()
+
+
+def application(environ, start_response):
+    if _started_pid != os.getpid():
+        _start_process()
+    return django_application(environ, start_response)
 
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
@@ -15,12 +15,16 @@ class DotDict(dict):
         config.fruit.apple.type = 'macoun'
     """
     def __init__(self, value=None):
+        # A count of modifications, shared with the DotDicts nested in
+        # this one, so that values derived from a DotDict can be
+        # discarded when it may have changed
+        self.__dict__['_mutations'] = [0]
 
         if value is None:
             pass
         elif isinstance(value, dict):
             for key in value:
-                self.__setitem__(key, value[key])
+                self._set(key, value[key])
         else:
             raise TypeError('Expected dict')
 
@@ -29,7 +33,31 @@ class DotDict(dict):
             raise KeyError('Cannot set "%s" in "%s" (%s)' %
                            (restOfKey, myKey, repr(target)))
 
+    def mutation_count(self):
+        """
+        The number of times this DotDict, or one nested in it, has been
+        modified since it was created
+        """
+        return self._get_mutations()[0]
+
+    def _get_mutations(self):
+        # Unpickling sets items before restoring __dict__
+        return self.__dict__.setdefault('_mutations', [0])
+
+    def _mutated(self):
+        self._get_mutations()[0] += 1
+
+    def _share_mutations(self, mutations):
+        self.__dict__['_mutations'] = mutations
+        for value in dict.itervalues(self):
+            if isinstance(value, DotDict):
+                value._share_mutations(mutations)
+
     def __setitem__(self, key, value):
+        self._mutated()
+        self._set(key, value)
+
+    def _set(self, key, value):
         if '.' in key:
             myKey, restOfKey = key.split('.', 1)
             target = self.setdefault(myKey, DotDict())
@@ -38,6 +66,8 @@ class DotDict(dict):
         else:
             if isinstance(value, dict) and not isinstance(value, DotDict):
                 value = DotDict(value)
+            if isinstance(value, DotDict):
+                value._share_mutations(self._get_mutations())
             dict.__setitem__(self, key, value)
 
     def __getitem__(self, key):
@@ -67,6 +97,27 @@ class DotDict(dict):
             return False
         return restOfKey in target
 
+    def __delitem__(self, key):
+        self._mutated()
+        dict.__delitem__(self, key)
+
+    def pop(self, *args):
+        self._mutated()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._mutated()
+        return dict.popitem(self)
+
+    def update(self, *args, **kwargs):
+        self._mutated()
+        dict.update(self, *args, **kwargs)
+        self._share_mutations(self._get_mutations())
+
+    def clear(self):
+        self._mutated()
+        dict.clear(self)
+
     def setdefault(self, key, default):
         if key not in self:
             self[key] = default
@@ -76,7 +127,8 @@ class DotDict(dict):
         return self.__dict__
 
     def __setstate__(self, d):
-        self.__dict__ = d
+        self.__dict__.update(d)
+        self._share_mutations(self._get_mutations())
 
     def __deepcopy__(self, memo):
         return DotDict(deepcopy(dict(self), memo))
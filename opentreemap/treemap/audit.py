@@ -24,7 +24,8 @@ from treemap.units import (is_convertible, is_convertible_or_formattable,
                            get_display_value, get_units, get_unit_name)
 from treemap.util import all_subclasses
 from treemap.lib.object_caches import (permissions, role_permissions,
-                                       invalidate_adjuncts, udf_defs)
+                                       invalidate_adjuncts, udf_defs,
+                                       compiled_permissions, Freezable)
 from treemap.lib.dates import datesafe_eq
 
 
@@ -586,7 +587,7 @@ class UserTrackable(Dictable):
         return []
 
 
-class FieldPermission(models.Model):
+class FieldPermission(Freezable, models.Model):
     model_name = models.CharField(max_length=255)
     field_name = models.CharField(max_length=255)
     role = models.ForeignKey('Role')
@@ -708,16 +709,12 @@ class Authorizable(UserTrackable):
                 "Cannot retrieve permissions for this object because "
                 "it does not have an instance associated with it."))
 
-        perms = permissions(user, self.instance, self._model_name)
+        perms = self._compiled_perms_for_user(user)
 
         if direct_only:
-            perm_set = {perm.field_name
-                        for perm in perms
-                        if perm.permission_level ==
-                        FieldPermission.WRITE_DIRECTLY}
+            perm_set = perms.direct_writable
         else:
-            perm_set = {perm.field_name for perm in perms
-                        if perm.allows_writes}
+            perm_set = perms.writable
 
         return perm_set.union(self._get_joint_writeable_fields(user))
 
@@ -725,9 +722,8 @@ class Authorizable(UserTrackable):
         # If any field on any model is writable in any capacity, read
         # a class property to get the set of field names that are also
         # writable.
-        can_write_anything = bool({perm.field_name for perm
-                                   in permissions(user, self.instance)
-                                   if perm.allows_writes})
+        can_write_anything = bool(
+            compiled_permissions(user, self.instance).writable)
         if can_write_anything:
             return getattr(type(self), 'joint_writable', set())
         else:
@@ -794,10 +790,7 @@ class Authorizable(UserTrackable):
         return fields_to_audit
 
     def mask_unauthorized_fields(self, user):
-        perms = permissions(user, self.instance, self._model_name)
-        readable_fields = {perm.field_name for perm
-                           in perms
-                           if perm.allows_reads}
+        readable_fields = self._compiled_perms_for_user(user).readable
 
         fields = set(self.get_previous_state().keys())
         unreadable_fields = fields - readable_fields
@@ -807,28 +800,28 @@ class Authorizable(UserTrackable):
 
         self._has_been_masked = True
 
-    def _perms_for_user(self, user):
-        return permissions(user, self.instance, self._model_name)
+    def _compiled_perms_for_user(self, user):
+        return compiled_permissions(user, self.instance, self._model_name)
 
     def visible_fields(self, user):
-        perms = self._perms_for_user(user)
+        perms = self._compiled_perms_for_user(user)
         always_readable = getattr(type(self), 'joint_writable', set())
 
-        return always_readable | \
-            {perm.field_name for perm in perms if perm.allows_reads}
+        return always_readable | perms.readable
 
     def field_is_visible(self, user, field):
-        return field in self.visible_fields(user)
+        return (self._compiled_perms_for_user(user).allows_read(field) or
+                field in getattr(type(self), 'joint_writable', set()))
 
     def editable_fields(self, user):
-        perms = self._perms_for_user(user)
+        perms = self._compiled_perms_for_user(user)
         always_writeable = self._get_joint_writeable_fields(user)
 
-        return always_writeable | \
-            {perm.field_name for perm in perms if perm.allows_writes}
+        return always_writeable | perms.writable
 
     def field_is_editable(self, user, field):
-        return field in self.editable_fields(user)
+        return (self._compiled_perms_for_user(user).allows_write(field) or
+                field in self._get_joint_writeable_fields(user))
 
     @staticmethod
     def mask_queryset(qs, user):
@@ -9,7 +9,7 @@ from functools import wraps
 from django.utils.translation import ugettext as _
 from django.core.exceptions import PermissionDenied
 from django.http import (HttpResponse, HttpResponseBadRequest,
-                         HttpResponseRedirect)
+                         HttpResponseRedirect, Http404)
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ValidationError
 from django.views.decorators.http import require_http_methods
@@ -19,21 +19,28 @@ from django_tinsel.utils import decorate as do
 from django_tinsel.decorators import json_api_call
 
 from treemap.util import (LazyEncoder, add_visited_instance,
-                          get_instance_or_404, login_redirect,
-                          can_read_as_super_admin)
+                          login_redirect, can_read_as_super_admin)
+from treemap.lib.object_caches import instance_by_url_name
 from treemap.exceptions import FeatureNotEnabledException
 
 
 def instance_request(view_fn, redirect=True):
     @wraps(view_fn)
     def wrapper(request, instance_url_name, *args, **kwargs):
-        instance = get_instance_or_404(url_name=instance_url_name)
+        from treemap.models import Instance
+
+        try:
+            instance, has_itree_region = instance_by_url_name(
+                instance_url_name)
+        except Instance.DoesNotExist:
+            raise Http404('No Instance matches the given query.')
+
         # Include the instance as both a request property and as an
         # view function argument for flexibility and to keep "template
         # only" requests simple.
         request.instance = instance
 
-        request.instance_supports_ecobenefits = instance.has_itree_region()
+        request.instance_supports_ecobenefits = has_itree_region
 
         user = request.user
         if user.is_authenticated():
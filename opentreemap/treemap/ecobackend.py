@@ -3,10 +3,14 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import division
 
-import urllib2
-import urllib
+import httplib
 import json
 import re
+import socket
+import threading
+import time
+import urllib
+import urlparse
 
 from django.conf import settings
 from django.contrib.gis.db.backends.postgis.adapter import PostGISAdapter
@@ -50,8 +54,6 @@ ECOBENEFIT_ERRORS = {
 
 
 def json_benefits_call(endpoint, params, post=False, convert_params=True):
-    url = "%s/%s" % (settings.ECO_SERVICE_URL, endpoint)
-
     if post:
         if convert_params:
             paramdata = {}
@@ -82,16 +84,14 @@ def json_benefits_call(endpoint, params, post=False, convert_params=True):
             data = json.dumps(paramdata)
         else:
             data = json.dumps(params)
-        req = urllib2.Request(url,
-                              data,
-                              {'Content-Type': 'application/json'})
+        method = 'POST'
+        query = ''
     else:
-        paramString = "&".join(["%s=%s" % (urllib.quote_plus(str(name)),
-                                           urllib.quote_plus(str(val)))
-                                for (name, val) in params])
-
-        # A get request is assumed by urllib2
-        req = url + '?' + paramString
+        data = None
+        method = 'GET'
+        query = "&".join(["%s=%s" % (urllib.quote_plus(str(name)),
+                                     urllib.quote_plus(str(val)))
+                          for (name, val) in params])
 
     # the caller decides if it wants to raise the error
     # as an exception, or return it as a status code on
@@ -99,17 +99,291 @@ def json_benefits_call(endpoint, params, post=False, convert_params=True):
     # return this string, and never raise.
     general_unhandled_struct = (None, UNKNOWN_ECOBENEFIT_ERROR)
 
+    client = _get_client()
+
+    if not client.breaker.allows_request():
+        logger.warning("ECOBENEFIT FAILURE: circuit open, not calling %s"
+                       % endpoint)
+        return general_unhandled_struct
+
     try:
-        return (json.loads(urllib2.urlopen(req).read()), None)
-    except urllib2.HTTPError as e:
-        error_body = e.fp.read()
-        logger.warning("ECOBENEFIT FAILURE: " + error_body)
-        for code, patterns in ECOBENEFIT_ERRORS.items():
-            for pattern in patterns:
-                match = re.match(pattern, error_body)
-                if match:
-                    return (None, code)
-        else:
-            return general_unhandled_struct
-    except urllib2.URLError:
+        return _call_ecoservice(client, method, endpoint, query, data)
+    finally:
+        # If the call raised an unexpected error, let another trial
+        # request through rather than leaving the breaker open for good
+        client.breaker.end_trial()
+
+
+def _call_ecoservice(client, method, endpoint, query, data):
+    general_unhandled_struct = (None, UNKNOWN_ECOBENEFIT_ERROR)
+
+    start = time.time()
+    try:
+        status, body = client.request(method, endpoint, query, data)
+    except (httplib.HTTPException, socket.error) as e:
+        client.breaker.record_failure()
+        logger.warning("ECOBENEFIT FAILURE: %s %s" % (endpoint, e))
         return general_unhandled_struct
+    finally:
+        _record_latency(endpoint, time.time() - start)
+
+    if status < 400:
+        client.breaker.record_success()
+        return (json.loads(body), None)
+
+    logger.warning("ECOBENEFIT FAILURE: " + body)
+    for code, patterns in ECOBENEFIT_ERRORS.items():
+        for pattern in patterns:
+            match = re.match(pattern, body)
+            if match:
+                # The service is working, it just can't handle this request
+                client.breaker.record_success()
+                return (None, code)
+
+    if status >= 500:
+        client.breaker.record_failure()
+    else:
+        client.breaker.record_success()
+
+    return general_unhandled_struct
+
+
+def latency_histograms():
+    """
+    Returns a dict mapping each ecoservice endpoint called by this process
+    to a histogram of the time taken by those calls
+    """
+    with _histograms_lock:
+        return {endpoint: histogram.as_dict()
+                for endpoint, histogram in _histograms.iteritems()}
+
+
+def reset_latency_histograms():
+    with _histograms_lock:
+        _histograms.clear()
+
+
+def circuit_breaker_state():
+    return _get_client().breaker.state
+
+
+class LatencyHistogram(object):
+    """
+    Counts observed durations (in seconds) in buckets with the given upper
+    bounds. Bucket counts are cumulative, so each bucket includes every
+    observation less than or equal to its bound.
+    """
+    def __init__(self, bounds):
+        self.bounds = sorted(bounds)
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(self.bounds):
+            if seconds <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def as_dict(self):
+        buckets = [[bound, count]
+                   for bound, count in zip(self.bounds, self.counts)]
+        buckets.append(['+Inf', self.count])
+
+        return {'buckets': buckets,
+                'count': self.count,
+                'sum': self.sum}
+
+
+class CircuitBreaker(object):
+    """
+    Stops calls to a failing service.
+
+    After failure_threshold consecutive failures the breaker opens and
+    rejects requests for reset_timeout seconds. It then lets a single
+    trial request through ("half open"), closing again if it succeeds
+    and reopening if it fails.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return CircuitBreaker.CLOSED
+        elif time.time() - self.opened_at >= self.reset_timeout:
+            return CircuitBreaker.HALF_OPEN
+        else:
+            return CircuitBreaker.OPEN
+
+    def allows_request(self):
+        with self._lock:
+            state = self.state
+            if state == CircuitBreaker.CLOSED:
+                return True
+            elif state == CircuitBreaker.HALF_OPEN \
+                    and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return True
+            else:
+                return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_progress or \
+                    self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+            self._trial_in_progress = False
+
+    def end_trial(self):
+        with self._lock:
+            self._trial_in_progress = False
+
+
+class _EcoserviceClient(object):
+    """
+    Makes requests to the ecoservice over a pool of persistent
+    connections, with separate connect and read timeouts
+    """
+    def __init__(self, url, pool_size, connect_timeout, read_timeout,
+                 breaker):
+        parsed = urlparse.urlparse(url)
+        if parsed.scheme == 'https':
+            self.connection_class = httplib.HTTPSConnection
+        else:
+            self.connection_class = httplib.HTTPConnection
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path.rstrip('/')
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.breaker = breaker
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def request(self, method, endpoint, query, data):
+        path = '%s/%s' % (self.path, endpoint)
+        if query:
+            path += '?' + query
+        path = path.encode('utf-8')
+
+        headers = {'Content-Type': 'application/json'}
+
+        conn, reused = self._get_connection()
+        try:
+            return self._request(conn, method, path, data, headers)
+        except (httplib.HTTPException, socket.error) as e:
+            conn.close()
+
+            # The service may have closed an idle connection, so retry
+            # once with a fresh one (but not after a timeout, since the
+            # service is probably just slow)
+            if not reused or isinstance(e, socket.timeout):
+                raise
+
+        conn = self._new_connection()
+        try:
+            return self._request(conn, method, path, data, headers)
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            raise
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def _request(self, conn, method, path, data, headers):
+        conn.request(method, path, data, headers)
+        response = conn.getresponse()
+        body = response.read()
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release_connection(conn)
+
+        return (response.status, body)
+
+    def _get_connection(self):
+        with self._lock:
+            if self._idle:
+                return (self._idle.pop(), True)
+        return (self._new_connection(), False)
+
+    def _new_connection(self):
+        conn = self.connection_class(self.host, self.port,
+                                     timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def _release_connection(self, conn):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def _get_client():
+    global _client
+
+    config = (settings.ECO_SERVICE_URL,
+              settings.ECO_SERVICE_POOL_SIZE,
+              settings.ECO_SERVICE_CONNECT_TIMEOUT,
+              settings.ECO_SERVICE_READ_TIMEOUT,
+              settings.ECO_SERVICE_FAILURE_THRESHOLD,
+              settings.ECO_SERVICE_RESET_TIMEOUT)
+
+    with _client_lock:
+        # Settings may change in tests, in which case start over
+        if _client is None or _client.config != config:
+            if _client is not None:
+                _client.close()
+
+            url, pool_size, connect_timeout, read_timeout, \
+                failure_threshold, reset_timeout = config
+
+            breaker = CircuitBreaker(failure_threshold, reset_timeout)
+            _client = _EcoserviceClient(url, pool_size, connect_timeout,
+                                        read_timeout, breaker)
+            _client.config = config
+
+        return _client
+
+
+def _record_latency(endpoint, seconds):
+    with _histograms_lock:
+        histogram = _histograms.get(endpoint)
+        if histogram is None:
+            histogram = LatencyHistogram(
+                settings.ECO_SERVICE_LATENCY_BUCKETS)
+            _histograms[endpoint] = histogram
+        histogram.observe(seconds)
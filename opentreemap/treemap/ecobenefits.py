@@ -3,20 +3,40 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import division
 
+import math
+
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.gis.geos.point import Point
+from django.core.exceptions import PermissionDenied
 from django.db import connection
 
 from django_tinsel.decorators import json_api_call
-import itertools
 
-from treemap import ecobackend
+from treemap import ecobackend, ecoengine
+from treemap.lib import (benefit_aggregates, benefit_caches,
+                         benefit_sampling, itree_region_index)
 from treemap.models import MapFeature
 
 WATTS_PER_BTU = 0.29307107
 GAL_PER_CUBIC_M = 264.172052
 LBS_PER_KG = 2.20462
 
+# Selects the code of the i-Tree region containing a tree's plot, for use
+# in an extra() clause on a Tree queryset joined to its plot
+_PLOT_REGION_SQL = (
+    'SELECT code FROM treemap_itreeregion '
+    'WHERE ST_Contains(treemap_itreeregion.geometry, '
+    'treemap_mapfeature.the_geom_webmercator) LIMIT 1')
+
+# Limits a Tree queryset joined to its plot to trees in an i-Tree region,
+# for use in an extra() clause with the region code as a parameter
+_PLOT_IN_REGION_SQL = (
+    'ST_Contains((SELECT geometry FROM treemap_itreeregion '
+    'WHERE code = %s), treemap_mapfeature.the_geom_webmercator)')
+
 
 class BenefitCategory(object):
     ENERGY = 'energy'
@@ -66,19 +86,41 @@ class BenefitCalculator(object):
     that basis groups are summed across all eco benefits returned
     so your additional keys should be numbers
 
+    Summaries estimated from a sample come with a margins dictionary,
+    which has the half-width of the confidence interval (at
+    benefit_sampling.CONFIDENCE_LEVEL) of each estimated benefit:
+    { group-name:
+      { name-of-benefit:
+          { 'value': margin,
+            'currency': margin [or None]
+          },
+          ...
+      },
+      ...
+    }
+    Exact summaries have an empty margins dictionary.
+
     benefits_for_filter returns a tuple:
-    (dict from above, basis dict)
+    (dict from above, basis dict, margins dict)
 
     benefits_for_object returns a tuple of:
     (dict from above, basis dict, error [or None])
     """
 
     def benefits_for_filter(self, instance, item_filter):
-        return {}
+        return ({}, {}, {})
 
     def benefits_for_object(self, instance, obj):
         return {}
 
+    def benefits_for_objects(self, instance, objs):
+        """
+        Returns a list with the result of benefits_for_object for each
+        object. Subclasses should override this to avoid computing the
+        benefits of each object separately.
+        """
+        return [self.benefits_for_object(instance, obj) for obj in objs]
+
 
 class TreeBenefitsCalculator(BenefitCalculator):
     def _make_sql_from_query(self, query):
@@ -90,13 +132,23 @@ class TreeBenefitsCalculator(BenefitCalculator):
         from treemap.models import Tree
 
         trees = item_filter.get_objects(Tree)
-        n_total_trees = trees.count()
 
         if not instance.has_itree_region():
             basis = {'plot':
                      {'n_objects_used': 0,
-                      'n_objects_discarded': n_total_trees}}
-            return ({}, basis)
+                      'n_objects_discarded':
+                      item_filter.get_object_count(Tree)}}
+            return ({}, basis, {})
+
+        # Unfiltered and single boundary searches are answered from
+        # the incrementally maintained totals for the instance
+        aggregate = benefit_aggregates.get_aggregate_for_filter(
+            item_filter, self.raw_benefits_for_trees)
+
+        if aggregate is not None:
+            n_total_trees = aggregate.n_trees_total
+        else:
+            n_total_trees = item_filter.get_object_count(Tree)
 
         if n_total_trees == 0:
             basis = {'plot':
@@ -104,17 +156,181 @@ class TreeBenefitsCalculator(BenefitCalculator):
                       'n_objects_discarded': n_total_trees}}
             empty_rslt = self._compute_currency_and_transform_units(
                 instance, {})
-            return (empty_rslt, basis)
+            return (empty_rslt, basis, {})
+
+        # Summaries of very large searches are estimated from a sample
+        sample = (aggregate is None and
+                  benefit_sampling.should_sample(n_total_trees))
 
+        if sample:
+            return self._sampled_benefits_for_trees(
+                instance, trees, n_total_trees)
+
+        if aggregate is not None:
+            benefits = dict(aggregate.benefits)
+            n_computed_trees = aggregate.n_trees_computed
+        else:
+            rawb, err = self.raw_benefits_for_trees(instance, trees)
+
+            if err:
+                raise Exception(err)
+
+            benefits = rawb['Benefits']
+
+            if 'n_trees' in benefits:
+                n_computed_trees = int(benefits['n_trees'])
+            else:
+                n_computed_trees = 1
+
+        # Extrapolate an average over the rest of the urban forest
+        if n_computed_trees > 0 and n_total_trees > 0:
+            percent = float(n_computed_trees) / n_total_trees
+            for key in benefits:
+                benefits[key] /= percent
+
+        rslt = self._compute_currency_and_transform_units(instance, benefits)
+
+        basis = {'plot':
+                 {'n_objects_used': n_computed_trees,
+                  'n_objects_discarded': n_total_trees - n_computed_trees}}
+
+        return (rslt, basis, {})
+
+    def raw_benefits_for_trees(self, instance, trees):
+        """
+        Returns a tuple of (raw benefits, error) for a Tree queryset, in
+        the same form as a call to the 'eco_summary.json' endpoint
+        """
+        region_code = self._single_region_code(instance)
+        trees_with_data = self._trees_with_data(instance, trees)
+
+        if ecoengine.use_local_engine():
+            return self._local_benefits_for_trees(
+                instance, trees_with_data, region_code)
+        else:
+            return self._ecoservice_benefits_for_trees(
+                instance, trees_with_data, region_code)
+
+    def _single_region_code(self, instance):
         # When calculating benefits we can skip region information
         # if there is only one intersecting region or if the
         # instance forces a region on us
         region_codes = instance.itree_region_codes()
         if len(region_codes) == 1:
-            region_code = region_codes[0]
+            return region_codes[0]
         else:
-            region_code = None
+            return None
+
+    def _trees_with_data(self, instance, trees):
+        # We use two extra instance filter to help out
+        # the database a bit when doing the joins
+        return trees.filter(species__isnull=False)\
+                    .filter(diameter__isnull=False)\
+                    .filter(plot__instance=instance)\
+                    .filter(species__instance=instance)
+
+    def _sampled_benefits_for_trees(self, instance, trees, n_total_trees):
+        """
+        Returns a tuple of (benefits, basis, margins) for a Tree queryset,
+        estimated from the benefits of a sample of the trees
+        """
+        estimates, margins, n_computed_trees = \
+            self._estimate_totals_per_tree(instance, trees, n_total_trees)
+
+        # The conversions are linear, so the totals of the converted
+        # values can be filled in to the result for no trees
+        rslt = self._compute_currency_and_transform_units(instance, {})
+        rslt_margins = {'plot': {}}
+
+        for group, benefit in rslt['plot'].iteritems():
+            rslt_margins['plot'][group] = {}
+
+            for field in ('value', 'currency'):
+                key = '%s.%s' % (group, field)
+                estimate = estimates.get(key, 0)
+
+                if field == 'currency' and not estimate:
+                    benefit[field] = None
+                    rslt_margins['plot'][group][field] = None
+                else:
+                    benefit[field] = estimate
+                    rslt_margins['plot'][group][field] = margins.get(key, 0)
+
+        basis = {'plot':
+                 {'n_objects_used': n_computed_trees,
+                  'n_objects_discarded': n_total_trees - n_computed_trees}}
+
+        return (rslt, basis, rslt_margins)
+
+    def _estimate_totals_per_tree(self, instance, trees, n_total_trees):
+        trees = self._trees_with_data(instance, trees)\
+                    .select_related('species')
+
+        if not instance.itree_region_default:
+            trees = trees.extra(select={'region_code': _PLOT_REGION_SQL})
 
+        def values_for_trees(sample):
+            if instance.itree_region_default:
+                for tree in sample:
+                    tree.region_code = instance.itree_region_default
+
+            trees_and_regions = [(tree, tree.region_code) for tree in sample
+                                 if tree.region_code]
+
+            raw_benefits = self.raw_benefits_for_each_tree(
+                instance, trees_and_regions)
+
+            values_by_tree = {}
+            for (tree, __), (rawb, err) in zip(trees_and_regions,
+                                               raw_benefits):
+                if not err:
+                    rslt = self._compute_currency_and_transform_units(
+                        instance, rawb['Benefits'])
+                    values_by_tree[tree.pk] = _flatten_benefit_groups(rslt)
+
+            return [values_by_tree.get(tree.pk) for tree in sample]
+
+        return benefit_sampling.estimate_totals(
+            trees, n_total_trees, values_for_trees)
+
+    def _ecoservice_benefits_for_trees(self, instance, trees, region_code):
+        if not region_code and settings.ECO_REGION_FAN_OUT_WORKERS > 0:
+            return self._ecoservice_benefits_by_region(instance, trees)
+
+        params = self._eco_summary_params(instance, trees, region_code)
+
+        return ecobackend.json_benefits_call(
+            'eco_summary.json', params.iteritems(), post=True)
+
+    def _ecoservice_benefits_by_region(self, instance, trees):
+        # Rather than have the ecoservice find the region of every tree,
+        # split the trees by region here and summarize each region
+        # separately, in parallel
+        params_list = [
+            self._eco_summary_params(
+                instance,
+                trees.extra(where=[_PLOT_IN_REGION_SQL], params=[code]),
+                code)
+            for code in instance.itree_region_codes()]
+
+        def eco_summary(params):
+            return ecobackend.json_benefits_call(
+                'eco_summary.json', params.iteritems(), post=True)
+
+        # Worker threads only make HTTP requests. The queries are built
+        # above, since database connections can't be shared by threads.
+        results = _map_in_threads(eco_summary, params_list,
+                                  settings.ECO_REGION_FAN_OUT_WORKERS)
+
+        benefits = {}
+        for rawb, err in results:
+            if err:
+                return (None, err)
+            benefits = _sum_dict(benefits, rawb['Benefits'])
+
+        return ({'Benefits': benefits}, None)
+
+    def _eco_summary_params(self, instance, trees, region_code):
         # We want to do a values query that returns the info that
         # we need for an eco calculation:
         # diameter, species id and species code
@@ -129,13 +345,7 @@ class TreeBenefitsCalculator(BenefitCalculator):
         if not region_code:
             values += ('plot__geom',)
 
-        # We use two extra instance filter to help out
-        # the database a bit when doing the joins
-        treeValues = trees.filter(species__isnull=False)\
-                          .filter(diameter__isnull=False)\
-                          .filter(plot__instance=instance)\
-                          .filter(species__instance=instance)\
-                          .values_list(*values)
+        treeValues = trees.values_list(*values)
 
         query = self._make_sql_from_query(treeValues.query)
 
@@ -151,39 +361,104 @@ class TreeBenefitsCalculator(BenefitCalculator):
 
             query = query.replace(targetGeomField, xyGeomFields, 1)
 
-        params = {'query': query,
-                  'instance_id': instance.pk,
-                  'region': region_code or ""}
+        return {'query': query,
+                'instance_id': instance.pk,
+                'region': region_code or ""}
 
-        rawb, err = ecobackend.json_benefits_call(
-            'eco_summary.json', params.iteritems(), post=True)
+    def _local_benefits_for_trees(self, instance, trees, region_code):
+        values = ('diameter',
+                  'species__pk',
+                  'species__otm_code',)
 
-        if err:
-            raise Exception(err)
+        if region_code:
+            rows = ((diameter, species_id, otm_code, region_code)
+                    for diameter, species_id, otm_code
+                    in trees.values_list(*values))
+        else:
+            # Without a single region, let the database find the
+            # region containing each tree
+            rows = trees.extra(select={'region_code': _PLOT_REGION_SQL})\
+                        .values_list(*(values + ('region_code',)))
+
+        engine = ecoengine.get_local_engine()
+        overrides = ecoengine.get_itree_code_overrides(instance)
+
+        return engine.summary_benefits(overrides, rows)
 
-        benefits = rawb['Benefits']
+    def benefits_for_object(self, instance, plot):
+        tree = plot.current_tree()
 
-        if 'n_trees' in benefits:
-            n_computed_trees = int(benefits['n_trees'])
+        if tree is not None and tree.diameter and tree.species:
+            region = tree.itree_region
         else:
-            n_computed_trees = 1
+            region = None
 
-        # Extrapolate an average over the rest of the urban forest
-        if n_computed_trees > 0 and n_total_trees > 0:
-            percent = float(n_computed_trees) / n_total_trees
-            for key in benefits:
-                benefits[key] /= percent
+        if region:
+            raw_benefits = self.raw_benefits_for_tree(instance, tree, region)
+        else:
+            raw_benefits = None
 
-        rslt = self._compute_currency_and_transform_units(instance, benefits)
+        return self._benefits_for_tree(instance, tree, region, raw_benefits)
 
-        basis = {'plot':
-                 {'n_objects_used': n_computed_trees,
-                  'n_objects_discarded': n_total_trees - n_computed_trees}}
+    def benefits_for_objects(self, instance, plots):
+        trees_by_plot = self._current_trees(instance, plots)
 
-        return (rslt, basis)
+        trees_and_regions = [
+            (tree, tree.region_code) for tree in trees_by_plot.values()
+            if tree.diameter and tree.species and tree.region_code]
 
-    def benefits_for_object(self, instance, plot):
-        tree = plot.current_tree()
+        raw_benefits = self.raw_benefits_for_each_tree(
+            instance, trees_and_regions)
+
+        raw_benefits_by_tree = {
+            tree.pk: raw for (tree, __), raw
+            in zip(trees_and_regions, raw_benefits)}
+
+        results = []
+        for plot in plots:
+            tree = trees_by_plot.get(plot.pk)
+            if tree is None:
+                region = raw = None
+            else:
+                region = tree.region_code
+                raw = raw_benefits_by_tree.get(tree.pk)
+
+            results.append(
+                self._benefits_for_tree(instance, tree, region, raw))
+
+        return results
+
+    def _current_trees(self, instance, plots):
+        """
+        Returns a dict mapping plot ids to the plot's current tree, with the
+        code of the tree's i-Tree region in its region_code attribute
+        """
+        from treemap.models import Tree
+
+        trees = Tree.objects.filter(plot__in=[plot.pk for plot in plots])\
+                            .filter(plot__instance=instance)\
+                            .select_related('species')\
+                            .order_by('pk')
+
+        trees_by_plot = {}
+        for tree in trees:
+            trees_by_plot.setdefault(tree.plot_id, tree)
+
+        if instance.itree_region_default:
+            for tree in trees_by_plot.values():
+                tree.region_code = instance.itree_region_default
+        else:
+            # Find the regions in memory, rather than in the database
+            geoms = {plot.pk: plot.geom for plot in plots}
+            trees = trees_by_plot.values()
+            region_codes = itree_region_index.region_codes_for_points(
+                [geoms[tree.plot_id] for tree in trees])
+            for tree, region_code in zip(trees, region_codes):
+                tree.region_code = region_code
+
+        return trees_by_plot
+
+    def _benefits_for_tree(self, instance, tree, region, raw_benefits):
         error = None
 
         if tree is None:
@@ -195,30 +470,18 @@ class TreeBenefitsCalculator(BenefitCalculator):
         elif not tree.species:
             rslt = None
             error = 'MISSING_SPECIES'
+        elif not region:
+            rslt = None
+            error = 'MISSING_REGION'
         else:
-            region = tree.itree_region
-
-            if region:
-                params = {'otmcode': tree.species.otm_code,
-                          'diameter': tree.diameter,
-                          'region': region,
-                          'instanceid': instance.pk,
-                          'speciesid': tree.species.pk}
-
-                rawb, err = ecobackend.json_benefits_call(
-                    'eco.json', params.iteritems())
+            rawb, err = raw_benefits
 
-                if err:
-                    rslt = {'error': err}
-                    error = err
-                else:
-                    benefits = self._compute_currency_and_transform_units(
-                        instance, rawb['Benefits'])
-
-                    rslt = benefits
+            if err:
+                rslt = {'error': err}
+                error = err
             else:
-                rslt = None
-                error = 'MISSING_REGION'
+                rslt = self._compute_currency_and_transform_units(
+                    instance, rawb['Benefits'])
 
         basis = {'plot':
                  {'n_objects_used': 1 if rslt else 0,
@@ -226,6 +489,63 @@ class TreeBenefitsCalculator(BenefitCalculator):
 
         return (rslt, basis, error)
 
+    def raw_benefits_for_tree(self, instance, tree, region):
+        """
+        Returns a tuple of (raw benefits, error) for a tree with a species
+        and diameter, in the same form as a call to the 'eco.json' endpoint
+        """
+        def compute(diameter):
+            return self._tree_benefits(
+                instance, tree.species, diameter, region)
+
+        return benefit_caches.get_tree_benefits(
+            instance, tree.species, tree.diameter, region, compute)
+
+    def raw_benefits_for_each_tree(self, instance, trees_and_regions):
+        """
+        Returns a list with a tuple of (raw benefits, error) for each
+        (tree, region code) tuple, in the same form as a call to the
+        'eco.json' endpoint, computed together
+        """
+        def compute_many(requests):
+            if ecoengine.use_local_engine():
+                rows = [(diameter, species.pk, species.otm_code, region)
+                        for species, diameter, region in requests]
+
+                return ecoengine.get_local_engine().trees_benefits(
+                    ecoengine.get_itree_code_overrides(instance), rows)
+            else:
+                # The ecoservice computes one tree per request, so make
+                # the requests in parallel over its connection pool
+                def tree_benefits(request):
+                    species, diameter, region = request
+                    return self._tree_benefits(
+                        instance, species, diameter, region)
+
+                return _map_in_threads(tree_benefits, requests,
+                                       settings.ECO_SERVICE_POOL_SIZE)
+
+        return benefit_caches.get_many_tree_benefits(
+            instance,
+            [(tree.species, tree.diameter, region)
+             for tree, region in trees_and_regions],
+            compute_many)
+
+    def _tree_benefits(self, instance, species, diameter, region):
+        if ecoengine.use_local_engine():
+            return ecoengine.get_local_engine().tree_benefits(
+                ecoengine.get_itree_code_overrides(instance),
+                species.pk, species.otm_code, diameter, region)
+        else:
+            params = {'otmcode': species.otm_code,
+                      'diameter': diameter,
+                      'region': region,
+                      'instanceid': instance.pk,
+                      'speciesid': species.pk}
+
+            return ecobackend.json_benefits_call(
+                'eco.json', params.iteritems())
+
     def _compute_currency_and_transform_units(self, instance, benefits):
 
         hydrofactors = ['hydro_interception']
@@ -322,6 +642,30 @@ def _sum_dict(d1, d2):
     return dsum
 
 
+def _flatten_benefit_groups(rslt):
+    # Returns the values and currencies of the benefit groups of a
+    # result as a single dict, with keys like 'energy.value'
+    values = {}
+    for group, benefit in rslt['plot'].iteritems():
+        values['%s.value' % group] = benefit['value']
+        values['%s.currency' % group] = benefit['currency'] or 0
+
+    return values
+
+
+def _map_in_threads(fn, items, max_threads):
+    n_threads = min(max_threads, len(items))
+
+    if n_threads <= 1:
+        return map(fn, items)
+
+    pool = ThreadPool(n_threads)
+    try:
+        return pool.map(fn, items)
+    finally:
+        pool.close()
+
+
 def _benefits_for_class(cls, filter):
     benefits_fn = cls.benefits.benefits_for_filter
 
@@ -367,6 +711,22 @@ def _combine_grouped_benefits(benefits, new_benefit_groups):
                 bgroup[ft_benefit_key] = ft_benefit
 
 
+def _combine_margins(margins, new_margin_groups):
+    # The margins of independent estimates add in quadrature
+    for group, ft_margins in new_margin_groups.iteritems():
+        mgroup = margins.setdefault(group, {})
+
+        for ft_benefit_key, ft_margin in ft_margins.iteritems():
+            existing_margin = mgroup.setdefault(ft_benefit_key, {})
+
+            for field, margin in ft_margin.iteritems():
+                existing = existing_margin.get(field)
+                if existing is None:
+                    existing_margin[field] = margin
+                elif margin is not None:
+                    existing_margin[field] = math.hypot(existing, margin)
+
+
 def _annotate_basis_with_extra_stats(basis):
     # Basis groups just have # calc and # discarded
     # annotate with some more info
@@ -382,31 +742,45 @@ def _annotate_basis_with_extra_stats(basis):
 
 
 def get_benefits_for_filter(filter):
+    return benefit_caches.get_filter_benefits(
+        filter, lambda: _compute_benefits_for_filter(filter))
+
+
+def _compute_benefits_for_filter(filter):
     allowed_types = filter.instance.map_feature_types
-    benefits, basis = {}, {}
+    benefits, basis, margins = {}, {}, {}
 
     for C in MapFeature.subclass_dict().values():
         if not hasattr(C, 'benefits') or C.__name__ not in allowed_types:
             continue
 
-        ft_benefit_groups, ft_basis = _benefits_for_class(C, filter)
+        ft_benefit_groups, ft_basis, ft_margins = \
+            _benefits_for_class(C, filter)
 
         _combine_benefit_basis(basis, ft_basis)
         _combine_grouped_benefits(benefits, ft_benefit_groups)
+        _combine_margins(margins, ft_margins)
 
     _annotate_basis_with_extra_stats(basis)
 
-    return benefits, basis
+    return benefits, basis, margins
 
 
 def within_itree_regions(request):
-    from treemap.models import ITreeRegion
     x = request.GET.get('x', None)
     y = request.GET.get('y', None)
     return (bool(x) and bool(y) and
-            ITreeRegion.objects
-            .filter(geometry__contains=Point(float(x),
-                                             float(y))).exists())
+            bool(itree_region_index.region_codes_containing(
+                Point(float(x), float(y), srid=3857))))
+
+
+def eco_service_stats(request):
+    if not request.user.is_superuser:
+        raise PermissionDenied
+
+    return {'latency': ecobackend.latency_histograms(),
+            'circuit_breaker': ecobackend.circuit_breaker_state()}
+
 
 benefit_labels = {
     # Translators: 'Energy conserved' is the name of an eco benefit
@@ -422,32 +796,5 @@ benefit_labels = {
 }
 
 
-_itree_codes_by_region = None
-_all_itree_codes = None
-
-
-def all_itree_codes():
-    _ensure_itree_codes_fetched()
-    return _all_itree_codes
-
-
-def has_itree_code(region_code, itree_code):
-    _ensure_itree_codes_fetched()
-    has = itree_code in _itree_codes_by_region.get(region_code, [])
-    return has
-
-
-def _ensure_itree_codes_fetched():
-    global _itree_codes_by_region, _all_itree_codes
-    if _itree_codes_by_region is None:
-        result, err = ecobackend.json_benefits_call('itree_codes.json', {})
-        if err:
-            raise Exception('Failed to retrieve i-Tree codes from ecoservice')
-
-        _itree_codes_by_region = result['Codes']
-
-        _all_itree_codes = set(
-            itertools.chain(*_itree_codes_by_region.values()))
-
-
 within_itree_regions_view = json_api_call(within_itree_regions)
+eco_service_stats_view = json_api_call(eco_service_stats)
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import json
+import os
+
+import numpy as np
+
+from django.conf import settings
+
+from treemap.ecobackend import BAD_CODE_PAIR
+from treemap.species.codes import get_itree_code, otm_codes_by_itree_code
+
+# An in-process replacement for the HTTP ecoservice.
+#
+# The engine loads the i-Tree lookup tables once per process and computes
+# benefits for whole columns of trees with array math, so summaries no
+# longer require a network round trip and a second table scan inside the
+# ecoservice.
+#
+# The data directory contains one JSON file per i-Tree region, named
+# <region code>.json, with the following format:
+#
+#   {
+#     "dbh_breakpoints": [cm, cm, ...],
+#     "species": {
+#       itree_code: {
+#         factor: [value at each breakpoint, ...],
+#         ...
+#       },
+#       ...
+#     }
+#   }
+#
+# Factors are the keys returned by the ecoservice in its "Benefits"
+# dictionary (e.g. "electricity", "co2_storage", "hydro_interception").
+# Values between breakpoints are linearly interpolated and values outside
+# of the breakpoints are clamped, matching the ecoservice.
+#
+# The files are generated from the ecoservice with the export_eco_tables
+# management command, which asks it for the benefits of every i-Tree code
+# of each region at each breakpoint, and then checks the interpolated
+# values against the ecoservice's at diameters between the breakpoints.
+
+CM_PER_INCH = 2.54
+
+# i-Tree Streets computes benefits for trees in DBH classes of 0-3, 3-6,
+# 6-12, 12-18, 18-24, 24-30, 30-36, 36-42 and over 42 inches, so tables
+# are exported with a breakpoint in the middle of each class
+ITREE_DBH_CLASS_MIDPOINTS_CM = [3.81, 11.43, 22.86, 38.1, 53.34, 68.58,
+                                83.82, 99.06, 114.3]
+
+ECOSERVICE = 'ecoservice'
+LOCAL = 'local'
+
+
+class LocalEcoEngine(object):
+    def __init__(self, region_tables):
+        self.factors = sorted({factor
+                               for table in region_tables.values()
+                               for factors in table['species'].values()
+                               for factor in factors})
+
+        # For each region, the breakpoints and a table with the shape
+        # (i-Tree codes, factors, breakpoints)
+        self._breakpoints = {}
+        self._tables = {}
+        self._row_for_code = {}
+
+        for region, table in region_tables.iteritems():
+            breakpoints = np.asarray(table['dbh_breakpoints'], dtype=float)
+            species = table['species']
+
+            values = np.zeros(
+                (len(species), len(self.factors), len(breakpoints)))
+            rows = {}
+
+            for row, (itree_code, factors) in enumerate(species.iteritems()):
+                rows[itree_code] = row
+                for i, factor in enumerate(self.factors):
+                    if factor in factors:
+                        values[row, i, :] = factors[factor]
+
+            self._breakpoints[region] = breakpoints
+            self._tables[region] = values
+            self._row_for_code[region] = rows
+
+    @classmethod
+    def from_directory(cls, path):
+        region_tables = {}
+        for filename in os.listdir(path):
+            region, ext = os.path.splitext(filename)
+            if ext == '.json':
+                with open(os.path.join(path, filename)) as f:
+                    region_tables[region] = json.load(f)
+
+        return cls(region_tables)
+
+    def has_region(self, region_code):
+        return region_code in self._tables
+
+    def breakpoints(self, region_code):
+        return self._breakpoints[region_code].tolist()
+
+    def tree_benefits(self, overrides, species_id, otm_code, diameter,
+                      region_code):
+        """
+        Returns a tuple of (benefits, error) in the same form as a call to
+        the 'eco.json' endpoint of the ecoservice
+        """
+        return self.trees_benefits(
+            overrides, [(diameter, species_id, otm_code, region_code)])[0]
+
+    def trees_benefits(self, overrides, tree_rows):
+        """
+        Returns a list with a tuple of (benefits, error) for each tree, in
+        the same form as a call to the 'eco.json' endpoint of the
+        ecoservice, computed all at once
+
+        tree_rows is a sequence of (diameter, species id, otm code, region)
+        """
+        results = [(None, BAD_CODE_PAIR)] * len(tree_rows)
+
+        for indexes, values in self._compute(overrides, tree_rows):
+            for index, tree_values in zip(indexes, values.tolist()):
+                benefits = dict(zip(self.factors, tree_values))
+                results[index] = ({'Benefits': benefits}, None)
+
+        return results
+
+    def summary_benefits(self, overrides, tree_rows):
+        """
+        Returns a tuple of (benefits, error) in the same form as a call to
+        the 'eco_summary.json' endpoint of the ecoservice
+
+        tree_rows is an iterable of (diameter, species id, otm code, region)
+        """
+        totals = np.zeros(len(self.factors))
+        n_trees = 0
+
+        for indexes, values in self._compute(overrides, tree_rows):
+            totals += values.sum(axis=0)
+            n_trees += len(indexes)
+
+        benefits = dict(zip(self.factors, totals.tolist()))
+        benefits['n_trees'] = n_trees
+
+        return ({'Benefits': benefits}, None)
+
+    def _compute(self, overrides, tree_rows):
+        """
+        Yields a tuple of (row indexes, values) for each region, where
+        values has the shape (trees, factors). Trees without a diameter or
+        i-Tree code are skipped.
+        """
+        # Split the trees into one (indexes, rows, diameters) column
+        # triple per region, since each region has its own table and
+        # breakpoints
+        columns = {}
+
+        for index, (diameter, species_id, otm_code, region_code) \
+                in enumerate(tree_rows):
+            rows = self._row_for_code.get(region_code)
+            if rows is None or not diameter:
+                continue
+
+            itree_code = overrides.get((species_id, region_code)) or \
+                get_itree_code(region_code, otm_code)
+
+            row = rows.get(itree_code)
+            if row is not None:
+                region_indexes, region_rows, region_diameters = \
+                    columns.setdefault(region_code, ([], [], []))
+                region_indexes.append(index)
+                region_rows.append(row)
+                region_diameters.append(diameter)
+
+        for region_code, (indexes, rows, diameters) in columns.iteritems():
+            diameters_cm = np.asarray(diameters, dtype=float) * CM_PER_INCH
+            values = self._interpolate(region_code, np.asarray(rows),
+                                       diameters_cm)
+            yield indexes, values
+
+    def _interpolate(self, region_code, rows, diameters_cm):
+        breakpoints = self._breakpoints[region_code]
+        table = self._tables[region_code]
+
+        n_breakpoints = len(breakpoints)
+        if n_breakpoints == 1:
+            return table[rows, :, 0]
+
+        lower = np.searchsorted(breakpoints, diameters_cm, side='right') - 1
+        lower = np.clip(lower, 0, n_breakpoints - 2)
+        upper = lower + 1
+
+        span = breakpoints[upper] - breakpoints[lower]
+        weight = np.clip((diameters_cm - breakpoints[lower]) / span, 0, 1)
+
+        # Both have the shape (trees, factors)
+        lower_values = table[rows, :, lower]
+        upper_values = table[rows, :, upper]
+
+        return lower_values + \
+            (upper_values - lower_values) * weight[:, np.newaxis]
+
+
+def export_region_table(region_code, tree_benefits,
+                        breakpoints=ITREE_DBH_CLASS_MIDPOINTS_CM):
+    """
+    Returns a tuple of (table, i-Tree codes which failed) for a region, with
+    the table in the format read by LocalEcoEngine
+
+    tree_benefits is called with (otm code, diameter in inches, region
+    code) for each i-Tree code of the region at each breakpoint, and
+    returns a tuple of (benefits, error) in the same form as a call to the
+    'eco.json' endpoint of the ecoservice
+    """
+    species = {}
+    failed = []
+
+    for itree_code, otm_code in \
+            sorted(otm_codes_by_itree_code(region_code).iteritems()):
+        factors = {}
+        for breakpoint in breakpoints:
+            rawb, error = tree_benefits(
+                otm_code, breakpoint / CM_PER_INCH, region_code)
+            if error:
+                failed.append(itree_code)
+                break
+
+            for factor, value in rawb['Benefits'].iteritems():
+                factors.setdefault(factor, []).append(value)
+        else:
+            species[itree_code] = factors
+
+    table = {'dbh_breakpoints': list(breakpoints),
+             'species': species}
+
+    return (table, failed)
+
+
+def diameters_between_breakpoints(breakpoints):
+    """
+    Returns the diameters in inches halfway between each pair of
+    breakpoints, and below and above the outer ones, at which interpolated
+    values can be checked against the ecoservice
+    """
+    diameters_cm = [breakpoints[0] / 2] + \
+        [(lower + upper) / 2
+         for lower, upper in zip(breakpoints, breakpoints[1:])] + \
+        [breakpoints[-1] * 1.5]
+
+    return [diameter / CM_PER_INCH for diameter in diameters_cm]
+
+
+def compare_with_ecoservice(engine, region_code, tree_benefits, diameters,
+                            tolerance):
+    """
+    Returns a list of (otm code, diameter, factor, ecoservice value, engine
+    value) for each benefit which the engine computes differently from
+    tree_benefits by more than the relative tolerance
+
+    tree_benefits is called like it is by export_region_table
+    """
+    differences = []
+
+    for __, otm_code in \
+            sorted(otm_codes_by_itree_code(region_code).iteritems()):
+        for diameter in diameters:
+            expected, error = tree_benefits(otm_code, diameter, region_code)
+            if error:
+                continue
+
+            actual, error = engine.tree_benefits(
+                {}, None, otm_code, diameter, region_code)
+            actual = actual['Benefits'] if actual else {}
+
+            for factor, value in expected['Benefits'].iteritems():
+                computed = actual.get(factor)
+                if computed is None or \
+                        abs(computed - value) > tolerance * abs(value):
+                    differences.append(
+                        (otm_code, diameter, factor, value, computed))
+
+    return differences
+
+
+def get_itree_code_overrides(instance):
+    """
+    Returns a dict mapping (species id, region code) to the i-Tree code
+    overrides defined for the instance
+    """
+    from treemap.models import ITreeCodeOverride
+
+    overrides = ITreeCodeOverride.objects \
+        .filter(instance_species__instance=instance) \
+        .values_list('instance_species_id', 'region__code', 'itree_code')
+
+    return {(species_id, region_code): itree_code
+            for species_id, region_code, itree_code in overrides}
+
+
+_engine = None
+
+
+def get_local_engine():
+    global _engine
+    if _engine is None:
+        _engine = LocalEcoEngine.from_directory(
+            settings.ECO_LOCAL_ENGINE_DATA_DIR)
+
+    return _engine
+
+
+def use_local_engine():
+    return settings.ECO_BENEFITS_ENGINE == LOCAL
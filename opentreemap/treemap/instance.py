@@ -20,7 +20,8 @@ from copy import deepcopy
 from treemap.species import SPECIES
 from treemap.species.codes import ITREE_REGIONS
 from treemap.json_field import JSONField
-from treemap.lib.object_caches import udf_defs
+from treemap.lib.config_view import ConfigView
+from treemap.lib.object_caches import udf_defs, increment_adjuncts_timestamp
 from treemap.species.codes import (species_codes_for_regions,
                                    all_species_codes, ITREE_REGION_CHOICES)
 
@@ -247,11 +248,33 @@ class Instance(models.Model):
     itree_region_default = models.CharField(
         max_length=20, null=True, blank=True, choices=ITREE_REGION_CHOICES)
 
+    """
+    Comma-separated codes of the i-Tree regions intersecting "bounds", so
+    that they don't need to be found with a spatial query on each use.
+    None until they are first needed after "bounds" or the i-Tree regions
+    change. Use itree_region_codes() rather than reading this directly.
+    """
+    itree_region_codes_in_bounds = models.TextField(null=True, blank=True)
+
     # Monotonically increasing number used to invalidate my InstanceAdjuncts
     adjuncts_timestamp = models.BigIntegerField(default=0)
 
+    # Incremented whenever one of my ITreeCodeOverrides changes, to
+    # invalidate cached eco benefits (see treemap/lib/benefit_caches.py)
+    eco_override_rev = models.IntegerField(default=0)
+
     objects = models.GeoManager()
 
+    # Fields which are only changed with SQL increments, and so are never
+    # written back by save() (a stale copy would undo an increment)
+    _INCREMENTED_FIELDS = {'geo_rev', 'eco_override_rev',
+                           'adjuncts_timestamp'}
+
+    def __init__(self, *args, **kwargs):
+        super(Instance, self).__init__(*args, **kwargs)
+        self._saved_values = {}
+        self._remember_saved_values()
+
     def __unicode__(self):
         return self.name
 
@@ -282,6 +305,18 @@ class Instance(models.Model):
 
     non_admins_can_export = models.BooleanField(default=True)
 
+    @property
+    def config_view(self):
+        """
+        A ConfigView of values derived from the config, which is kept until
+        the config may have changed
+        """
+        view = self.__dict__.get('_config_view')
+        if view is None or not view.is_current(self.config):
+            view = ConfigView(self.config)
+            self._config_view = view
+        return view
+
     @property
     def advanced_search_fields(self):
         # TODO pull from the config once users have a way to set search fields
@@ -290,6 +325,15 @@ class Instance(models.Model):
             return {'standard': [], 'missing': [], 'display': [],
                     'udfc': self._get_udfc_search_fields()}
 
+        # The memoized fields are shared, so callers get a copy
+        fields = deepcopy(self.config_view.memoized(
+            ('advanced_search_fields', tuple(self.map_feature_types)),
+            self._get_standard_search_fields))
+        fields['udfc'] = self._get_udfc_search_fields()
+
+        return fields
+
+    def _get_standard_search_fields(self):
         from treemap.models import MapFeature  # prevent circular import
 
         fields = {
@@ -341,8 +385,6 @@ class Instance(models.Model):
                 field['id'] = "%s_%s" % (field.get('identifier', ''), num)
                 num += 1
 
-        fields['udfc'] = self._get_udfc_search_fields()
-
         return fields
 
     def _get_udfc_search_fields(self):
@@ -439,6 +481,30 @@ class Instance(models.Model):
 
         return names
 
+    def _remember_saved_values(self, names=None):
+        """
+        Keeps a copy of the values of the named fields (or of all fields),
+        as they were loaded or saved, to find changes to them on save
+        """
+        for field in self._meta.fields:
+            # Deferred fields haven't been loaded
+            if ((names is None or field.name in names) and
+                    field.attname in self.__dict__):
+                self._saved_values[field.name] = \
+                    deepcopy(self.__dict__[field.attname])
+
+    def _changed_fields(self):
+        """
+        Returns the names of the fields which have changed since the
+        instance was loaded or saved
+        """
+        return {field.name for field in self._meta.fields
+                if not field.primary_key and
+                field.attname in self.__dict__ and
+                (field.name not in self._saved_values or
+                 self._saved_values[field.name] !=
+                 self.__dict__[field.attname])}
+
     def update_geo_rev(self):
         qs = Instance.objects.filter(pk=self.id)
 
@@ -449,29 +515,35 @@ class Instance(models.Model):
         self.geo_rev = qs[0].geo_rev
 
     def itree_region_codes(self):
-        from treemap.models import ITreeRegion
-
         if self.itree_region_default:
-            region_codes = [self.itree_region_default]
-        else:
-            region_codes = ITreeRegion.objects \
-                .filter(geometry__intersects=self.bounds) \
-                .values_list('code', flat=True)
+            return [self.itree_region_default]
 
-        return region_codes
+        if self.itree_region_codes_in_bounds is None:
+            self.update_itree_region_codes()
 
-    def itree_regions(self):
+        codes = self.itree_region_codes_in_bounds
+        return codes.split(',') if codes else []
+
+    def update_itree_region_codes(self):
+        """
+        Finds the i-Tree regions intersecting the instance's bounds and
+        stores their codes, without saving any other changes
+        """
         from treemap.models import ITreeRegion  # prevent circular import
-        if self.itree_region_default:
-            codes = [self.itree_region_default]
-        else:
-            codes = (ITreeRegion
-                     .objects
-                     .filter(geometry__intersects=self.bounds)
-                     .values_list('code', flat=True))
 
+        codes = ITreeRegion.objects \
+            .filter(geometry__intersects=self.bounds) \
+            .order_by('code') \
+            .values_list('code', flat=True)
+        self.itree_region_codes_in_bounds = ','.join(codes)
+
+        if self.pk is not None:
+            Instance.objects.filter(pk=self.pk).update(
+                itree_region_codes_in_bounds=self.itree_region_codes_in_bounds)
+
+    def itree_regions(self):
         return [(code, ITREE_REGIONS.get(code, {}).get('name'))
-                for code in codes]
+                for code in self.itree_region_codes()]
 
     def has_itree_region(self):
         return bool(self.itree_regions())
@@ -488,8 +560,9 @@ class Instance(models.Model):
             # If a user is not logged in, trying to check
             # user=user raises a type error so I am checking
             # pk instead
-            self.instanceuser_set.get(user__pk=user.pk)
-            return True
+            if user.pk is None:
+                return False
+            return user.get_instance_user(self) is not None
         except ObjectDoesNotExist:
             return False
 
@@ -609,4 +682,47 @@ class Instance(models.Model):
 
         self.url_name = self.url_name.lower()
 
+        if self._state.adding or kwargs.get('force_insert'):
+            changed = {field.name for field in self._meta.fields}
+            written = None
+        else:
+            changed = self._changed_fields()
+            if kwargs.get('update_fields') is not None:
+                changed &= set(kwargs['update_fields'])
+
+            # Only write what has changed, so that saving a stale copy of
+            # the instance doesn't write back its old values
+            written = changed - self._INCREMENTED_FIELDS
+
+        bounds_changed = 'bounds' in changed
+        region_default_changed = 'itree_region_default' in changed
+
+        if bounds_changed:
+            # Found again when first needed
+            self.itree_region_codes_in_bounds = None
+            if written is not None:
+                written.add('itree_region_codes_in_bounds')
+
+        if written is not None:
+            kwargs['update_fields'] = written
+
         super(Instance, self).save(*args, **kwargs)
+
+        self._remember_saved_values(written)
+
+        if (region_default_changed or
+                (bounds_changed and not self.itree_region_default)):
+            # Benefits are computed for each tree's i-Tree region
+            from treemap.lib.benefit_aggregates import invalidate_aggregates
+            invalidate_aggregates(self.pk)
+
+        # Cached copies of the instance (see object_caches) are only used
+        # while its adjuncts timestamp is unchanged. Their geo_rev is kept
+        # current, and a changed adjuncts timestamp is an explicit request
+        # to reload them.
+        if changed - {'geo_rev', 'eco_override_rev'}:
+            increment_adjuncts_timestamp(self)
+            self.adjuncts_timestamp = Instance.objects\
+                .filter(pk=self.pk)\
+                .values_list('adjuncts_timestamp', flat=True)[0]
+            self._remember_saved_values({'adjuncts_timestamp'})
@@ -11,6 +11,7 @@ var $ = require('jquery'),
 var DATETIME_FORMAT = FH.DATETIME_FORMAT;
 var TREE_MODELS = ['Tree', 'EmptyPlot'];
 var SEARCH_FIELD_SELECTOR = '[data-search-type]';
+var BENEFIT_JOB_POLL_INTERVAL = 2000; // 2s
 
 var isCombinator = function(pred) {
     return _.isArray(pred) && (pred[0] === "OR" || pred[0] === "AND");
@@ -71,6 +72,10 @@ exports._buildElems = buildElems;
 function executeSearch(config, filters) {
     var query = makeQueryStringFromFilters(config, filters);
 
+    if (config.asyncBenefitSummaries) {
+        return executeAsyncSearch(config, query);
+    }
+
     var search = $.ajax({
         url: config.instance.url + 'benefit/search',
         data: query,
@@ -81,6 +86,42 @@ function executeSearch(config, filters) {
     return Bacon.fromPromise(search);
 }
 
+// The summary is computed by a worker, so start a job and poll it until
+// the summary markup is ready
+function executeAsyncSearch(config, query) {
+    var start = $.ajax({
+        url: config.instance.url + 'benefit/search/start',
+        data: query,
+        type: 'GET',
+        dataType: 'json'
+    });
+
+    return Bacon.fromPromise(start)
+        .flatMap(function(job) {
+            return job.status === 'PENDING' ?
+                pollBenefitJob(config, job.job_id) : Bacon.once(job);
+        })
+        .flatMap(function(job) {
+            return job.status === 'COMPLETE' ?
+                Bacon.once(job.html) : new Bacon.Error(job.message);
+        });
+}
+
+function pollBenefitJob(config, jobId) {
+    var url = config.instance.url + 'benefit/search/check/' + jobId + '/';
+
+    return Bacon.fromPoll(BENEFIT_JOB_POLL_INTERVAL, function() {
+            return Bacon.fromPromise($.ajax({
+                url: url,
+                type: 'GET',
+                dataType: 'json'
+            }));
+        })
+        .flatMap(_.identity)
+        .filter(function(job) { return job.status !== 'PENDING'; })
+        .take(1);
+}
+
 function updateSearchResults(newMarkup) {
     var $new = $(newMarkup),
         countsMarkup = $new.filter('#tree-and-planting-site-counts').html(),
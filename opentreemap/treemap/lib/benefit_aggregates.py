@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import logging
+import threading
+
+from contextlib import contextmanager
+from json import loads
+
+from django.conf import settings
+from django.db import transaction, DatabaseError
+from django.db.models import F
+
+from treemap.ecobackend import BAD_CODE_PAIR
+from treemap.lib import itree_region_index
+
+logger = logging.getLogger(__name__)
+
+# Keep raw eco benefit totals for all of the trees in an instance, and for
+# the trees within a boundary, so that unfiltered and single boundary
+# summaries don't require an eco summary over every tree.
+#
+# A BenefitAggregate is built by the first summary which needs it. After
+# that, saving or deleting a tree (or moving or deleting its plot) computes
+# the raw benefits of its trees before and after the change, and adds the
+# difference to the aggregates which contain them, in the same transaction
+# as the change. Within batched_updates, the differences are added when it
+# exits, with the benefits of all of the changed trees computed at once.
+#
+# Changing anything else which affects the benefits of many of the
+# instance's trees (species, i-Tree code overrides, boundaries, the
+# instance's i-Tree region) marks the aggregates stale and queues a celery
+# task which rebuilds them from an eco summary over every tree. So does a
+# failure to compute the benefits of a changed tree, and the rebuild also
+# corrects any drift between the per-tree and summary benefits. Summaries
+# don't use stale aggregates, so they are never out of date.
+#
+# Benefits are stored unconverted, as returned by the ecoservice, so that
+# changing an instance's currency conversions doesn't affect them.
+
+_BOUNDARY_FILTER_KEYS = {'plot.geom', 'mapFeature.geom'}
+
+_batch = threading.local()
+
+
+class BenefitAggregateException(Exception):
+    pass
+
+
+# ------------------------------------------------------------------------
+# Interface functions
+
+
+def get_aggregate_for_filter(filter, compute):
+    """
+    Returns the BenefitAggregate for the trees matching a search.Filter,
+    calling compute(instance, trees) to build it if needed, or None if the
+    filter is not an unfiltered or single boundary search.
+
+    compute must return a tuple of (raw benefits, error) in the same form
+    as a call to the 'eco_summary.json' endpoint.
+    """
+    from treemap.models import BenefitAggregate, Boundary
+
+    if not settings.ECO_BENEFIT_AGGREGATES:
+        return None
+
+    if not _display_filter_includes_all_trees(filter.display_filter):
+        return None
+
+    is_aggregate_filter, boundary_id = _parse_aggregate_filter(
+        filter.filterstr)
+
+    if not is_aggregate_filter:
+        return None
+
+    instance = filter.instance
+
+    if boundary_id is None:
+        boundary = None
+    else:
+        try:
+            boundary = Boundary.objects.get(pk=boundary_id)
+        except (Boundary.DoesNotExist, ValueError, TypeError):
+            # Let the regular search report the bad boundary
+            return None
+
+    aggregate = BenefitAggregate.objects\
+        .filter(instance=instance, boundary=boundary)\
+        .first()
+
+    if aggregate is None:
+        aggregate = _build_aggregate(instance, boundary, compute)
+    elif aggregate.is_stale:
+        # Not usable until a celery worker has rebuilt it
+        return None
+
+    return aggregate
+
+
+def rebuild_stale_aggregates(instance_id, compute):
+    """
+    Rebuilds the instance's stale benefit aggregates, calling
+    compute(instance, trees) as for get_aggregate_for_filter. Run by a
+    celery worker (see treemap.tasks).
+    """
+    from treemap.models import BenefitAggregate, Instance
+
+    instance = Instance.objects.filter(pk=instance_id).first()
+    if instance is None:
+        return
+
+    # Aggregates whose trees changed while they were being rebuilt are
+    # still stale, and are rebuilt again
+    aggregates = _get_stale_aggregates(instance_id)
+    while aggregates:
+        for aggregate in aggregates:
+            try:
+                benefits, n_trees_computed, n_trees_total = _compute_totals(
+                    instance, aggregate.boundary, compute)
+            except (BenefitAggregateException, DatabaseError):
+                logger.exception('Failed to rebuild the benefit aggregates '
+                                 'of instance %s' % instance_id)
+                # The next summary which needs them will build them
+                BenefitAggregate.objects\
+                    .filter(instance_id=instance_id, is_stale=True)\
+                    .delete()
+                raise
+
+            BenefitAggregate.objects\
+                .filter(pk=aggregate.pk, revision=aggregate.revision)\
+                .update(benefits=benefits,
+                        n_trees_computed=n_trees_computed,
+                        n_trees_total=n_trees_total,
+                        is_stale=False)
+
+        aggregates = _get_stale_aggregates(instance_id)
+
+
+@contextmanager
+def batched_updates():
+    """
+    Adds the differences in the benefits of the trees changed in the body
+    of the with statement to the aggregates (or marks them stale) once,
+    when it exits, rather than once for each tree
+    """
+    if getattr(_batch, 'changes', None) is not None:
+        # Already batching
+        yield
+        return
+
+    _batch.changes = {}
+    _batch.stale = set()
+    try:
+        yield
+        changes, stale = _batch.changes, _batch.stale
+    finally:
+        _batch.changes = _batch.stale = None
+
+    for instance_id in stale:
+        invalidate_aggregates(instance_id)
+
+    for instance_id, (instance, instance_changes) in changes.iteritems():
+        # A rebuild includes the changes
+        if instance_id not in stale:
+            _apply_changes(instance, instance_changes)
+
+
+@contextmanager
+def updating_trees(instance, get_trees):
+    """
+    Adds the difference in the benefits of the trees returned by
+    get_trees(), a function returning a Tree queryset, made by the body of
+    the with statement to the instance's aggregates, in the same
+    transaction
+    """
+    from treemap.models import BenefitAggregate
+
+    if not (settings.ECO_BENEFIT_AGGREGATES and
+            BenefitAggregate.objects.filter(instance=instance).exists()):
+        yield
+        return
+
+    with transaction.atomic():
+        before = _snapshot(instance, get_trees())
+        yield
+        after = _snapshot(instance, get_trees())
+
+        if _snapshot_keys(before) == _snapshot_keys(after):
+            return
+
+        changes = [(-1, tree) for tree in before] + \
+                  [(1, tree) for tree in after]
+
+        batched = getattr(_batch, 'changes', None)
+        if batched is not None:
+            batched.setdefault(instance.pk, (instance, []))[1]\
+                   .extend(changes)
+        else:
+            _apply_changes(instance, changes)
+
+
+def invalidate_aggregates(instance_id):
+    """
+    Marks the instance's aggregates stale, and has a celery worker
+    rebuild them
+    """
+    from treemap.models import BenefitAggregate
+
+    if not settings.ECO_BENEFIT_AGGREGATES:
+        return
+
+    stale = getattr(_batch, 'stale', None)
+    if stale is not None:
+        stale.add(instance_id)
+    else:
+        _mark_stale(BenefitAggregate.objects.filter(instance_id=instance_id))
+
+
+def invalidate_itree_code_overrides(*args, **kwargs):
+    # Called by 'save' and 'delete' signal handlers for ITreeCodeOverride
+    override = kwargs['instance']  # 'instance' is a Django term here
+    invalidate_aggregates(override.instance_species.instance_id)
+
+
+def invalidate_species(*args, **kwargs):
+    # Called by 'save' and 'delete' signal handlers for Species, whose
+    # otm_code may have changed
+    species = kwargs['instance']  # 'instance' is a Django term here
+    invalidate_aggregates(species.instance_id)
+
+
+def invalidate_boundary(*args, **kwargs):
+    # Called by the 'save' signal handler for Boundary, whose geometry
+    # may have changed
+    from treemap.models import BenefitAggregate
+    boundary = kwargs['instance']  # 'instance' is a Django term here
+    _mark_stale(BenefitAggregate.objects.filter(boundary=boundary))
+
+
+# ------------------------------------------------------------------------
+# Helpers
+
+
+def _display_filter_includes_all_trees(display_filter):
+    return (display_filter is None
+            or 'Plot' in display_filter
+            or 'Tree' in display_filter)
+
+
+def _parse_aggregate_filter(filterstr):
+    """
+    Returns a tuple of (is aggregate filter, boundary id), where the
+    boundary id is None for an unfiltered search
+    """
+    if not filterstr:
+        return (True, None)
+
+    try:
+        query = loads(filterstr)
+    except ValueError:
+        return (False, None)
+
+    # A combinator with a single predicate is the same as the predicate
+    if (isinstance(query, list) and len(query) == 2
+            and query[0] in ('AND', 'OR')):
+        query = query[1]
+
+    if query == {}:
+        return (True, None)
+
+    if isinstance(query, dict) and len(query) == 1:
+        key, value = query.items()[0]
+        if (key in _BOUNDARY_FILTER_KEYS and isinstance(value, dict)
+                and value.keys() == ['IN_BOUNDARY']):
+            return (True, value['IN_BOUNDARY'])
+
+    return (False, None)
+
+
+def _build_aggregate(instance, boundary, compute):
+    from treemap.models import BenefitAggregate
+
+    benefits, n_trees_computed, n_trees_total = _compute_totals(
+        instance, boundary, compute)
+
+    aggregate = BenefitAggregate(instance=instance,
+                                 boundary=boundary,
+                                 benefits=benefits,
+                                 n_trees_computed=n_trees_computed,
+                                 n_trees_total=n_trees_total)
+    aggregate.save()
+
+    return aggregate
+
+
+def _compute_totals(instance, boundary, compute):
+    """
+    Returns a tuple of (raw benefits, computed tree count, total tree
+    count) for the instance's trees, or its trees within a boundary
+    """
+    from treemap.models import Tree
+
+    trees = Tree.objects.filter(instance=instance)
+    if boundary is not None:
+        trees = trees.filter(plot__geom__within=boundary.geom)
+
+    n_trees_total = trees.count()
+
+    if n_trees_total == 0:
+        return ({}, 0, 0)
+
+    rawb, err = compute(instance, trees)
+
+    if err:
+        raise BenefitAggregateException(err)
+
+    benefits = dict(rawb['Benefits'])
+    n_trees_computed = int(benefits.pop('n_trees', 1))
+
+    return (benefits, n_trees_computed, n_trees_total)
+
+
+def _snapshot(instance, trees):
+    """
+    Returns a list of the trees, with the code of each tree's i-Tree region
+    in its region_code attribute
+    """
+    trees = list(trees.select_related('plot', 'species'))
+
+    if instance.itree_region_default:
+        region_codes = [instance.itree_region_default] * len(trees)
+    else:
+        region_codes = itree_region_index.region_codes_for_points(
+            [tree.plot.geom for tree in trees])
+
+    for tree, region_code in zip(trees, region_codes):
+        tree.region_code = region_code
+
+    return trees
+
+
+def _snapshot_keys(trees):
+    return sorted((tree.pk, tree.species_id, tree.diameter, tree.region_code,
+                   tree.plot.geom.ewkt) for tree in trees)
+
+
+def _apply_changes(instance, changes):
+    """
+    Adds the benefits of each tree in changes, a list of (sign, tree)
+    tuples with trees from _snapshot, multiplied by its sign to the
+    aggregates which contain it
+    """
+    from treemap.ecobenefits import TreeBenefitsCalculator
+    from treemap.models import BenefitAggregate
+
+    # Computed before locking the aggregates, since it may call the
+    # ecoservice
+    trees_and_regions = [
+        (tree, tree.region_code) for __, tree in changes
+        if tree.diameter and tree.species and tree.region_code]
+
+    results = TreeBenefitsCalculator().raw_benefits_for_each_tree(
+        instance, trees_and_regions)
+
+    benefits_by_tree = {}
+    for (tree, __), (rawb, err) in zip(trees_and_regions, results):
+        if err == BAD_CODE_PAIR:
+            # Not computed by an eco summary either
+            continue
+        elif err:
+            logger.warning('Failed to compute the benefits of tree %s (%s), '
+                           'rebuilding the benefit aggregates of instance %s'
+                           % (tree.pk, err, instance.pk))
+            invalidate_aggregates(instance.pk)
+            return
+
+        benefits_by_tree[id(tree)] = rawb['Benefits']
+
+    with transaction.atomic():
+        aggregates = BenefitAggregate.objects\
+            .select_for_update()\
+            .select_related('boundary')\
+            .filter(instance=instance)
+
+        for aggregate in aggregates:
+            if aggregate.is_stale:
+                # Keep a rebuild in progress from missing the change
+                _mark_stale(BenefitAggregate.objects.filter(pk=aggregate.pk))
+                continue
+
+            for sign, tree in changes:
+                if not (aggregate.boundary is None or
+                        aggregate.boundary.geom.contains(tree.plot.geom)):
+                    continue
+
+                aggregate.n_trees_total += sign
+
+                benefits = benefits_by_tree.get(id(tree))
+                if benefits is not None:
+                    aggregate.n_trees_computed += sign
+                    for factor, value in benefits.iteritems():
+                        aggregate.benefits[factor] = \
+                            aggregate.benefits.get(factor, 0) + sign * value
+
+            aggregate.save()
+
+
+def _get_stale_aggregates(instance_id):
+    from treemap.models import BenefitAggregate
+
+    # A rebuild may be queued before the transaction which marked the
+    # aggregates stale commits. Locking them waits for it to finish.
+    with transaction.atomic():
+        return list(BenefitAggregate.objects
+                    .select_for_update()
+                    .filter(instance_id=instance_id, is_stale=True))
+
+
+def _mark_stale(aggregates):
+    from treemap.tasks import rebuild_benefit_aggregates
+
+    # Incrementing the revisions of aggregates which are already stale
+    # keeps a rebuild which is in progress from marking them up to date
+    aggregates.filter(is_stale=True)\
+        .update(revision=F('revision') + 1)
+
+    n_newly_stale = aggregates.filter(is_stale=False)\
+        .update(is_stale=True, revision=F('revision') + 1)
+
+    # Any stale aggregates already have a rebuild queued
+    if n_newly_stale:
+        instance_ids = set(aggregates.values_list('instance_id', flat=True))
+        for instance_id in instance_ids:
+            rebuild_benefit_aggregates.delay(instance_id)
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import hashlib
+
+from copy import deepcopy
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db.models import F
+
+from treemap.lib.lru_cache import LRUCache
+
+# Cache eco benefit results, which depend only on a small set of inputs
+# and are expensive to compute (an HTTP call to the ecoservice).
+#
+# Results are kept in a bounded in-process LRU cache and, if the
+# ECO_SHARED_CACHE setting names a Django cache, in that shared cache
+# as well so that other processes can reuse them.
+#
+# Per-tree benefits depend on the instance's i-Tree code overrides, so
+# their keys include an override revision, which is incremented whenever
+# an ITreeCodeOverride is saved or deleted. The revision is stored on the
+# instance (Instance.eco_override_rev), so that every process sees it, and
+# is read from the loaded instance, whose copies in the instance cache are
+# kept current (see object_caches.instance_by_url_name).
+#
+# Filter summaries also depend on the trees matching the filter and on
+# the map feature types summarized, so their keys include the instance's
+# search hash, which changes whenever an audit record is written or the
+# currency conversion changes, and the instance's map feature types.
+
+
+class _BenefitCache(object):
+    def __init__(self, max_size):
+        self.local = LRUCache(max_size)
+        self.shared_hits = 0
+
+    def get(self, key):
+        value = self.local.get(key)
+
+        if value is None:
+            shared_cache = _get_shared_cache()
+            if shared_cache:
+                value = shared_cache.get(key)
+                if value is not None:
+                    self.shared_hits += 1
+                    self.local.set(key, value)
+
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+
+        shared_cache = _get_shared_cache()
+        if shared_cache:
+            shared_cache.set(key, value, settings.ECO_SHARED_CACHE_TIMEOUT)
+
+    def clear(self):
+        self.local.clear()
+        self.shared_hits = 0
+
+    def stats(self):
+        stats = self.local.stats()
+        stats['shared_hits'] = self.shared_hits
+        return stats
+
+
+_tree_benefits = _BenefitCache(settings.ECO_TREE_CACHE_SIZE)
+_filter_benefits = _BenefitCache(settings.ECO_FILTER_CACHE_SIZE)
+
+# ------------------------------------------------------------------------
+# Interface functions
+
+
+def get_tree_benefits(instance, species, diameter, region, compute):
+    """
+    Returns a tuple of (raw benefits, error) for a tree, as returned by
+    the 'eco.json' endpoint, calling compute(diameter) on a cache miss.
+
+    The diameter is bucketed before it is used as a key, and compute is
+    called with the bucketed diameter, so cached values always match what
+    would have been computed.
+    """
+    def compute_many(trees):
+        __, diameter, __ = trees[0]
+        return [compute(diameter)]
+
+    return get_many_tree_benefits(
+        instance, [(species, diameter, region)], compute_many)[0]
+
+
+def get_many_tree_benefits(instance, trees, compute_many):
+    """
+    Returns a list with a tuple of (raw benefits, error) for each
+    (species, diameter, region) tuple in trees.
+
+    compute_many is called once, with a list of the (species, bucketed
+    diameter, region) tuples not found in the cache, and must return a
+    list of the corresponding results.
+    """
+    override_revision = instance.eco_override_rev
+
+    results = [None] * len(trees)
+    misses = {}
+
+    for index, (species, diameter, region) in enumerate(trees):
+        diameter = diameter_bucket(diameter)
+        key = 'eco:tree:%s:%s:%s:%s:%s:%s' % (
+            instance.pk, override_revision,
+            species.pk, species.otm_code, diameter, region)
+
+        benefits = _tree_benefits.get(key)
+
+        if benefits is not None:
+            results[index] = _copy_benefits(benefits)
+        elif key in misses:
+            misses[key][1].append(index)
+        else:
+            misses[key] = ((species, diameter, region), [index])
+
+    if misses:
+        keys = misses.keys()
+        computed = compute_many([misses[miss_key][0] for miss_key in keys])
+
+        for key, (rawb, err) in zip(keys, computed):
+            # Errors are not cached, since they may be transient
+            if not err:
+                _tree_benefits.set(key, rawb['Benefits'])
+
+            for index in misses[key][1]:
+                if err:
+                    results[index] = (rawb, err)
+                else:
+                    results[index] = _copy_benefits(rawb['Benefits'])
+
+    return results
+
+
+def get_filter_benefits(filter, compute):
+    """
+    Returns a tuple of (benefits, basis, margins) for the given
+    search.Filter,
+    as returned by ecobenefits.get_benefits_for_filter, calling compute()
+    on a cache miss.
+    """
+    result = peek_filter_benefits(filter)
+
+    if result is None:
+        result = compute()
+        set_filter_benefits(filter, result)
+
+    return result
+
+
+def peek_filter_benefits(filter):
+    """
+    Returns the cached (benefits, basis, margins) tuple for the given
+    search.Filter,
+    or None if it isn't cached
+    """
+    result = _filter_benefits.get(filter_benefits_key(filter))
+
+    if result is not None:
+        result = deepcopy(result)
+
+    return result
+
+
+def set_filter_benefits(filter, result):
+    _filter_benefits.set(filter_benefits_key(filter), deepcopy(result))
+
+
+def filter_benefits_key(filter):
+    """
+    Returns the key of the summary of the given search.Filter, which
+    changes whenever the summary may have changed
+    """
+    instance = filter.instance
+    key_parts = (filter.search_hash,
+                 str(instance.eco_override_rev),
+                 ','.join(sorted(instance.map_feature_types)),
+                 filter.normalized_filterstr,
+                 filter.normalized_displaystr)
+    key_hash = hashlib.md5('|'.join(key_parts).encode('utf-8')).hexdigest()
+
+    # The prefix changes with the form of the cached summaries, so that
+    # summaries cached by older code are ignored
+    return 'eco:summary:%s:%s' % (instance.pk, key_hash)
+
+
+def diameter_bucket(diameter):
+    return round(diameter, settings.ECO_TREE_CACHE_DIAMETER_DIGITS)
+
+
+def tree_benefits_stats():
+    return _tree_benefits.stats()
+
+
+def filter_benefits_stats():
+    return _filter_benefits.stats()
+
+
+def clear_caches():
+    _tree_benefits.clear()
+    _filter_benefits.clear()
+
+
+def invalidate_itree_code_overrides(*args, **kwargs):
+    # Called by 'save' and 'delete' signal handlers for ITreeCodeOverride
+    override = kwargs['instance']  # 'instance' is a Django term here
+    _increment_override_revision(override.instance_species.instance)
+
+
+# ------------------------------------------------------------------------
+# Helpers
+
+
+def _copy_benefits(benefits):
+    # Callers mutate the benefits dict while converting units, so
+    # always hand out copies
+    return ({'Benefits': dict(benefits)}, None)
+
+
+def _get_shared_cache():
+    if settings.ECO_SHARED_CACHE:
+        return get_cache(settings.ECO_SHARED_CACHE)
+    else:
+        return None
+
+
+def _increment_override_revision(instance):
+    # Use a SQL increment, to prevent race conditions between servers
+    from treemap.models import Instance
+    qs = Instance.objects.filter(pk=instance.pk)
+    qs.update(eco_override_rev=F('eco_override_rev') + 1)
+
+    # Fetch updated value so later lookups with this instance see it
+    instance.eco_override_rev = qs.values_list('eco_override_rev',
+                                               flat=True)[0]
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import math
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Count
+
+# Estimate the eco benefits of very large searches from a sample of the
+# matching trees, rather than computing the benefits of every tree.
+#
+# Trees are stratified by species and diameter class. The sample is
+# chosen with a hash of the tree ids, which gives every tree the same
+# chance of being chosen (so each stratum is sampled in proportion to its
+# size) and picks the same trees each time a search is summarized.
+#
+# The total for each stratum is estimated from the mean of its sampled
+# trees and the size of the stratum, which is counted in the database.
+# Strata with fewer than two computed trees in the sample are pooled into
+# a single stratum. Confidence bounds use the normal approximation to the
+# variance of the stratified estimate.
+#
+# Sampled trees whose values can't be computed are represented by the
+# other trees of their stratum, and trees without a species or diameter
+# by the average computed tree, whichever engine computes the benefits.
+
+CONFIDENCE_LEVEL = 0.95
+_Z = 1.96
+
+# Knuth's multiplicative hash of the tree id, which is in [0, 2^32)
+_ID_HASH_SQL = 'mod(treemap_tree.id * 2654435761, 4294967296)'
+_ID_HASH_MODULUS = 2 ** 32
+
+# ------------------------------------------------------------------------
+# Interface functions
+
+
+def should_sample(n_trees):
+    threshold = settings.ECO_SAMPLING_THRESHOLD
+    return threshold is not None and n_trees > threshold
+
+
+def estimate_totals(trees, n_total_trees, values_for_trees):
+    """
+    Estimates the totals of some values over n_total_trees trees from a
+    sample of a Tree queryset, which should only contain trees with a
+    species and a diameter. Any other trees are assumed to have the same
+    values as the average computed tree.
+
+    values_for_trees is called with a list of the sampled trees and must
+    return a list with a dict of values for each tree, or None if a tree's
+    values can't be computed.
+
+    Returns a tuple of (estimates, margins, number of trees computed),
+    where estimates and margins map value keys to the estimated total and
+    the half-width of its confidence interval.
+    """
+    strata_sizes = _count_strata(trees)
+    n_trees_with_data = sum(strata_sizes.itervalues())
+
+    if n_trees_with_data == 0:
+        return ({}, {}, 0)
+
+    fraction = min(1.0, settings.ECO_SAMPLE_SIZE / n_trees_with_data)
+    sample = list(_sample(trees, fraction))
+
+    samples_by_stratum = defaultdict(list)
+    for tree, values in zip(sample, values_for_trees(sample)):
+        if values is not None:
+            stratum = (tree.species_id, int(tree.diameter_class))
+            samples_by_stratum[stratum].append(values)
+
+    strata = _collapse_strata(strata_sizes, samples_by_stratum)
+    estimates, variances = _stratified_estimate(strata)
+
+    scale = n_total_trees / n_trees_with_data
+
+    estimates = {key: estimate * scale
+                 for key, estimate in estimates.iteritems()}
+    margins = {key: _Z * math.sqrt(variance) * scale
+               for key, variance in variances.iteritems()}
+    n_computed = sum(len(values) for values in samples_by_stratum.values())
+
+    return (estimates, margins, n_computed)
+
+
+# ------------------------------------------------------------------------
+# Helpers
+
+
+def _diameter_class_sql():
+    width = float(settings.ECO_SAMPLING_DIAMETER_CLASS_WIDTH)
+    return 'floor(treemap_tree.diameter / %s)' % width
+
+
+def _count_strata(trees):
+    rows = trees.extra(select={'diameter_class': _diameter_class_sql()})\
+                .values_list('species', 'diameter_class')\
+                .order_by()\
+                .annotate(n=Count('pk'))
+
+    return {(species_id, int(diameter_class)): n
+            for species_id, diameter_class, n in rows}
+
+
+def _sample(trees, fraction):
+    threshold = int(math.ceil(fraction * _ID_HASH_MODULUS))
+
+    return trees.extra(select={'diameter_class': _diameter_class_sql()},
+                       where=['%s < %%s' % _ID_HASH_SQL],
+                       params=[threshold])
+
+
+def _collapse_strata(strata_sizes, samples_by_stratum):
+    """
+    Returns a list of (stratum size, list of sampled values) tuples,
+    pooling strata which don't have enough samples for an estimate
+    """
+    strata = []
+    pooled_size, pooled_values = 0, []
+
+    for stratum, size in strata_sizes.iteritems():
+        values = samples_by_stratum.get(stratum, [])
+
+        if len(values) >= 2:
+            strata.append((size, values))
+        else:
+            pooled_size += size
+            pooled_values.extend(values)
+
+    if pooled_size > 0:
+        if len(pooled_values) < 2:
+            # Too few samples to say anything about the pooled trees, so
+            # treat them like the sample as a whole
+            pooled_values = [sample_values
+                             for stratum_values in samples_by_stratum.values()
+                             for sample_values in stratum_values]
+
+        if pooled_values:
+            strata.append((pooled_size, pooled_values))
+
+    return strata
+
+
+def _stratified_estimate(strata):
+    """
+    Returns a tuple of (estimated totals, variances) for a list of
+    (stratum size, list of sampled values) tuples
+    """
+    estimates = defaultdict(float)
+    variances = defaultdict(float)
+
+    for size, samples in strata:
+        n = len(samples)
+        keys = set(key for values in samples for key in values)
+
+        # The finite population correction, which is 0 when every tree
+        # in the stratum was sampled
+        fpc = max(0.0, 1 - n / size)
+
+        for key in keys:
+            xs = [values.get(key, 0) for values in samples]
+            mean = sum(xs) / n
+
+            estimates[key] += size * mean
+
+            # A single sample tells us nothing about the variance
+            if n > 1:
+                s2 = sum((x - mean) ** 2 for x in xs) / (n - 1)
+            else:
+                s2 = 0
+
+            variances[key] += size ** 2 * fpc * s2 / n
+
+    return (dict(estimates), dict(variances))
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+from django.conf import settings
+
+from treemap.DotDict import DotDict
+
+# Remember values derived from an instance's config, such as the units and
+# digits used to display each value, so that they aren't looked up in the
+# config (and the defaults in settings) every time they are used.
+#
+# A view is discarded as soon as the config may have changed: when it is
+# replaced, when it (or a DotDict nested in it) is modified in place, or
+# when the settings it depends on are replaced (as they are by
+# override_settings in tests). Configs are rarely modified outside of
+# editing them, so views are normally kept for the life of the Instance
+# object.
+
+
+class ConfigView(object):
+    """
+    Values derived from an instance's config, computed when first needed.
+    Get one with Instance.config_view.
+    """
+    def __init__(self, config):
+        self.config = config
+        if isinstance(config, DotDict):
+            self._mutations = config.mutation_count()
+        else:
+            self._mutations = None
+        self._display_defaults = settings.DISPLAY_DEFAULTS
+        self._storage_units = settings.STORAGE_UNITS
+        self._values = {}
+
+    def is_current(self, config):
+        return (config is self.config and
+                isinstance(config, DotDict) and
+                self._mutations == config.mutation_count() and
+                self._display_defaults is settings.DISPLAY_DEFAULTS and
+                self._storage_units is settings.STORAGE_UNITS)
+
+    def memoized(self, key, compute):
+        """
+        Returns the value remembered for key, calling compute() to get it
+        if there is none. The value is shared, so must not be modified.
+        """
+        if key not in self._values:
+            self._values[key] = compute()
+        return self._values[key]
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from treemap import ecobackend
+from treemap.species.codes import itree_codes_by_region
+
+logger = logging.getLogger(__name__)
+
+# The i-Tree codes known to the ecoservice, by region.
+#
+# Looking up codes never waits on the ecoservice. The codes used are, in
+# order of preference:
+#
+#   - the copy loaded by this process
+#   - the copy in ITREE_CODES_CACHE_FILE, which is shared by all of the
+#     processes on a machine
+#   - the codes in treemap/species/codes.py
+#
+# Whenever the codes in use are more than ITREE_CODES_CACHE_TTL seconds
+# old (or come from treemap/species/codes.py), a background thread fetches
+# them from the ecoservice and rewrites the cache file. Failed fetches are
+# retried at most once every RETRY_INTERVAL seconds.
+
+RETRY_INTERVAL = 60
+
+_codes_by_region = None
+_all_codes = None
+_fetched_at = None  # None when using the fallback codes
+_file_mtime = None
+
+_refresh_lock = threading.Lock()
+_refresh_thread = None
+_last_refresh_attempt = None
+
+# ------------------------------------------------------------------------
+# Interface functions
+
+
+def all_itree_codes():
+    _ensure_loaded()
+    return _all_codes
+
+
+def has_itree_code(region_code, itree_code):
+    _ensure_loaded()
+    return itree_code in _codes_by_region.get(region_code, [])
+
+
+def warm_up(wait=False):
+    """
+    Loads the codes, starting a background fetch from the ecoservice if
+    they are missing or stale. Call once in each process, after it has
+    forked, so requests don't find stale codes.
+    """
+    _ensure_loaded()
+
+    thread = _refresh_thread
+    if wait and thread is not None:
+        thread.join()
+
+
+def refresh():
+    """
+    Fetches the codes from the ecoservice, updating this process's copy
+    and the cache file. Returns True if the codes were fetched.
+    """
+    result, err = ecobackend.json_benefits_call('itree_codes.json', {})
+    if err:
+        logger.warning('Failed to retrieve i-Tree codes from ecoservice: %s'
+                       % err)
+        return False
+
+    codes_by_region = result['Codes']
+
+    try:
+        _write_cache_file(codes_by_region)
+    except (IOError, OSError) as e:
+        logger.warning('Failed to write i-Tree code cache file: %s' % e)
+
+    _set_codes(codes_by_region, time.time())
+
+    return True
+
+
+def clear():
+    global _codes_by_region, _all_codes, _fetched_at, _file_mtime, \
+        _last_refresh_attempt
+    _codes_by_region = _all_codes = _fetched_at = _file_mtime = None
+    _last_refresh_attempt = None
+
+
+# ------------------------------------------------------------------------
+# Helpers
+
+
+def _ensure_loaded():
+    if _is_fresh(_fetched_at):
+        return
+
+    codes_by_region, mtime = _read_cache_file()
+
+    if codes_by_region is not None:
+        _set_codes(codes_by_region, mtime)
+    elif _codes_by_region is None:
+        _set_codes(itree_codes_by_region(), None)
+
+    if not _is_fresh(_fetched_at):
+        _start_refresh()
+
+
+def _is_fresh(fetched_at):
+    return (fetched_at is not None and
+            time.time() - fetched_at < settings.ITREE_CODES_CACHE_TTL)
+
+
+def _set_codes(codes_by_region, fetched_at):
+    global _codes_by_region, _all_codes, _fetched_at
+    _all_codes = set(itertools.chain(*codes_by_region.values()))
+    _codes_by_region = codes_by_region
+    _fetched_at = fetched_at
+
+
+def _read_cache_file():
+    """
+    Returns a tuple of (codes by region, modification time) from the cache
+    file, or (None, None) if there is no file or it hasn't changed since it
+    was last read
+    """
+    global _file_mtime
+    path = settings.ITREE_CODES_CACHE_FILE
+
+    try:
+        mtime = os.path.getmtime(path)
+        if mtime == _file_mtime:
+            return (None, None)
+
+        with open(path) as f:
+            codes_by_region = json.load(f)
+    except (IOError, OSError, ValueError):
+        return (None, None)
+
+    _file_mtime = mtime
+    return (codes_by_region, mtime)
+
+
+def _write_cache_file(codes_by_region):
+    path = settings.ITREE_CODES_CACHE_FILE
+    directory = os.path.dirname(path)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o755)
+
+    # Write to a temporary file and rename it, so that other processes
+    # never read a partially written file
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(codes_by_region, f)
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def _start_refresh():
+    global _refresh_thread, _last_refresh_attempt
+
+    with _refresh_lock:
+        now = time.time()
+
+        if _refresh_thread is not None and _refresh_thread.is_alive():
+            return
+        if (_last_refresh_attempt is not None and
+                now - _last_refresh_attempt < RETRY_INTERVAL):
+            return
+
+        _last_refresh_attempt = now
+        _refresh_thread = threading.Thread(target=refresh)
+        _refresh_thread.daemon = True
+        _refresh_thread.start()
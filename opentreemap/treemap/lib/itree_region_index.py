@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import threading
+
+# Find the i-Tree regions containing points in memory, rather than with a
+# PostGIS query per point.
+#
+# The region polygons are loaded once per process and kept as prepared
+# GEOS geometries, which make repeated containment tests fast. There are
+# only a few dozen regions, so candidates are found by checking each
+# region's extent rather than with a spatial tree.
+#
+# Regions are static data, loaded with the database, so the index is only
+# rebuilt after a region is saved or deleted. Other processes are told of
+# the change over the object caches' notification channel (see
+# OBJECT_CACHES_NOTIFY_CHANNEL in object_caches.py).
+
+_index = None
+_index_lock = threading.Lock()
+
+# ------------------------------------------------------------------------
+# Interface functions
+
+
+def region_code_for_point(point):
+    """
+    Returns the code of the i-Tree region containing the point, or None
+    """
+    codes = region_codes_containing(point)
+    return codes[0] if codes else None
+
+
+def region_codes_for_points(points):
+    """
+    Returns a list with the code of the i-Tree region containing each of
+    the points (or None, for points outside every region, or None points)
+    """
+    index = _get_index()
+    codes = []
+
+    for point in points:
+        codes_for_point = _codes_containing(index, point) if point else []
+        codes.append(codes_for_point[0] if codes_for_point else None)
+
+    return codes
+
+
+def region_codes_containing(point):
+    """
+    Returns a list of the codes of all the i-Tree regions containing the
+    point, which should have at most one item
+    """
+    return _codes_containing(_get_index(), point)
+
+
+def clear(*args, **kwargs):
+    # Also called when any process saves or deletes an ITreeRegion
+    global _index
+    _index = None
+
+
+# ------------------------------------------------------------------------
+# Helpers
+
+
+def _get_index():
+    global _index
+    index = _index
+
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _build_index()
+            index = _index
+
+    return index
+
+
+def _build_index():
+    from treemap.models import ITreeRegion  # prevent circular import
+
+    index = []
+    for code, geometry in ITreeRegion.objects.order_by('code')\
+                                             .values_list('code', 'geometry'):
+        index.append((geometry.extent, geometry.prepared, geometry.srid,
+                      code))
+    return index
+
+
+def _codes_containing(index, point):
+    codes = []
+
+    for (xmin, ymin, xmax, ymax), prepared, srid, code in index:
+        if point.srid and srid and point.srid != srid:
+            point = point.transform(srid, clone=True)
+
+        if xmin <= point.x <= xmax and ymin <= point.y <= ymax:
+            if prepared.contains(point):
+                codes.append(code)
+
+    return codes
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import threading
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A thread-safe, size-bounded, in-process cache which evicts the least
+    recently used entry when full, and counts hits, misses and evictions.
+
+    A max_size of zero (or less) disables the cache.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            # Re-inserting moves the entry to the most recently used end
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def peek(self, key, default=None):
+        """
+        Returns the entry for key without counting a hit or a miss, or
+        making it the most recently used entry
+        """
+        with self._lock:
+            return self._entries.get(key, default)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def items(self):
+        with self._lock:
+            return list(self._entries.items())
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
@@ -15,10 +15,11 @@ from django.db.models import Q
 from treemap.audit import Audit
 from treemap.ecobackend import ECOBENEFIT_ERRORS
 from treemap.lib import execute_sql
-from treemap.models import Tree, MapFeature, User, Favorite
+from treemap.models import Tree, Plot, MapFeature, User, Favorite
 
 from treemap.lib import format_benefits
 from treemap.lib.photo import context_dict_for_photo
+from treemap.units import convert_all_to_display_units
 from treemap.util import leaf_subclasses
 
 
@@ -71,15 +72,19 @@ def _map_feature_audits(user, instance, feature, filters=None,
     return audits
 
 
-def _add_eco_benefits_to_context_dict(instance, feature, context):
+def _add_eco_benefits_to_context_dict(instance, feature, context,
+                                      benefits_result=None):
     FeatureClass = feature.__class__
 
     if not hasattr(FeatureClass, 'benefits'):
         return
 
-    benefits, basis, error = FeatureClass.benefits\
-                                         .benefits_for_object(
-                                             instance, feature)
+    if benefits_result is None:
+        benefits_result = FeatureClass.benefits\
+                                      .benefits_for_object(
+                                          instance, feature)
+
+    benefits, basis, error = benefits_result
 
     if error in ECOBENEFIT_ERRORS:
         context[error] = True
@@ -165,8 +170,28 @@ def get_map_feature_or_404(feature_id, instance, type=None):
         return feature.cast_to_subtype()
 
 
-def context_dict_for_plot(request, plot, edit=False, tree_id=None):
-    context = context_dict_for_map_feature(request, plot)
+def context_dicts_for_plots(request, plots):
+    """
+    Returns the result of context_dict_for_plot for each plot, computing
+    the eco benefits of all of the plots, and the display units of all of
+    their trees, at once
+    """
+    plots = list(plots)
+    benefits_results = Plot.benefits.benefits_for_objects(
+        request.instance, plots)
+
+    trees = [plot.current_tree() for plot in plots]
+    convert_all_to_display_units([tree for tree in trees if tree])
+
+    return [context_dict_for_plot(request, plot, tree=tree,
+                                  benefits_result=benefits_result)
+            for plot, tree, benefits_result
+            in zip(plots, trees, benefits_results)]
+
+
+def context_dict_for_plot(request, plot, edit=False, tree_id=None,
+                          benefits_result=None, tree=None):
+    context = context_dict_for_map_feature(request, plot, benefits_result)
 
     if edit:
         context['editmode'] = edit
@@ -174,13 +199,14 @@ def context_dict_for_plot(request, plot, edit=False, tree_id=None):
     instance = request.instance
     user = request.user
 
-    if tree_id:
-        tree = get_object_or_404(Tree,
-                                 instance=instance,
-                                 plot=plot,
-                                 pk=tree_id)
-    else:
-        tree = plot.current_tree()
+    if tree is None:
+        if tree_id:
+            tree = get_object_or_404(Tree,
+                                     instance=instance,
+                                     plot=plot,
+                                     pk=tree_id)
+        else:
+            tree = plot.current_tree()
 
     if tree:
         tree.convert_to_display_units()
@@ -307,7 +333,7 @@ def title_for_map_feature(feature):
     return title
 
 
-def context_dict_for_map_feature(request, feature):
+def context_dict_for_map_feature(request, feature, benefits_result=None):
     instance = request.instance
     if instance.pk != feature.instance_id:
         raise Exception("Invalid instance, does not match map feature")
@@ -336,7 +362,8 @@ def context_dict_for_map_feature(request, feature):
         'photo_upload_share_text': _photo_upload_share_text(feature),
     }
 
-    _add_eco_benefits_to_context_dict(instance, feature, context)
+    _add_eco_benefits_to_context_dict(instance, feature, context,
+                                      benefits_result)
 
     return context
 
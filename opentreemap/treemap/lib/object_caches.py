@@ -3,22 +3,102 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import division
 
+import cPickle as pickle
+import logging
+import os
+import select
+import socket
+import threading
+import time
+
 from copy import deepcopy
 
 from django.conf import settings
+from django.core.cache import get_cache
+from django.db import connection, connections
 from django.db.models import F
 
+from treemap.lib import itree_region_index
+from treemap.lib.lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
 # For each instance, cache "adjunct" objects -- frequently-accessed objects
 # which change rarely -- by storing them in local memory. Track cache validity
 # via a database timestamp on each instance (instance.adjunct_timestamp).
 # Check the timestamp before returning any object from the cache; if it's stale
 # invalidate all adjunct objects for the instance.
 #
+# Cached objects are frozen (see Freezable below) and returned without being
+# copied, so callers can't modify the objects shared with other callers.
+#
 # When an adjunct object is modified (saved to the db or deleted), invalidate
 # the appropriate instance's cache and update its timestamp. The timestamp
 # update will cause the change to propagate to any other servers.
+#
+# If the OBJECT_CACHES_SHARED_CACHE setting names a Django cache, all of an
+# instance's adjuncts are also kept in that cache, in a store shared by
+# every process, so that they are loaded from the database once rather than
+# once per process. The local copies act as a first level cache in front
+# of the shared store. Entries in the shared store carry the timestamp they
+# were loaded at, and are only used if they are at least as new as the
+# instance's timestamp.
+#
+# Checking the timestamp requires a fresh Instance, which long-lived
+# processes like celery workers may not have. If the
+# OBJECT_CACHES_NOTIFY_CHANNEL setting names a PostgreSQL channel, each
+# timestamp increment also sends a NOTIFY on that channel with the instance
+# id and its new timestamp, and each process which has called
+# start_invalidation_listener() evicts the instance's adjuncts as soon as
+# the change is committed. The notified timestamp is then required of the
+# adjuncts, even if the caller's Instance has an older one.
+#
+# The same channel carries notifications that an i-Tree region changed, so
+# every process rebuilds its region index (see itree_region_index.py).
+# Without the channel, only the process which changed the region does.
+#
+# At most OBJECT_CACHES_MAX_INSTANCES instances' adjuncts are kept in each
+# process; the least recently used are evicted first. adjunct_cache_stats()
+# reports how well this process's cache is working. With a shared store,
+# each process which has called start_stats_publisher() also publishes its
+# statistics there every OBJECT_CACHES_STATS_INTERVAL seconds, from a
+# background thread, and published_adjunct_cache_stats() (and the
+# adjunct_cache_stats management command) report them for every running
+# process. Each process publishes under its own key, so processes never
+# overwrite each other's statistics.
+#
+# Instances themselves are cached by url name for instance_request, which
+# looks them up on every request. A cached instance is only used while
+# its adjuncts timestamp is unchanged (Instance.save increments it), which
+# is checked with a query much cheaper than fetching the instance. Each
+# caller gets its own copy, since views may modify the instance.
+
+_adjuncts = LRUCache(settings.OBJECT_CACHES_MAX_INSTANCES)
+
+_instances = LRUCache(settings.OBJECT_CACHES_MAX_INSTANCES)
+
+# The number of cached adjuncts which were reloaded because they were stale
+_stale_loads = 0
+
+_store = None
+
+# Adjuncts timestamps received from notifications, by instance id
+_notified_timestamps = {}
 
-_adjuncts = {}
+# Notification payload sent when an i-Tree region is saved or deleted
+_ITREE_REGIONS_CHANGED = 'itree_regions'
+
+_listener_thread = None
+_listener_lock = threading.Lock()
+
+_publisher_thread = None
+_publisher_lock = threading.Lock()
+
+# The key this process publishes its statistics under in the shared store
+_stats_slot = None
+
+# Seconds to wait before reconnecting after losing the listener connection
+LISTENER_RETRY_INTERVAL = 5
 
 # ------------------------------------------------------------------------
 # Interface functions
@@ -40,6 +120,29 @@ def role_permissions(role, instance=None, model_name=None):
         return _role_permissions_from_db(role, model_name)
 
 
+def compiled_permissions(user, instance, model_name=None):
+    """
+    Returns the CompiledPermissions of the user's role for the model (or
+    for all models if model_name is None)
+    """
+    if settings.USE_OBJECT_CACHES:
+        return _get_adjuncts(instance).compiled_permissions(user, model_name)
+    else:
+        return CompiledPermissions(
+            _permissions_from_db(user, instance, model_name))
+
+
+def compiled_role_permissions(role, instance=None, model_name=None):
+    if settings.USE_OBJECT_CACHES:
+        if not instance:
+            instance = role.instance
+        return _get_adjuncts(instance).compiled_role_permissions(
+            role.id, model_name)
+    else:
+        return CompiledPermissions(
+            _role_permissions_from_db(role, model_name))
+
+
 def udf_defs(instance, model_name=None):
     if settings.USE_OBJECT_CACHES:
         return _get_adjuncts(instance).udf_defs(model_name)
@@ -47,9 +150,62 @@ def udf_defs(instance, model_name=None):
         return _udf_defs_from_db(instance, model_name)
 
 
+def instance_by_url_name(url_name):
+    """
+    Returns a tuple of (instance, whether it has an i-Tree region) for the
+    instance with the given url name (ignoring case), or raises
+    Instance.DoesNotExist
+    """
+    from treemap.models import Instance
+
+    if not settings.USE_OBJECT_CACHES:
+        instance = Instance.objects.get(url_name__iexact=url_name)
+        return (instance, instance.has_itree_region())
+
+    key = url_name.lower()
+    versions = Instance.objects.filter(url_name__iexact=url_name)\
+                               .values_list('adjuncts_timestamp', 'geo_rev',
+                                            'eco_override_rev')
+    if not versions:
+        raise Instance.DoesNotExist()
+    adjuncts_timestamp, geo_rev, eco_override_rev = versions[0]
+
+    cached = _instances.get(key)
+    if cached is None or cached[0].adjuncts_timestamp != adjuncts_timestamp:
+        instance = Instance.objects.get(url_name__iexact=url_name)
+
+        # Related objects aren't covered by the adjuncts timestamp
+        for name in list(instance.__dict__):
+            if name.startswith('_') and name.endswith('_cache'):
+                del instance.__dict__[name]
+
+        cached = (instance, instance.has_itree_region())
+        _instances.set(key, cached)
+
+    instance, has_itree_region = cached
+    instance = deepcopy(instance)
+
+    # The geo_rev changes with every edit to a map feature's geometry (and
+    # the eco_override_rev with every i-Tree code override), so they are
+    # kept current rather than reloading the instance
+    instance.geo_rev = geo_rev
+    instance.eco_override_rev = eco_override_rev
+
+    return (instance, has_itree_region)
+
+
 def clear_caches():
-    global _adjuncts
-    _adjuncts = {}
+    global _adjuncts, _instances, _notified_timestamps, _stale_loads, \
+        _stats_slot
+    _adjuncts = LRUCache(settings.OBJECT_CACHES_MAX_INSTANCES)
+    _instances = LRUCache(settings.OBJECT_CACHES_MAX_INSTANCES)
+    _notified_timestamps = {}
+    _stale_loads = 0
+    _stats_slot = None
+
+    store = _get_store()
+    if store is not None:
+        store.clear()
 
 
 def invalidate_adjuncts(*args, **kwargs):
@@ -57,11 +213,25 @@ def invalidate_adjuncts(*args, **kwargs):
     if settings.USE_OBJECT_CACHES:
         adjunct_object = kwargs['instance']  # 'instance' is a Django term here
         instance = adjunct_object.instance
-        if instance.id in _adjuncts:
-            del _adjuncts[instance.id]
+        _adjuncts.delete(instance.id)
+
+        store = _get_store()
+        if store is not None:
+            store.delete(instance.id)
+
         increment_adjuncts_timestamp(instance)
 
 
+def invalidate_itree_regions(*args, **kwargs):
+    # Called by 'save' and 'delete' signal handlers for ITreeRegion
+    itree_region_index.clear()
+
+    channel = settings.OBJECT_CACHES_NOTIFY_CHANNEL
+    if channel:
+        connection.cursor().execute(
+            "SELECT pg_notify(%s, %s)", [channel, _ITREE_REGIONS_CHANGED])
+
+
 def increment_adjuncts_timestamp(instance):
     # Increment the timestamp carefully.
     # Don't call save(), to avoid storing possibly-stale data in "instance".
@@ -70,6 +240,169 @@ def increment_adjuncts_timestamp(instance):
     Instance.objects.filter(pk=instance.id)\
                     .update(adjuncts_timestamp=F('adjuncts_timestamp') + 1)
 
+    channel = settings.OBJECT_CACHES_NOTIFY_CHANNEL
+    if channel:
+        # Notifications are delivered when the transaction commits, so
+        # listeners never reload the adjuncts before they can see the change
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT pg_notify(%s, id || ':' || adjuncts_timestamp) "
+            "FROM treemap_instance WHERE id = %s", [channel, instance.id])
+
+
+def start_invalidation_listener():
+    """
+    Starts a thread which evicts adjuncts and the i-Tree region index from
+    this process's caches when they are changed by any process, if
+    OBJECT_CACHES_NOTIFY_CHANNEL is set.
+    Call once in each process, after it has forked.
+    """
+    global _listener_thread
+    channel = settings.OBJECT_CACHES_NOTIFY_CHANNEL
+
+    if not channel:
+        return
+
+    with _listener_lock:
+        if _listener_thread is not None and _listener_thread.is_alive():
+            return
+
+        _listener_thread = threading.Thread(target=_listen, args=(channel,))
+        _listener_thread.daemon = True
+        _listener_thread.start()
+
+
+def start_stats_publisher():
+    """
+    Starts a thread which publishes this process's adjunct cache statistics
+    to the shared store every OBJECT_CACHES_STATS_INTERVAL seconds, if
+    there is a shared store. Call once in each process, after it has forked.
+    """
+    global _publisher_thread
+
+    if not (settings.USE_OBJECT_CACHES and _get_store() is not None
+            and settings.OBJECT_CACHES_STATS_INTERVAL > 0):
+        return
+
+    with _publisher_lock:
+        if _publisher_thread is not None and _publisher_thread.is_alive():
+            return
+
+        _publisher_thread = threading.Thread(target=_publish_periodically)
+        _publisher_thread.daemon = True
+        _publisher_thread.start()
+
+
+def load_adjuncts(instance):
+    """
+    Loads all of the instance's adjuncts into this process's cache
+    """
+    if settings.USE_OBJECT_CACHES:
+        _get_adjuncts(instance).ensure_loaded()
+
+
+def adjunct_cache_stats(include_bytes=False):
+    """
+    Returns a dict of this process's adjunct cache statistics, with an
+    'instances' dict of the statistics of each cached instance's adjuncts.
+    Their size in 'bytes' is only included if asked for, since finding it
+    means pickling every cached object.
+    """
+    stats = _adjuncts.stats()
+    stats['stale_loads'] = _stale_loads
+    stats['instances'] = {instance_id: adjuncts.stats(include_bytes)
+                          for instance_id, adjuncts in _adjuncts.items()}
+    return stats
+
+
+def published_adjunct_cache_stats():
+    """
+    Returns a dict of the adjunct cache statistics (as returned by
+    adjunct_cache_stats) published by each running process, by process
+    name, or None if there is no shared store to publish them to
+    """
+    store = _get_store()
+    if store is None:
+        return None
+
+    return {stats['process']: stats
+            for stats in _current_stats(store.get_stats())}
+
+
+def shared_adjunct_bytes(instance_id):
+    """
+    Returns the size of the instance's adjuncts in the shared store, or
+    None if they aren't there
+    """
+    store = _get_store()
+    data = store.get(instance_id) if store is not None else None
+    if data is None:
+        return None
+
+    return len(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+
+
+class Freezable(object):
+    """
+    Mixin for adjunct models, whose cached instances are shared by every
+    caller. Setting a field of a frozen instance raises an AttributeError.
+
+    Django caches related objects (e.g. a FieldPermission's role) on the
+    instance they were fetched through. Those are not cached on frozen
+    instances, since they would be shared too, and could go stale.
+    """
+    _frozen = False
+
+    def freeze(self):
+        object.__setattr__(self, '_frozen', True)
+
+    def __setattr__(self, name, value):
+        if self._frozen:
+            if name.startswith('_') and name.endswith('_cache'):
+                return
+            raise AttributeError("Can't set '%s' of a frozen %s" %
+                                 (name, type(self).__name__))
+
+        super(Freezable, self).__setattr__(name, value)
+
+
+class CompiledPermissions(object):
+    """
+    A role's field permissions for a model, compiled into a lookup table of
+    the permission level of each field and the sets of readable, writable
+    and directly writable fields. Cached along with the role's permissions,
+    so it must not be modified.
+
+    Fields without a FieldPermission have no level (None) and are neither
+    readable nor writable. For all models (model_name=None), fields are
+    identified by name alone, and each name has the highest level it has
+    on any model.
+    """
+    def __init__(self, perms):
+        levels = {}
+        for perm in perms:
+            name, level = perm.field_name, perm.permission_level
+            if name not in levels or level > levels[name]:
+                levels[name] = level
+
+        self.levels = levels
+        self.readable = frozenset(perm.field_name for perm in perms
+                                  if perm.allows_reads)
+        self.writable = frozenset(perm.field_name for perm in perms
+                                  if perm.allows_writes)
+        self.direct_writable = frozenset(
+            perm.field_name for perm in perms
+            if perm.permission_level == perm.WRITE_DIRECTLY)
+
+    def level(self, field_name):
+        return self.levels.get(field_name)
+
+    def allows_read(self, field_name):
+        return field_name in self.readable
+
+    def allows_write(self, field_name):
+        return field_name in self.writable
+
 
 # ------------------------------------------------------------------------
 # Fetch info from database when not using cache
@@ -103,59 +436,192 @@ def _udf_defs_from_db(instance, model_name):
 
 
 def _get_adjuncts(instance):
+    global _stale_loads
+    timestamp = max(instance.adjuncts_timestamp,
+                    _notified_timestamps.get(instance.id, 0))
+
     adjuncts = _adjuncts.get(instance.id)
-    if not adjuncts or adjuncts.timestamp < instance.adjuncts_timestamp:
-        adjuncts = _InstanceAdjuncts(instance)
-        _adjuncts[instance.id] = adjuncts
+    if adjuncts and adjuncts.timestamp >= timestamp:
+        adjuncts.hits += 1
+    else:
+        if adjuncts:
+            _stale_loads += 1
+        adjuncts = _load_adjuncts(instance, timestamp)
+        _adjuncts.set(instance.id, adjuncts)
+    return adjuncts
+
+
+def _load_adjuncts(instance, timestamp):
+    store = _get_store()
+
+    if store is None:
+        return _InstanceAdjuncts(instance, timestamp=timestamp)
+
+    data = store.get(instance.id)
+
+    if data is not None and data['timestamp'] >= timestamp:
+        return _InstanceAdjuncts(instance, data)
+
+    adjuncts = _InstanceAdjuncts(instance, timestamp=timestamp)
+    adjuncts.load_all()
+    store.set(instance.id, adjuncts.to_data())
+
     return adjuncts
 
 
+def _publish_periodically():
+    while True:
+        time.sleep(settings.OBJECT_CACHES_STATS_INTERVAL)
+        try:
+            _publish_stats()
+        except Exception:
+            logger.exception('Could not publish adjunct cache statistics')
+
+
+def _publish_stats():
+    global _stats_slot
+    store = _get_store()
+    if store is None:
+        return
+
+    if _stats_slot is None:
+        _stats_slot = store.new_stats_slot()
+
+    stats = adjunct_cache_stats()
+    stats['process'] = '%s:%s' % (socket.gethostname(), os.getpid())
+    stats['published'] = time.time()
+    store.set_stats(_stats_slot, stats)
+
+
+def _current_stats(all_stats):
+    # Leave out processes which have stopped publishing
+    oldest = time.time() - 2 * settings.OBJECT_CACHES_STATS_INTERVAL
+    return [stats for stats in all_stats if stats['published'] >= oldest]
+
+
+def _timed(load):
+    def timed_load(self):
+        start = time.time()
+        load(self)
+        self.load_time += time.time() - start
+
+    return timed_load
+
+
 class _InstanceAdjuncts:
-    def __init__(self, instance):
+    def __init__(self, instance, data=None, timestamp=None):
         self._instance = instance
-        self._user_role_ids = {}
-        self._permissions = {}
-        self._udf_defs = {}
-        self.timestamp = instance.adjuncts_timestamp
+        self.hits = 0
+        self.load_time = 0.0
+        if data is not None:
+            self._user_role_ids = data['user_role_ids']
+            self._permissions = data['permissions']
+            self._udf_defs = data['udf_defs']
+            self.timestamp = data['timestamp']
+            self._compiled = {}
+        else:
+            # Each kind of adjunct is loaded when first needed
+            self._user_role_ids = None
+            self._permissions = None
+            self._udf_defs = None
+            self._compiled = None
+            if timestamp is None:
+                timestamp = instance.adjuncts_timestamp
+            self.timestamp = timestamp
+
+    def load_all(self):
+        self._load_roles()
+        self._load_permissions()
+        self._load_udf_defs()
+
+    def ensure_loaded(self):
+        if self._user_role_ids is None:
+            self._load_roles()
+        if self._permissions is None:
+            self._load_permissions()
+        if self._udf_defs is None:
+            self._load_udf_defs()
+
+    def stats(self, include_bytes=False):
+        permissions = self._permissions or {}
+        udf_defs = self._udf_defs or {}
+
+        stats = {'timestamp': self.timestamp,
+                 'hits': self.hits,
+                 'load_time': self.load_time,
+                 'users': len(self._user_role_ids or {}),
+                 'permissions': sum(len(perms) for (__, model_name), perms
+                                    in permissions.iteritems()
+                                    if model_name is None),
+                 'udf_defs': len(udf_defs.get(None, []))}
+        if include_bytes:
+            stats['bytes'] = len(pickle.dumps(self.to_data(),
+                                              pickle.HIGHEST_PROTOCOL))
+        return stats
+
+    def to_data(self):
+        return {'user_role_ids': self._user_role_ids,
+                'permissions': self._permissions,
+                'udf_defs': self._udf_defs,
+                'timestamp': self.timestamp}
 
     def permissions(self, user, model_name):
-        if not self._user_role_ids:
+        return self.role_permissions(self._role_id(user), model_name)
+
+    def compiled_permissions(self, user, model_name):
+        return self.compiled_role_permissions(self._role_id(user), model_name)
+
+    def _role_id(self, user):
+        if self._user_role_ids is None:
             self._load_roles()
         if user and user.id in self._user_role_ids:
-            role_id = self._user_role_ids[user.id]
+            return self._user_role_ids[user.id]
         else:
-            role_id = self._user_role_ids[None]
-        return self.role_permissions(role_id, model_name)
+            return self._user_role_ids[None]
 
     def role_permissions(self, role_id, model_name):
-        if not self._permissions:
+        if self._permissions is None:
             self._load_permissions()
         perms = self._permissions.get((role_id, model_name))
 
-        # We must always deepcopy the cached items before returning them,
-        # to prevent inadvertent modifcations to the cached items
-        return deepcopy(perms) if perms else []
+        # The items are frozen, but the list must still be copied
+        return list(perms) if perms else []
+
+    def compiled_role_permissions(self, role_id, model_name):
+        if self._permissions is None:
+            self._load_permissions()
+        key = (role_id, model_name)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = CompiledPermissions(self._permissions.get(key, []))
+            self._compiled[key] = compiled
+        return compiled
 
     def udf_defs(self, model_name):
-        if not self._udf_defs:
+        if self._udf_defs is None:
             self._load_udf_defs()
         defs = self._udf_defs.get(model_name)
 
-        # We must always deepcopy the cached items before returning them,
-        # to prevent inadvertent modifcations to the cached items
-        return deepcopy(defs) if defs else []
+        # The items are frozen, but the list must still be copied
+        return list(defs) if defs else []
 
+    @_timed
     def _load_roles(self):
         from treemap.models import InstanceUser
 
+        self._user_role_ids = {}
         for iu in InstanceUser.objects.filter(instance=self._instance):
             self._user_role_ids[iu.user_id] = iu.role_id
 
         self._user_role_ids[None] = self._instance.default_role_id
 
+    @_timed
     def _load_permissions(self):
         from treemap.audit import FieldPermission
+        self._permissions = {}
+        self._compiled = {}
         for fp in FieldPermission.objects.filter(instance=self._instance):
+            fp.freeze()
             dict = self._permissions
             self._append_value(dict, (fp.role_id, fp.model_name), fp)
             self._append_value(dict, (fp.role_id, None), fp)
@@ -165,10 +631,187 @@ class _InstanceAdjuncts:
             dict[key] = []
         dict[key].append(value)
 
+    @_timed
     def _load_udf_defs(self):
         from treemap.udf import UserDefinedFieldDefinition
         qs = UserDefinedFieldDefinition.objects.filter(instance=self._instance)
+        self._udf_defs = {}
         for udfd in qs:
+            udfd.freeze()
             self._append_value(self._udf_defs, udfd.model_type, udfd)
             # Add to the "None" key for looking up UDF defs without model name
             self._append_value(self._udf_defs, None, udfd)
+
+
+# ------------------------------------------------------------------------
+# Shared stores
+
+
+class DjangoCacheAdjunctStore(object):
+    """
+    Keeps the adjunct data of each instance in a Django cache, which
+    pickles it
+    """
+    def __init__(self, cache_name, timeout):
+        self._cache = get_cache(cache_name)
+        self._timeout = timeout
+
+    def get(self, instance_id):
+        return self._cache.get(self._key(instance_id))
+
+    def set(self, instance_id, data):
+        self._cache.set(self._key(instance_id), data, self._timeout)
+
+    def delete(self, instance_id):
+        self._cache.delete(self._key(instance_id))
+
+    def new_stats_slot(self):
+        # Never expires, so that slots are never reused
+        self._cache.add('adjuncts:stats:slots', 0, None)
+        return self._cache.incr('adjuncts:stats:slots')
+
+    def get_stats(self):
+        slots = self._cache.get('adjuncts:stats:slots') or 0
+        keys = ['adjuncts:stats:%s' % slot for slot in xrange(1, slots + 1)]
+        return self._cache.get_many(keys).values()
+
+    def set_stats(self, slot, stats):
+        # Expires soon after the process stops publishing
+        self._cache.set('adjuncts:stats:%s' % slot, stats,
+                        2 * settings.OBJECT_CACHES_STATS_INTERVAL)
+
+    def clear(self):
+        # The cache may be shared with other data, so leave it alone.
+        # Stale entries are ignored because of their timestamps.
+        pass
+
+    def _key(self, instance_id):
+        return 'adjuncts:%s' % instance_id
+
+
+class LocalAdjunctStore(object):
+    """
+    An in-process stand-in for a shared store, for tests. Data is pickled
+    like it would be by a shared store, so that nothing is shared between
+    the objects put in to and taken out of the store.
+    """
+    def __init__(self):
+        self._data = {}
+        self._stats = {}
+        self._stats_slots = 0
+        self.gets = 0
+        self.sets = 0
+
+    def get(self, instance_id):
+        self.gets += 1
+        data = self._data.get(instance_id)
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, instance_id, data):
+        self.sets += 1
+        self._data[instance_id] = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+    def delete(self, instance_id):
+        self._data.pop(instance_id, None)
+
+    def new_stats_slot(self):
+        self._stats_slots += 1
+        return self._stats_slots
+
+    def get_stats(self):
+        return [pickle.loads(stats) for stats in self._stats.itervalues()]
+
+    def set_stats(self, slot, stats):
+        self._stats[slot] = pickle.dumps(stats, pickle.HIGHEST_PROTOCOL)
+
+    def clear(self):
+        self._data = {}
+        self._stats = {}
+        self._stats_slots = 0
+
+
+def set_store(store):
+    """
+    Use the given shared store rather than the one configured in settings
+    (None reverts to the configured store)
+    """
+    global _store, _stats_slot
+    _store = store
+    _stats_slot = None
+
+
+def _get_store():
+    if _store is not None:
+        return _store
+
+    if settings.OBJECT_CACHES_SHARED_CACHE:
+        return DjangoCacheAdjunctStore(
+            settings.OBJECT_CACHES_SHARED_CACHE,
+            settings.OBJECT_CACHES_SHARED_CACHE_TIMEOUT)
+    else:
+        return None
+
+
+# ------------------------------------------------------------------------
+# Invalidation listener
+
+
+def _listen(channel):
+    while True:
+        try:
+            _listen_on_connection(channel)
+        except Exception:
+            logger.exception('Lost adjunct invalidation listener connection')
+
+        # Notifications may have been missed while disconnected
+        _evict_all()
+        time.sleep(LISTENER_RETRY_INTERVAL)
+
+
+def _listen_on_connection(channel):
+    import psycopg2
+    import psycopg2.extensions
+
+    params = connections['default'].get_connection_params()
+    conn = psycopg2.connect(**params)
+
+    try:
+        conn.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        conn.cursor().execute('LISTEN "%s"' % channel.replace('"', '""'))
+
+        # Anything cached before we started listening may be stale
+        _evict_all()
+
+        while True:
+            if select.select([conn], [], [], 60) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                _handle_notification(conn.notifies.pop(0).payload)
+    finally:
+        conn.close()
+
+
+def _handle_notification(payload):
+    if payload == _ITREE_REGIONS_CHANGED:
+        itree_region_index.clear()
+        return
+
+    try:
+        instance_id, timestamp = [int(part) for part in payload.split(':')]
+    except ValueError:
+        logger.warning('Bad adjunct invalidation payload: %r' % payload)
+        return
+
+    if timestamp > _notified_timestamps.get(instance_id, 0):
+        _notified_timestamps[instance_id] = timestamp
+
+    adjuncts = _adjuncts.peek(instance_id)
+    if adjuncts is not None and adjuncts.timestamp < timestamp:
+        _adjuncts.delete(instance_id)
+
+
+def _evict_all():
+    _adjuncts.clear()
+    itree_region_index.clear()
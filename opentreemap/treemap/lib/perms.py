@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 from __future__ import division
 
 from django.contrib.gis.db.models import Field
+from treemap.lib.object_caches import compiled_role_permissions
 from treemap.models import InstanceUser, Role
 
 """
@@ -48,8 +49,8 @@ def _allows_perm(role_related_obj, model_name,
     or a custom value.
 
     perm_attr is the minimum permission value necessary to consider
-    the perm present in this context. Should correspond to an attr
-    on the FieldPermission class.
+    the perm present in this context. Should be ALLOWS_READS or
+    ALLOWS_WRITES.
 
     field/fields is the fields to use in conjunction with predicate and
     perm_attr.
@@ -92,7 +93,7 @@ def _allows_perm(role_related_obj, model_name,
     if feature_name and not role.instance.feature_enabled(feature_name):
         return False
 
-    perms = {perm for perm in role.model_permissions(model_name)}
+    perms = compiled_role_permissions(role, role.instance, model_name)
 
     # process args
     if field and fields:
@@ -108,10 +109,20 @@ def _allows_perm(role_related_obj, model_name,
     fields = {field.name if isinstance(field, Field) else field
               for field in fields}
 
+    # Only fields with a FieldPermission are considered
     if fields:
-        perms = {perm for perm in perms if perm.field_name in fields}
+        fields = {field for field in fields if field in perms.levels}
+    else:
+        fields = perms.levels
+
+    if perm_attr == ALLOWS_WRITES:
+        allowed = perms.writable
+    elif perm_attr == ALLOWS_READS:
+        allowed = perms.readable
+    else:
+        raise ValueError("Unknown perm_attr '%s'" % perm_attr)
 
-    perm_attrs = {getattr(perm, perm_attr) for perm in perms}
+    perm_attrs = {field in allowed for field in fields}
 
     # TODO: find a better way to support 'all'
     # this is a hack around a quirk, that all([]) == True.
@@ -123,6 +134,28 @@ def _allows_perm(role_related_obj, model_name,
         return predicate(perm_attrs)
 
 
+def allows_read(role_related_obj, model_name, field=None, fields=None,
+                predicate=any):
+    """
+    Whether any (or, with predicate=all, all) of the given fields of the
+    model, or of all of the model's fields, can be read by the role
+    """
+    return _allows_perm(role_related_obj, model_name,
+                        predicate=predicate, perm_attr=ALLOWS_READS,
+                        field=field, fields=fields)
+
+
+def allows_write(role_related_obj, model_name, field=None, fields=None,
+                 predicate=any):
+    """
+    Whether any (or, with predicate=all, all) of the given fields of the
+    model, or of all of the model's fields, can be written by the role
+    """
+    return _allows_perm(role_related_obj, model_name,
+                        predicate=predicate, perm_attr=ALLOWS_WRITES,
+                        field=field, fields=fields)
+
+
 def _invalid_instanceuser(instanceuser):
     return (instanceuser is None or
             instanceuser == '' or
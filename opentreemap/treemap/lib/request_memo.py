@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import threading
+
+# Remember values which are looked up repeatedly while handling a request,
+# such as the requesting user's InstanceUser, so that each is only queried
+# once per request.
+#
+# RequestMemoMiddleware starts a memo when a request begins and discards it
+# when the response is returned. Outside of a request (in tests, tasks and
+# management commands) nothing is remembered. Values which may change
+# during a request must be forgotten when they do, e.g. by connecting
+# forget_all to the model's save and delete signals.
+
+_memo = threading.local()
+
+# ------------------------------------------------------------------------
+# Interface functions
+
+
+def memoized(key, compute):
+    """
+    Returns the value remembered for key in this request, calling compute()
+    to get it if there is none
+    """
+    values = getattr(_memo, 'values', None)
+
+    if values is None:
+        return compute()
+
+    if key not in values:
+        values[key] = compute()
+
+    return values[key]
+
+
+def forget_all(*args, **kwargs):
+    # Also called by 'save' and 'delete' signal handlers
+    if getattr(_memo, 'values', None) is not None:
+        _memo.values = {}
+
+
+def begin():
+    _memo.values = {}
+
+
+def end():
+    _memo.values = None
+
+
+class RequestMemoMiddleware(object):
+    def process_request(self, request):
+        begin()
+
+    def process_response(self, request, response):
+        end()
+        return response
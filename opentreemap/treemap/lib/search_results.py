@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+from django.conf import settings
+
+from treemap.lib.lru_cache import LRUCache
+
+# Cache the number of objects matching a search, which is counted several
+# times for the same search (for the search results, eco benefits and
+# display).
+#
+# Keys include the instance's search hash, which changes whenever an audit
+# record is written, the eco benefit conversion changes or a boundary of
+# the instance is edited (see search.get_search_hash), so counts are never
+# used once the objects they describe have been edited.
+
+_counts = LRUCache(settings.SEARCH_RESULT_CACHE_SIZE)
+
+# ------------------------------------------------------------------------
+# Interface functions
+
+
+def get_object_count(filter, ModelClass):
+    """
+    Returns the number of ModelClass objects matching a search.Filter
+    """
+    key = _result_key(filter, ModelClass)
+    count = _counts.get(key)
+
+    if count is None:
+        count = filter.get_objects(ModelClass).count()
+        _counts.set(key, count)
+
+    return count
+
+
+def search_result_stats():
+    return _counts.stats()
+
+
+def clear():
+    _counts.clear()
+
+
+# ------------------------------------------------------------------------
+# Helpers
+
+
+def _result_key(filter, ModelClass):
+    return (filter.instance.pk,
+            ModelClass.__name__,
+            filter.search_hash,
+            filter.normalized_filterstr,
+            filter.normalized_displaystr)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+from django.conf import settings
+from django.db import connection
+
+# Indexes on the values of scalar UDFs, cast to the SQL types they are
+# searched with (see TypedUDFValue in treemap/udf.py), so that searching
+# numeric and date UDFs by range doesn't scan every row of the instance.
+#
+# Each index covers a single UDF definition and only the rows of its
+# instance. Searches and indexes both use search_expression(), which casts
+# with functions that return NULL for values which can't be cast (created
+# by migration 0106), since other instances and other MapFeature types
+# may store anything under the same name, and PostgreSQL may cast their
+# values before checking the instance. Empty values are also NULL.
+#
+# Indexes are built by a celery task when a definition is created, and
+# dropped when it is deleted. Outside a transaction they are built
+# CONCURRENTLY, so that writes to the table aren't blocked while the index
+# is built. Any missing indexes (e.g. ones dropped by a migration) are
+# built after migrating.
+
+# Functions casting text to each SQL type, returning NULL on failure. The
+# timestamp cast only accepts the ISO format dates are stored in, which
+# makes it IMMUTABLE, as index expressions must be.
+_SAFE_CASTS = {
+    'float8': 'udf_to_float8',
+    'timestamp': 'udf_iso_to_timestamp',
+}
+
+# ------------------------------------------------------------------------
+# Interface functions
+
+
+def index_name(udf_def):
+    return 'udf_search_%s' % udf_def.pk
+
+
+def search_expression(udfs_column, sql_type):
+    """
+    Returns the SQL expression which searches and indexes use for the
+    values in an hstore column of UDF values, cast to sql_type, with a
+    %s placeholder for the name of the UDF
+    """
+    value = "NULLIF(%s -> %%s, '')" % udfs_column
+    cast = _SAFE_CASTS.get(sql_type)
+
+    if cast:
+        return '%s(%s)' % (cast, value)
+    else:
+        return '%s::%s' % (value, sql_type)
+
+
+def create_index(udf_def):
+    """
+    Creates the search index of a UDF definition if it is searched with a
+    cast and has no index. Returns True if an index was created.
+    """
+    sql_type = udf_def.search_sql_type
+
+    if not settings.UDF_SEARCH_INDEXES or sql_type is None:
+        return False
+
+    name = index_name(udf_def)
+    cursor = connection.cursor()
+
+    cursor.execute('SELECT indisvalid FROM pg_index '
+                   'JOIN pg_class ON pg_class.oid = pg_index.indexrelid '
+                   'WHERE pg_class.relname = %s', [name])
+    row = cursor.fetchone()
+    if row:
+        is_valid, = row
+        if is_valid:
+            return False
+        # A concurrent build failed, leaving an index which isn't used
+        drop_index(udf_def)
+
+    # CONCURRENTLY can't be used in a transaction
+    concurrently = 'CONCURRENTLY ' if connection.get_autocommit() else ''
+
+    qn = connection.ops.quote_name
+    cursor.execute(
+        'CREATE INDEX %s%s ON %s ((%s)) WHERE instance_id = %%s'
+        % (concurrently, qn(name), qn(_table_with_udfs(udf_def)),
+           search_expression('udfs', sql_type)),
+        [udf_def.name, udf_def.instance_id])
+
+    return True
+
+
+def drop_index(udf_def):
+    cursor = connection.cursor()
+    cursor.execute('DROP INDEX IF EXISTS %s'
+                   % connection.ops.quote_name(index_name(udf_def)))
+
+
+def create_all_indexes():
+    """
+    Creates any missing search indexes, returning the number created
+    """
+    from treemap.udf import UserDefinedFieldDefinition
+
+    return sum(create_index(udf_def) for udf_def
+               in UserDefinedFieldDefinition.objects.filter(
+                   iscollection=False))
+
+
+def udf_def_saved(sender, **kwargs):
+    # Called by 'save' signal handler for UserDefinedFieldDefinition
+    from treemap.tasks import create_udf_search_index  # circular import
+
+    udf_def = kwargs['instance']  # 'instance' is a Django term here
+    if (kwargs['created'] and settings.UDF_SEARCH_INDEXES
+            and udf_def.search_sql_type is not None):
+        create_udf_search_index.delay(udf_def.pk)
+
+
+def create_missing_indexes(sender, **kwargs):
+    # Called by South's 'post_migrate' signal handler
+    if kwargs['app'] == 'treemap':
+        create_all_indexes()
+
+
+def udf_def_deleted(sender, **kwargs):
+    # Called by 'delete' signal handler for UserDefinedFieldDefinition
+    drop_index(kwargs['instance'])
+
+
+# ------------------------------------------------------------------------
+# Helpers
+
+
+def _table_with_udfs(udf_def):
+    from treemap.udf import safe_get_udf_model_class
+
+    Model = safe_get_udf_model_class(udf_def.model_type)
+
+    # The udfs of MapFeature subclasses are stored in the MapFeature table
+    __, parent_model, __, __ = Model._meta.get_field_by_name('udfs')
+    return (parent_model or Model)._meta.db_table
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+from django.core.management.base import BaseCommand, CommandError
+
+from treemap.lib import object_caches
+from treemap.models import Instance
+
+
+class Command(BaseCommand):
+    """
+    Reports the adjunct cache statistics (hit and miss ratios, and the size
+    and load time of each cached instance's roles, field permissions and
+    UDF definitions) which the running processes have published to the
+    shared cache, for the given instances or for all instances
+    """
+    args = '[instance_url_name ...]'
+
+    def handle(self, *args, **options):
+        all_stats = object_caches.published_adjunct_cache_stats()
+
+        if all_stats is None:
+            raise CommandError(
+                'Processes only publish their adjunct cache statistics '
+                'when OBJECT_CACHES_SHARED_CACHE is set')
+
+        if not all_stats:
+            print('No processes have published adjunct cache statistics')
+            return
+
+        print('%-30s %8s %8s %8s %8s %8s %8s' % (
+            'process', 'cached', 'hits', 'misses', 'hit %', 'stale',
+            'evicted'))
+
+        for process, stats in sorted(all_stats.iteritems()):
+            print('%-30s %8d %8d %8d %8s %8d %8d' % (
+                process, stats['size'], stats['hits'], stats['misses'],
+                _percent(stats['hits'], stats['hits'] + stats['misses']),
+                stats['stale_loads'], stats['evictions']))
+
+        instances = Instance.objects.all()
+        if args:
+            instances = instances.filter(url_name__in=args)
+        url_names = dict(instances.values_list('pk', 'url_name'))
+
+        # Each process has its own copy of an instance's adjuncts
+        entries = {}
+        for stats in all_stats.itervalues():
+            for instance_id, entry in stats['instances'].iteritems():
+                if instance_id in url_names:
+                    entries.setdefault(instance_id, []).append(entry)
+
+        print()
+        print('%-30s %9s %8s %8s %8s %8s %10s %10s' % (
+            'instance', 'processes', 'hits', 'users', 'perms', 'udfs',
+            'bytes', 'load (ms)'))
+
+        for url_name, instance_id, instance_entries in sorted(
+                (url_names[instance_id], instance_id, instance_entries)
+                for instance_id, instance_entries in entries.iteritems()):
+            latest = max(instance_entries, key=lambda e: e['timestamp'])
+            # Measured here rather than by every process as it publishes
+            size = object_caches.shared_adjunct_bytes(instance_id)
+            print('%-30s %9d %8d %8d %8d %8d %10s %10.1f' % (
+                url_name, len(instance_entries),
+                sum(entry['hits'] for entry in instance_entries),
+                latest['users'], latest['permissions'], latest['udf_defs'],
+                size if size is not None else '-',
+                sum(entry['load_time'] for entry in instance_entries) * 1000))
+
+
+def _percent(part, whole):
+    if whole == 0:
+        return '-'
+    return '%.1f' % (100 * part / whole)
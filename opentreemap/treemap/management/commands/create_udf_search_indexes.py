@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+from django.core.management.base import BaseCommand
+
+from treemap.lib import udf_indexes
+
+
+class Command(BaseCommand):
+    """
+    Creates the search indexes of scalar UDFs which were defined before
+    search indexes were created automatically
+    """
+    def handle(self, *args, **options):
+        n_created = udf_indexes.create_all_indexes()
+        print('Created %s UDF search indexes' % n_created)
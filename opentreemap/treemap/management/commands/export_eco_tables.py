@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import json
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from treemap import ecobackend, ecoengine
+from treemap.species.codes import all_itree_region_codes
+
+
+class Command(BaseCommand):
+    """
+    Writes the i-Tree lookup tables used by the local eco benefits engine
+    (one <region code>.json file per region) to the given directory, by
+    asking the ecoservice for the benefits of every i-Tree code at each
+    breakpoint. The interpolated values are then checked against the
+    ecoservice at diameters between the breakpoints.
+
+    With --check, only checks the tables already in the directory.
+
+    With --record, also writes every ecoservice response to a file, which
+    can be added to treemap/tests/resources/eco/recorded to check the
+    engine against in the tests.
+    """
+    args = '<output directory>'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-r', '--region',
+                    action='append',
+                    dest='regions',
+                    default=[],
+                    help='i-Tree region to export (default all)'),
+        make_option('-c', '--check',
+                    action='store_true',
+                    dest='check',
+                    default=False,
+                    help='Check the existing tables instead of exporting'),
+        make_option('-t', '--tolerance',
+                    action='store',
+                    type='float',
+                    dest='tolerance',
+                    default=0.01,
+                    help=('Largest relative difference from the '
+                          'ecoservice allowed between breakpoints')),
+        make_option('--record',
+                    action='store',
+                    dest='record',
+                    default=None,
+                    help='File to write the ecoservice responses to'))
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: export_eco_tables %s' % self.args)
+
+        directory = args[0]
+        regions = options['regions'] or sorted(all_itree_region_codes())
+        responses = {region_code: [] for region_code in regions}
+
+        def tree_benefits(otm_code, diameter, region_code):
+            params = {'otmcode': otm_code,
+                      'diameter': diameter,
+                      'region': region_code}
+            rawb, error = ecobackend.json_benefits_call(
+                'eco.json', params.iteritems())
+
+            if rawb:
+                responses[region_code].append(
+                    {'otmcode': otm_code,
+                     'diameter': diameter,
+                     'benefits': rawb['Benefits']})
+            return (rawb, error)
+
+        if options['check']:
+            engine = ecoengine.LocalEcoEngine.from_directory(directory)
+        else:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            tables = {}
+            for region_code in regions:
+                table, failed = ecoengine.export_region_table(
+                    region_code, tree_benefits)
+                if failed:
+                    print('%s: no benefits for %s' % (
+                        region_code, ', '.join(failed)))
+
+                with open(os.path.join(directory, region_code + '.json'),
+                          'w') as f:
+                    json.dump(table, f, indent=2, sort_keys=True)
+
+                tables[region_code] = table
+
+            engine = ecoengine.LocalEcoEngine(tables)
+
+        n_differences = 0
+        for region_code in regions:
+            if not engine.has_region(region_code):
+                raise CommandError('No table for region %s' % region_code)
+
+            diameters = ecoengine.diameters_between_breakpoints(
+                engine.breakpoints(region_code))
+            differences = ecoengine.compare_with_ecoservice(
+                engine, region_code, tree_benefits, diameters,
+                options['tolerance'])
+
+            for otm_code, diameter, factor, expected, actual in differences:
+                print('%s %s at %.2f in: %s is %s, ecoservice has %s' % (
+                    region_code, otm_code, diameter, factor, actual,
+                    expected))
+            n_differences += len(differences)
+
+        if options['record']:
+            with open(options['record'], 'w') as f:
+                json.dump({region_code:
+                           {'dbh_breakpoints': engine.breakpoints(region_code),
+                            'responses': responses[region_code]}
+                           for region_code in regions},
+                          f, indent=2, sort_keys=True)
+
+        if n_differences:
+            raise CommandError(
+                '%d benefits differ from the ecoservice between '
+                'breakpoints by more than %s' % (
+                    n_differences, options['tolerance']))
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+from django.core.management.base import BaseCommand
+
+from treemap.models import Instance
+
+
+class Command(BaseCommand):
+    """
+    Finds the i-Tree regions intersecting the bounds of each instance and
+    stores their codes on the instance
+    """
+    def handle(self, *args, **options):
+        for instance in Instance.objects.order_by('url_name'):
+            instance.update_itree_region_codes()
+            print('%s: %s' % (instance.url_name,
+                              ', '.join(instance.itree_region_codes())
+                              or 'no i-Tree regions'))
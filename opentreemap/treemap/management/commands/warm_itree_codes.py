@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+from django.core.management.base import BaseCommand
+
+from treemap.lib import itree_codes
+
+
+class Command(BaseCommand):
+    """
+    Fetches the i-Tree codes known to the ecoservice and writes them to
+    the cache file shared by all processes
+    """
+    def handle(self, *args, **options):
+        if itree_codes.refresh():
+            print('Updated i-Tree code cache')
+        else:
+            print('Failed to retrieve i-Tree codes from the ecoservice')
@@ -16,6 +16,7 @@ from django.http import Http404
 from django.contrib.gis.db import models
 from django.contrib.gis.measure import D
 from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
@@ -32,7 +33,13 @@ from treemap.images import save_uploaded_image
 from treemap.units import Convertible
 from treemap.udf import UDFModel, GeoHStoreUDFManager
 from treemap.instance import Instance
-from treemap.lib.object_caches import invalidate_adjuncts
+from treemap.json_field import JSONField
+from treemap.lib.object_caches import (invalidate_adjuncts,
+                                       invalidate_itree_regions)
+from treemap.lib import request_memo
+from treemap.lib.benefit_caches import invalidate_itree_code_overrides
+from treemap.lib import benefit_aggregates
+from treemap.lib import itree_region_index
 
 
 def _action_format_string_for_location(action):
@@ -201,15 +208,15 @@ class BenefitCurrencyConversion(Dictable, models.Model):
         Returns a new BenefitCurrencyConversion for the i-Tree region that
         contains the given point.
         """
-        regions_covered = ITreeRegion.objects.filter(geometry__contains=point)
+        region_codes = itree_region_index.region_codes_containing(point)
 
-        if len(regions_covered) > 1:
+        if len(region_codes) > 1:
             raise MultipleObjectsReturned(
                 "There should not be overlapping i-Tree regions")
-        elif len(regions_covered) == 0:
+        elif len(region_codes) == 0:
             return None
 
-        region_code = regions_covered[0].code
+        region_code = region_codes[0]
 
         return cls.get_default_for_region(region_code)
 
@@ -362,6 +369,11 @@ class User(AbstractUniqueEmailUser, Auditable):
         return self.organization if self.make_info_public else ''
 
     def get_instance_user(self, instance):
+        return request_memo.memoized(
+            ('instance_user', self.pk, instance.pk),
+            lambda: self._get_instance_user(instance))
+
+    def _get_instance_user(self, instance):
         try:
             return InstanceUser.objects.get(user=self, instance=instance)
         except InstanceUser.DoesNotExist:
@@ -493,6 +505,10 @@ class Species(UDFModel, PendingAuditable):
         unique_together = ('instance', 'common_name', 'genus', 'species',
                            'cultivar', 'other_part_of_name',)
 
+# A species' otm_code determines the i-Tree codes of its trees
+post_save.connect(benefit_aggregates.invalidate_species, sender=Species)
+post_delete.connect(benefit_aggregates.invalidate_species, sender=Species)
+
 
 class InstanceUser(Auditable, models.Model):
     instance = models.ForeignKey(Instance)
@@ -517,6 +533,8 @@ class InstanceUser(Auditable, models.Model):
 
 post_save.connect(invalidate_adjuncts, sender=InstanceUser)
 post_delete.connect(invalidate_adjuncts, sender=InstanceUser)
+post_save.connect(request_memo.forget_all, sender=InstanceUser)
+post_delete.connect(request_memo.forget_all, sender=InstanceUser)
 
 
 class MapFeature(Convertible, UDFModel, PendingAuditable):
@@ -755,11 +773,26 @@ class Plot(MapFeature):
         else:
             return None
 
+    def save_with_user(self, user, *args, **kwargs):
+        # Moving a plot may move its tree into a different boundary
+        # or i-Tree region
+        if 'geom' in self._updated_fields():
+            with benefit_aggregates.updating_trees(self.instance,
+                                                   self.tree_set.all):
+                super(Plot, self).save_with_user(user, *args, **kwargs)
+        else:
+            super(Plot, self).save_with_user(user, *args, **kwargs)
+
     def delete_with_user(self, user, cascade=False, *args, **kwargs):
         if self.current_tree() and cascade is False:
             raise ValidationError(_(
                 "Cannot delete plot with existing trees."))
-        super(Plot, self).delete_with_user(user, *args, **kwargs)
+
+        # Deleting the plot clears its pk
+        plot_id = self.pk
+        with benefit_aggregates.updating_trees(
+                self.instance, lambda: Tree.objects.filter(plot_id=plot_id)):
+            super(Plot, self).delete_with_user(user, *args, **kwargs)
 
     @classproperty
     def display_name(cls):
@@ -812,13 +845,7 @@ class Tree(Convertible, UDFModel, PendingAuditable):
         if self.instance.itree_region_default:
             region = self.instance.itree_region_default
         else:
-            regions = ITreeRegion.objects\
-                                 .filter(geometry__contains=self.plot.geom)
-
-            if len(regions) > 0:
-                region = regions[0].code
-            else:
-                region = None
+            region = itree_region_index.region_code_for_point(self.plot.geom)
 
         return region
 
@@ -834,7 +861,9 @@ class Tree(Convertible, UDFModel, PendingAuditable):
     def save_with_user(self, user, *args, **kwargs):
         self.full_clean_with_user(user)
         self.plot.update_updated_at()
-        super(Tree, self).save_with_user(user, *args, **kwargs)
+        with benefit_aggregates.updating_trees(
+                self.instance, lambda: Tree.objects.filter(pk=self.pk)):
+            super(Tree, self).save_with_user(user, *args, **kwargs)
 
     @property
     def hash(self):
@@ -869,7 +898,12 @@ class Tree(Convertible, UDFModel, PendingAuditable):
         for photo in photos:
             photo.delete_with_user(user)
         self.plot.update_updated_at()
-        super(Tree, self).delete_with_user(user, *args, **kwargs)
+
+        # Deleting the tree clears its pk
+        tree_id = self.pk
+        with benefit_aggregates.updating_trees(
+                self.instance, lambda: Tree.objects.filter(pk=tree_id)):
+            super(Tree, self).delete_with_user(user, *args, **kwargs)
 
 
 class Favorite(models.Model):
@@ -1021,6 +1055,20 @@ class Boundary(models.Model):
         return self.name
 
 
+def _invalidate_boundary_searches(*args, **kwargs):
+    # Called by the 'save' signal handler for Boundary. Its geometry may
+    # have changed, which changes the results of searches within it (see
+    # search.get_search_hash) and the instances' map tiles. Also increment
+    # the adjuncts timestamps, so cached instances see the new geo_rev.
+    boundary = kwargs['instance']  # 'instance' is a Django term here
+    Instance.objects.filter(boundaries=boundary).update(
+        geo_rev=F('geo_rev') + 1,
+        adjuncts_timestamp=F('adjuncts_timestamp') + 1)
+
+post_save.connect(_invalidate_boundary_searches, sender=Boundary)
+post_save.connect(benefit_aggregates.invalidate_boundary, sender=Boundary)
+
+
 class ITreeRegion(models.Model):
     code = models.CharField(max_length=40, unique=True)
     geometry = models.MultiPolygonField(srid=3857)
@@ -1028,6 +1076,20 @@ class ITreeRegion(models.Model):
     objects = models.GeoManager()
 
 
+def _invalidate_itree_region_codes(*args, **kwargs):
+    # Called by 'save' and 'delete' signal handlers for ITreeRegion.
+    # Also increment the adjuncts timestamps, so cached instances are
+    # reloaded with the new codes.
+    Instance.objects.update(
+        itree_region_codes_in_bounds=None,
+        adjuncts_timestamp=F('adjuncts_timestamp') + 1)
+
+post_save.connect(_invalidate_itree_region_codes, sender=ITreeRegion)
+post_delete.connect(_invalidate_itree_region_codes, sender=ITreeRegion)
+post_save.connect(invalidate_itree_regions, sender=ITreeRegion)
+post_delete.connect(invalidate_itree_regions, sender=ITreeRegion)
+
+
 class ITreeCodeOverride(models.Model, Auditable):
     instance_species = models.ForeignKey(Species)
     region = models.ForeignKey(ITreeRegion)
@@ -1035,3 +1097,80 @@ class ITreeCodeOverride(models.Model, Auditable):
 
     class Meta:
         unique_together = ('instance_species', 'region',)
+
+post_save.connect(invalidate_itree_code_overrides, sender=ITreeCodeOverride)
+post_delete.connect(invalidate_itree_code_overrides,
+                    sender=ITreeCodeOverride)
+post_save.connect(benefit_aggregates.invalidate_itree_code_overrides,
+                  sender=ITreeCodeOverride)
+post_delete.connect(benefit_aggregates.invalidate_itree_code_overrides,
+                    sender=ITreeCodeOverride)
+
+
+class BenefitAggregate(models.Model):
+    """
+    Raw eco benefit totals for the trees of an instance, or for the trees
+    of an instance within a boundary. Maintained by
+    treemap.lib.benefit_aggregates.
+    """
+    instance = models.ForeignKey(Instance)
+    boundary = models.ForeignKey(Boundary, null=True, blank=True)
+
+    benefits = JSONField(blank=True)
+    n_trees_computed = models.IntegerField(default=0)
+    n_trees_total = models.IntegerField(default=0)
+
+    # Set when a change affects the benefits of many of the instance's
+    # trees, until a celery worker has rebuilt the totals. The revision is
+    # incremented on every change to a stale aggregate, so a rebuild can
+    # tell if the trees changed while it was running.
+    is_stale = models.BooleanField(default=False)
+    revision = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('instance', 'boundary',)
+
+
+class BenefitSummaryJob(models.Model):
+    """
+    An eco benefit summary of a search, computed by a celery worker
+    (see treemap.tasks). Requests for the same summary share a job, which
+    is found by its key, the key of the summary in the filter benefit
+    cache.
+    """
+    FAILED = -1
+    PENDING = 0
+    COMPLETE = 1
+
+    STATUS_STRINGS = {
+        FAILED: 'FAILED',
+        PENDING: 'PENDING',
+        COMPLETE: 'COMPLETE',
+    }
+
+    STATUS_CHOICES = {
+        FAILED: _('Something went wrong with the eco benefit summary.'),
+        PENDING: _('Pending'),
+        COMPLETE: _('Ready'),
+    }
+
+    instance = models.ForeignKey(Instance)
+    key = models.CharField(max_length=255, db_index=True)
+    # The summary's labels are translated into this language
+    language = models.CharField(max_length=10)
+    filterstr = models.TextField(blank=True)
+    displaystr = models.TextField(blank=True)
+
+    status = models.IntegerField(choices=STATUS_CHOICES.items(),
+                                 default=PENDING)
+    # A list of [benefits, basis, margins], as returned by
+    # get_benefits_for_filter
+    result = JSONField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def complete_with(self, benefits, basis, margins):
+        self.result = [benefits, basis, margins]
+        self.status = self.COMPLETE
+
+    def fail(self):
+        self.status = self.FAILED
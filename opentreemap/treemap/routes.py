@@ -203,6 +203,16 @@ search_tree_benefits = do(
     render_template('treemap/partials/eco_benefits.html'),
     tree_views.search_tree_benefits)
 
+begin_search_tree_benefits = do(
+    json_api_call,
+    instance_request,
+    tree_views.begin_search_tree_benefits)
+
+check_search_tree_benefits = do(
+    json_api_call,
+    instance_request,
+    tree_views.check_search_tree_benefits)
+
 add_tree_photo = add_map_feature_photo_do(tree_views.add_tree_photo)
 
 #####################################
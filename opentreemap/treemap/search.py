@@ -3,10 +3,14 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import division
 
-from json import loads
+import hashlib
+
+from collections import Counter, namedtuple
+from json import loads, dumps
 from datetime import datetime
-from functools import partial
+from numbers import Number
 
+from django.conf import settings
 from django.db.models import Q
 
 from django.contrib.gis.measure import Distance
@@ -14,10 +18,18 @@ from django.contrib.gis.geos import Point
 
 from opentreemap.util import dotted_split
 
+from treemap.audit import Audit
 from treemap.lib.dates import DATETIME_FORMAT
-from treemap.models import Boundary, Tree, Plot, Species, TreePhoto
-from treemap.udf import UDFModel, UserDefinedCollectionValue
-from treemap.util import to_object_name
+from treemap.lib import search_results
+from treemap.lib.lru_cache import LRUCache
+from treemap.lib.object_caches import udf_defs
+from treemap.models import (Boundary, Tree, Plot, Species, TreePhoto,
+                            MapFeaturePhoto)
+from treemap.udf import (UDFModel, UserDefinedCollectionValue,
+                         UserDefinedCollectionSearchValue,
+                         UserDefinedFieldDefinition, TypedUDFValue,
+                         UDF_SEARCH_TYPES, UDF_COLLECTION_SEARCH_COLUMNS)
+from treemap.util import to_object_name, to_model_name
 
 
 class ParseException (Exception):
@@ -50,6 +62,7 @@ class Filter(object):
         self.filterstr = filterstr
         self.display_filter = loads(displaystr) if displaystr else None
         self.instance = instance
+        self._search_hash = None
 
     def get_objects(self, ModelClass):
         # Filter out invalid models
@@ -84,7 +97,69 @@ class Filter(object):
         return queryset
 
     def get_object_count(self, ModelClass):
-        return self.get_objects(ModelClass).count()
+        return search_results.get_object_count(self, ModelClass)
+
+    @property
+    def search_hash(self):
+        # Computing the hash takes a query, so it is only done once for
+        # each Filter
+        if self._search_hash is None:
+            self._search_hash = get_search_hash(self.instance)
+        return self._search_hash
+
+    @property
+    def normalized_filterstr(self):
+        return normalize_filter_string(self.filterstr)
+
+    @property
+    def normalized_displaystr(self):
+        if self.display_filter is None:
+            return ''
+        return dumps(sorted(self.display_filter))
+
+
+def normalize_filter_string(filterstr):
+    """
+    Returns the filter string with its keys sorted and insignificant
+    whitespace removed, so equivalent filters produce the same string
+    """
+    if not filterstr:
+        return ''
+    try:
+        return dumps(loads(filterstr), sort_keys=True, separators=(',', ':'))
+    except ValueError:
+        # Invalid filters will raise when parsed, so leave them as-is
+        return filterstr
+
+
+def get_search_hash(instance):
+    """
+    Returns a hash which changes whenever search results or eco benefit
+    values for the instance may have changed
+    """
+    audits = instance.scope_model(Audit)\
+                     .order_by('-updated')
+
+    try:
+        audit_id_str = str(audits[0].pk)
+    except IndexError:
+        audit_id_str = 'none'
+
+    eco_conversion = instance.eco_benefits_conversion
+
+    if eco_conversion:
+        eco_str = eco_conversion.hash
+    else:
+        eco_str = 'none'
+
+    region_str = ','.join(instance.itree_region_codes()) or 'none'
+
+    # Editing a boundary changes the results of searches within it, but
+    # doesn't write an audit record. It increments geo_rev instead.
+    string_to_hash = (audit_id_str + ":" + eco_str + ":" + region_str +
+                      ":" + str(instance.geo_rev))
+
+    return hashlib.md5(string_to_hash).hexdigest()
 
 
 def _is_valid_models_list_for_model(models, model_name, ModelClass, instance):
@@ -162,9 +237,10 @@ def create_filter(instance, filterstr, mapping):
 
     Returns a Q object that can be applied to a model of your choice
     """
-    if filterstr is not None and filterstr != '':
-        query = loads(filterstr)
-        q = _parse_filter(query, mapping)
+    node = compile_filter(filterstr, mapping)
+
+    if node is not None:
+        q = _node_to_q(node, instance)
     else:
         q = FilterContext()
 
@@ -174,18 +250,529 @@ def create_filter(instance, filterstr, mapping):
     return q
 
 
-def _parse_filter(query, mapping):
+# ------------------------------------------------------------------------
+# Compiled filters
+#
+# Filter strings are parsed and validated once into an immutable AST,
+# which is kept in an LRU cache keyed by the filter string and mapping.
+# A new Q object is built from the AST each time one is needed, since Q
+# objects are modified when they are combined.
+#
+# The AST is made of CombinatorNodes, whose children are other nodes,
+# and PredicateNodes, whose lookups are a sorted tuple of (Django lookup,
+# value) pairs. Collection UDF predicates are CollectionPredicateNodes,
+# whose lookups are on model (UserDefinedCollectionSearchValue if the
+# subfield has a search column, otherwise UserDefinedCollectionValue) and
+# which match the search_key of models with a matching collection value.
+# The optimizer
+# adds RelatedPredicateNodes, which match the search_key of objects with
+# a related object (referring to them with field) matching every tuple of
+# lookups in lookup_groups.
+#
+# Values must not be modified. Values which have to be read from the
+# database, such as boundary geometries, are resolved when a Q object is
+# built, so cached filters never hold on to stale data.
+
+CombinatorNode = namedtuple('CombinatorNode', ['combinator', 'children'])
+
+PredicateNode = namedtuple('PredicateNode', ['basekey', 'lookups'])
+
+CollectionPredicateNode = namedtuple(
+    'CollectionPredicateNode',
+    ['basekey', 'search_key', 'field_definition_id', 'model', 'lookups'])
+
+RelatedPredicateNode = namedtuple(
+    'RelatedPredicateNode',
+    ['basekey', 'search_key', 'model', 'field', 'lookup_groups'])
+
+
+class BoundaryGeom(namedtuple('BoundaryGeom', ['boundary_id'])):
+    def resolve(self):
+        return Boundary.objects.get(pk=self.boundary_id).geom
+
+
+_compiled_filters = LRUCache(settings.SEARCH_FILTER_CACHE_SIZE)
+
+
+def compile_filter(filterstr, mapping):
+    """
+    Returns the AST of the given filter string (see create_filter) for
+    the given mapping, or None if the filter string is empty
+    """
+    if filterstr is None or filterstr == '':
+        return None
+
+    optimize = settings.SEARCH_OPTIMIZE_FILTERS
+    key = (filterstr, tuple(sorted(mapping.iteritems())), optimize)
+    node = _compiled_filters.get(key)
+
+    if node is None:
+        node = _compile_filter(loads(filterstr), mapping)
+        if optimize:
+            node = optimize_filter(node)
+        _compiled_filters.set(key, node)
+
+    return node
+
+
+def compiled_filter_stats():
+    return _compiled_filters.stats()
+
+
+def clear_compiled_filters():
+    _compiled_filters.clear()
+
+
+def _compile_filter(query, mapping):
     if type(query) is dict:
-        return _parse_predicate(query, mapping)
+        return _compile_predicate(query, mapping)
     elif type(query) is list:
-        predicates = [_parse_filter(p, mapping) for p in query[1:]]
-        return _apply_combinator(query[0], predicates)
+        if len(query) == 0:
+            raise ParseException('Empty filter list is not allowed')
+        children = [_compile_filter(p, mapping) for p in query[1:]]
+        return _compile_combinator(query[0], children)
+    else:
+        raise ParseException(
+            'Filters must be objects or lists, not "%s"' % query)
+
+
+def _compile_predicate(query, mapping):
+    nodes = [_compile_predicate_pair(*kv, mapping=mapping)
+             for kv in query.iteritems()]
+    return _compile_combinator('AND', nodes)
+
+
+def _compile_combinator(combinator, children):
+    """
+    Returns a node applying the combinator to the children, with nested
+    uses of the same combinator flattened
+    """
+    if combinator not in ('AND', 'OR'):
+        raise ParseException(
+            'Only AND and OR combinators supported, not "%s"' %
+            combinator)
+    if len(children) == 0:
+        raise ParseException(
+            'Empty predicate list is not allowed')
+
+    if len(children) == 1:
+        return children[0]
+
+    flattened = []
+    for child in children:
+        if (isinstance(child, CombinatorNode)
+                and child.combinator == combinator):
+            flattened.extend(child.children)
+        else:
+            flattened.append(child)
+
+    return CombinatorNode(combinator, tuple(flattened))
+
+
+def _compile_predicate_pair(key, value, mapping):
+    model, search_key = _parse_predicate_key(key, mapping)
+    __, __, field = key.partition('.')
+
+    if _is_udf(model):
+        __, __, udf_def_pk = model.split(':')
+        column = _collection_search_column(udf_def_pk, field)
+    else:
+        column = None
+
+    if column:
+        if type(value) != dict:
+            value = {'IS': value}
+        preds = _parse_dict_value_for_mapping(
+            COLLECTION_SEARCH_PREDICATE_TYPES, value, column)
+        query = dict(preds, key=field)
+    elif _is_udf(model) and type(value) == dict:
+        preds = _parse_dict_value_for_mapping(
+            HSTORE_PREDICATE_TYPES, value, field)
+        query = {'data' + k: v for (k, v) in preds.iteritems()}
+    elif _is_udf(model):
+        query = {'data__contains': {field: value}}
+    elif type(value) is dict:
+        query = {search_key + k: v for (k, v)
+                 in _parse_dict_value_for_mapping(
+                     PREDICATE_TYPES, value).iteritems()}
+    else:
+        query = {search_key: value}
+
+    lookups = tuple(sorted(query.iteritems()))
+
+    # If the model being searched is a collection UDF, we do an in clause on a
+    # subquery because we can't easily join to UserDefinedCollectionValue
+    if _is_udf(model):
+        if column:
+            values_model = UserDefinedCollectionSearchValue
+        else:
+            values_model = UserDefinedCollectionValue
+        return CollectionPredicateNode(
+            model, search_key, udf_def_pk, values_model, lookups)
+    else:
+        return PredicateNode(model, lookups)
+
+
+def _collection_search_column(udf_def_pk, field):
+    """
+    Returns the column of UserDefinedCollectionSearchValue holding the
+    values of the given collection UDF subfield, or None if they are
+    only in UserDefinedCollectionValue.data
+    """
+    try:
+        udf_def = UserDefinedFieldDefinition.objects\
+            .filter(pk=udf_def_pk, iscollection=True)\
+            .first()
+    except ValueError:
+        return None
+
+    if udf_def is None:
+        return None
+
+    datatype = udf_def.datatype_by_field.get(field, {})
+    return UDF_COLLECTION_SEARCH_COLUMNS.get(datatype.get('type'))
+
+
+def _node_to_q(node, instance=None):
+    if isinstance(node, CombinatorNode):
+        return _apply_combinator(
+            node.combinator,
+            [_node_to_q(child, instance) for child in node.children])
+    elif isinstance(node, CollectionPredicateNode):
+        subquery = node.model.objects\
+            .filter(**_resolve_lookups(node.lookups))\
+            .filter(field_definition=node.field_definition_id)
+        if node.model is UserDefinedCollectionValue:
+            subquery = subquery.distinct('model_id')
+        subquery = subquery.values_list('model_id', flat=True)
+        return FilterContext(basekey=node.basekey,
+                             **{node.search_key + '__in': subquery})
+    elif isinstance(node, RelatedPredicateNode):
+        subquery = node.model.objects.all()
+        for lookups in node.lookup_groups:
+            subquery = subquery.filter(**_resolve_lookups(lookups))
+        subquery = subquery.values_list(node.field, flat=True)
+        return FilterContext(basekey=node.basekey,
+                             **{node.search_key + '__in': subquery})
+    else:
+        lookups = _resolve_lookups(node.lookups)
+        if instance:
+            lookups = {key: _type_udf_value(key, value, node.basekey,
+                                            instance)
+                       for key, value in lookups.iteritems()}
+        return FilterContext(basekey=node.basekey, **lookups)
+
+
+def _resolve_lookups(lookups):
+    return {key: value.resolve() if isinstance(value, BoundaryGeom)
+            else value
+            for key, value in lookups}
+
+
+def _type_udf_value(key, value, basekey, instance):
+    """
+    Returns a TypedUDFValue if the lookup compares the value with a scalar
+    UDF which is searched with a cast, so that the comparison casts the
+    UDF's values to its type and can use its index. Otherwise returns the
+    value unchanged.
+    """
+    parts = key.split('__')
+    udf_indexes = [i for i, part in enumerate(parts)
+                   if part.startswith('udf:')]
+
+    if len(udf_indexes) != 1 or udf_indexes[0] < len(parts) - 2:
+        return value
+
+    index = udf_indexes[0]
+    name = parts[index][len('udf:'):]
+    lookup = parts[index + 1] if index + 1 < len(parts) else 'exact'
+
+    udf_def = next((udf_def for udf_def
+                    in udf_defs(instance, to_model_name(basekey))
+                    if udf_def.name == name and not udf_def.iscollection),
+                   None)
+    sql_type = udf_def.search_sql_type if udf_def else None
+
+    if sql_type is None or lookup not in UDF_SEARCH_TYPES[
+            udf_def.datatype_dict['type']][1]:
+        return value
+
+    if sql_type == 'timestamp':
+        is_valid = isinstance(value, datetime)
+    elif sql_type == 'text':
+        is_valid = isinstance(value, basestring)
+    else:
+        is_valid = isinstance(value, Number) and not isinstance(value, bool)
+
+    if is_valid:
+        return TypedUDFValue(value, sql_type, instance.pk)
+    else:
+        return value
+
+
+def _parse_filter(query, mapping):
+    return _node_to_q(_compile_filter(query, mapping))
+
+
+# ------------------------------------------------------------------------
+# Optimizer
+#
+# Unless SEARCH_OPTIMIZE_FILTERS is False, compiled filters are rewritten
+# before they are cached into filters which match the same objects with
+# cheaper queries:
+#
+#   - repeated predicates under the same combinator are removed
+#   - predicates ANDed together on the same model are merged, keeping the
+#     tightest of any repeated MIN or MAX bounds
+#   - predicates through one-to-many relations (photos) are matched with
+#     a subquery, since joining returned a row for every matching photo.
+#     Lookups ANDed on a relation must match the same related object, so
+#     they share one subquery, or keep the join if nested combinators
+#     refer to the relation too.
+#   - ANDed predicates are ordered by how selective they are likely to be
+
+# Relations which can match several rows for each object searched, with
+# the model they lead to and its field referring back to the object
+_ONE_TO_MANY_RELATIONS = {
+    'mapfeaturephoto': (MapFeaturePhoto, 'map_feature'),
+    'treephoto': (TreePhoto, 'tree'),
+}
+
+_LOWER_BOUNDS = {'gt', 'gte'}
+_UPPER_BOUNDS = {'lt', 'lte'}
+
+# Estimated costs of lookups, from most to least selective
+_LOOKUP_COSTS = {'in': 0, 'isnull': 0,
+                 'gt': 1, 'gte': 1, 'lt': 1, 'lte': 1,
+                 'icontains': 2, 'contains': 2, 'within': 2, 'dwithin': 2}
+_EXACT_COST = 0
+_SUBQUERY_COST = 3
+_COMBINATOR_COST = 4
+
+
+def optimize_filter(node, joined=frozenset()):
+    """
+    Returns an AST matching the same objects as the given AST
+
+    joined is a set of (basekey, relation) pairs of one-to-many relations
+    which must be joined rather than matched with a subquery, because
+    predicates outside of node also refer to them
+    """
+    if isinstance(node, CombinatorNode):
+        children = node.children
+        if node.combinator == 'AND':
+            children = _merge_predicates(children)
+            joined = joined | _shared_relations(children)
+            children = _use_subqueries_for_one_to_many(children, joined)
+            # Predicates have been optimized together
+            children = [optimize_filter(child, joined)
+                        if isinstance(child, CombinatorNode) else child
+                        for child in children]
+        else:
+            children = [optimize_filter(child, joined) for child in children]
+
+        children = _remove_duplicates(children)
+
+        node = _compile_combinator(node.combinator, children)
+
+        if isinstance(node, CombinatorNode) and node.combinator == 'AND':
+            node = node._replace(children=tuple(
+                sorted(node.children, key=_estimated_cost)))
+
+        return node
+
+    elif isinstance(node, PredicateNode):
+        return _compile_combinator(
+            'AND', _use_subqueries_for_one_to_many([node], joined))
+
+    else:
+        return node
+
+
+def _remove_duplicates(nodes):
+    # Values may be unhashable, so nodes can't be put in a set
+    unique = []
+    for node in nodes:
+        if node not in unique:
+            unique.append(node)
+    return unique
+
+
+def _merge_predicates(nodes):
+    merged = []
+    index_by_basekey = {}
+
+    for node in nodes:
+        if isinstance(node, PredicateNode):
+            index = index_by_basekey.get(node.basekey)
+
+            if index is None:
+                index_by_basekey[node.basekey] = len(merged)
+            else:
+                lookups = _merge_lookups(merged[index].lookups, node.lookups)
+                if lookups is not None:
+                    merged[index] = merged[index]._replace(lookups=lookups)
+                    continue
+
+        merged.append(node)
+
+    return merged
+
+
+def _merge_lookups(lookups, other_lookups):
+    """
+    Returns the lookups matching both sets of lookups, or None if they
+    can't be expressed as a single set of lookups
+    """
+    merged = dict(lookups)
+
+    for key, value in other_lookups:
+        if key not in merged or merged[key] == value:
+            merged[key] = value
+        elif _are_comparable(merged[key], value):
+            __, __, lookup_type = key.rpartition('__')
+            if lookup_type in _LOWER_BOUNDS:
+                merged[key] = max(merged[key], value)
+            elif lookup_type in _UPPER_BOUNDS:
+                merged[key] = min(merged[key], value)
+            else:
+                return None
+        else:
+            return None
+
+    return tuple(sorted(merged.iteritems()))
+
+
+def _are_comparable(a, b):
+    if isinstance(a, Number) and isinstance(b, Number):
+        return not isinstance(a, bool) and not isinstance(b, bool)
+    else:
+        return isinstance(a, datetime) and isinstance(b, datetime)
+
+
+def _split_one_to_many_key(key):
+    """
+    Returns a tuple of (one-to-many relation, lookup on the related model)
+    for the given lookup, or (None, key) if it isn't through a one-to-many
+    relation
+    """
+    parts = key.split('__')
+    relation_index = next((i for i, part in enumerate(parts)
+                           if part in _ONE_TO_MANY_RELATIONS), None)
+
+    if relation_index is None:
+        return (None, key)
+    else:
+        return (tuple(parts[:relation_index + 1]),
+                '__'.join(parts[relation_index + 1:]))
+
+
+def _one_to_many_relations(node):
+    if isinstance(node, PredicateNode):
+        return {(node.basekey, _split_one_to_many_key(key)[0])
+                for key, __ in node.lookups} - {(node.basekey, None)}
+    elif isinstance(node, CombinatorNode):
+        return set().union(*[_one_to_many_relations(child)
+                             for child in node.children])
+    else:
+        return set()
+
+
+def _shared_relations(nodes):
+    """
+    Returns the one-to-many relations which both a combinator node and
+    some other of the given ANDed nodes refer to
+    """
+    counts = Counter()
+    in_combinators = set()
+
+    for node in nodes:
+        relations = _one_to_many_relations(node)
+        counts.update(relations)
+        if isinstance(node, CombinatorNode):
+            in_combinators |= relations
+
+    return {relation for relation in in_combinators if counts[relation] > 1}
+
+
+def _use_subqueries_for_one_to_many(nodes, joined):
+    """
+    Returns the given ANDed nodes, with lookups through one-to-many
+    relations matched with subqueries of the related model, except for
+    the relations in joined.
+
+    The lookups ANDed on a relation must all match the same related
+    object, so each relation of a basekey gets a single subquery, even
+    if its predicates couldn't be merged.
+    """
+    result = []
+    groups_by_relation = {}
+    lookups_by_node = []
+
+    for node in nodes:
+        if not isinstance(node, PredicateNode):
+            result.append(node)
+            continue
+
+        plain_lookups = []
+        lookups_by_relation = {}
+
+        for key, value in node.lookups:
+            relation, inner_key = _split_one_to_many_key(key)
+            if relation is None:
+                plain_lookups.append((key, value))
+            else:
+                lookups_by_relation.setdefault(relation, []).append(
+                    (inner_key, value))
+
+        for relation, lookups in lookups_by_relation.iteritems():
+            groups_by_relation.setdefault((node.basekey, relation), [])\
+                .append(tuple(sorted(lookups)))
+
+        lookups_by_node.append((node, plain_lookups, lookups_by_relation))
+
+    # Objects without a related object match "ISNULL" lookups, so those
+    # can't be matched with a subquery of related objects
+    joined = joined | {
+        relation_key
+        for relation_key, groups in groups_by_relation.iteritems()
+        if any(key.endswith('isnull') and value
+               for lookups in groups for key, value in lookups)}
+
+    for node, plain_lookups, lookups_by_relation in lookups_by_node:
+        for relation, lookups in lookups_by_relation.iteritems():
+            if (node.basekey, relation) in joined:
+                plain_lookups.extend(
+                    ('__'.join(relation + (key,)), value)
+                    for key, value in lookups)
+
+        if plain_lookups:
+            result.append(node._replace(lookups=tuple(sorted(plain_lookups))))
+
+    for (basekey, relation), groups in sorted(
+            groups_by_relation.iteritems()):
+        if (basekey, relation) not in joined:
+            model, field = _ONE_TO_MANY_RELATIONS[relation[-1]]
+            search_key = '__'.join(relation[:-1] + ('pk',))
+            result.append(RelatedPredicateNode(
+                basekey, search_key, model, field,
+                tuple(_remove_duplicates(groups))))
+
+    return result
+
+
+def _estimated_cost(node):
+    if isinstance(node, PredicateNode):
+        return min(_LOOKUP_COSTS.get(key.rpartition('__')[2], _EXACT_COST)
+                   for key, __ in node.lookups)
+    elif isinstance(node, CombinatorNode):
+        return _COMBINATOR_COST
+    else:
+        return _SUBQUERY_COST
 
 
 def _parse_predicate(query, mapping):
-    qs = [_parse_predicate_pair(*kv, mapping=mapping)
-          for kv in query.iteritems()]
-    return _apply_combinator('AND', qs)
+    return _node_to_q(_compile_predicate(query, mapping))
 
 
 def _parse_predicate_key(key, mapping):
@@ -280,8 +867,7 @@ def _parse_within_radius_value(predicate_value, field=None):
 
 
 def _parse_in_boundary(boundary_id, field=None):
-    boundary = Boundary.objects.get(pk=boundary_id)
-    return {'__within': boundary.geom}
+    return {'__within': BoundaryGeom(boundary_id)}
 
 
 def _parse_isnull_hstore(value, field):
@@ -366,6 +952,85 @@ HSTORE_PREDICATE_TYPES = {
 }
 
 
+def _parse_search_column_value(value, column):
+    """
+    Converts a value to the type of the given column of
+    UserDefinedCollectionSearchValue
+    """
+    if column == 'value':
+        return value
+
+    parsed_value = _parse_value(value)
+
+    if column == 'date_value':
+        if isinstance(parsed_value, datetime):
+            return parsed_value.date()
+    elif not isinstance(parsed_value, bool):
+        try:
+            return float(parsed_value)
+        except (TypeError, ValueError):
+            pass
+
+    raise ParseException('Invalid value for a %s field: %s'
+                         % (column, value))
+
+
+def _parse_min_max_search_value_fn(operator):
+    parse_min_max = _parse_min_max_value_fn(operator)
+
+    def fn(predicate_value, column):
+        if column == 'value':
+            raise ParseException('Cannot perform min/max comparisons on '
+                                 'choice fields')
+
+        [(key, value)] = parse_min_max(predicate_value).items()
+        return {column + key: _parse_search_column_value(value, column)}
+
+    return fn
+
+
+def _parse_in_search_value(values, column):
+    return {column + '__in': [_parse_search_column_value(value, column)
+                              for value in values]}
+
+
+def _parse_is_search_value(value, column):
+    return {column: _parse_search_column_value(value, column)}
+
+
+def _parse_isnull_search_value(value, column):
+    # Like _parse_isnull_hstore, this only matches collection values with
+    # the subfield, which have a UserDefinedCollectionSearchValue for it
+    if value:
+        return {column + '__isnull': True}
+    return {}
+
+# For subfields of collection UDFs with a search column, the predicate
+# builders are passed the column instead of the field
+COLLECTION_SEARCH_PREDICATE_TYPES = {
+    'MIN': {
+        'combines_with': {'MAX'},
+        'predicate_builder': _parse_min_max_search_value_fn('__gt'),
+    },
+    'MAX': {
+        'combines_with': {'MIN'},
+        'predicate_builder': _parse_min_max_search_value_fn('__lt'),
+    },
+    'IN': {
+        'combines_with': set(),
+        'predicate_builder': _parse_in_search_value,
+    },
+    'IS': {
+        'combines_with': set(),
+        'predicate_builder': _parse_is_search_value,
+    },
+    'ISNULL': {
+        'combines_with': set(),
+        'predicate_builder': _parse_isnull_search_value
+    },
+}
+
+
 def _parse_dict_value_for_mapping(mapping, valuesdict, field=None):
     """
     Loops over the keys provided and returns predicate pairs
@@ -398,38 +1063,9 @@ def _parse_dict_value_for_mapping(mapping, valuesdict, field=None):
     return params
 
 
-_parse_dict_value = partial(_parse_dict_value_for_mapping, PREDICATE_TYPES)
-_parse_udf_dict_value = partial(_parse_dict_value_for_mapping,
-                                HSTORE_PREDICATE_TYPES)
-
-
-def _parse_predicate_pair(key, value, mapping):
-    model, search_key = _parse_predicate_key(key, mapping)
-    __, __, field = key.partition('.')
-
-    if _is_udf(model) and type(value) == dict:
-        preds = _parse_udf_dict_value(value, field)
-        query = {'data' + k: v for (k, v) in preds.iteritems()}
-    elif _is_udf(model):
-        query = {'data__contains': {field: value}}
-    elif type(value) is dict:
-        query = {search_key + k: v for (k, v)
-                 in _parse_dict_value(value).iteritems()}
-    else:
-        query = {search_key: value}
-
-    # If the model being searched is a collection UDF, we do an in clause on a
-    # subquery because we can't easily join to UserDefinedCollectionValue
-    if _is_udf(model):
-        __, __, udf_def_pk = model.split(':')
-        subquery = UserDefinedCollectionValue.objects\
-            .filter(**query)\
-            .filter(field_definition=udf_def_pk)\
-            .distinct('model_id')\
-            .values_list('model_id', flat=True)
-        query = {search_key + '__in': subquery}
-
-    return FilterContext(basekey=model, **query)
+def _parse_dict_value(valuesdict):
+    params = _parse_dict_value_for_mapping(PREDICATE_TYPES, valuesdict)
+    return _resolve_lookups(params.iteritems())
 
 
 def _apply_combinator(combinator, predicates):
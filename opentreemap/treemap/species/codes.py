@@ -16,6 +16,10 @@ def species_codes_for_regions(region_codes):
     # Converting to a set removes duplicates
     return list(set(species_codes))
 
+def itree_codes_by_region():
+    return {region_code: list(set(codes.values()))
+            for region_code, codes in _CODES.iteritems()}
+
 def get_itree_code(region_code, otm_code):
     if otm_code:
         if region_code in _CODES:
@@ -23,6 +27,13 @@ def get_itree_code(region_code, otm_code):
                 return _CODES[region_code][otm_code]
     return None
 
+def otm_codes_by_itree_code(region_code):
+    otm_codes = {}
+    codes = _CODES.get(region_code, {})
+    for otm_code, itree_code in sorted(codes.iteritems()):
+        otm_codes.setdefault(itree_code, otm_code)
+    return otm_codes
+
 
 # The ``_CODES`` dictionary has the following format
 #
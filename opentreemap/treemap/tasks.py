@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+from celery import task
+from celery.signals import worker_process_init
+
+from django.utils import translation
+from django.utils.encoding import force_text
+
+from treemap.ecobenefits import (get_benefits_for_filter,
+                                 TreeBenefitsCalculator)
+from treemap.lib import benefit_aggregates, object_caches, udf_indexes
+from treemap.models import BenefitSummaryJob
+from treemap.udf import UserDefinedFieldDefinition
+from treemap.search import Filter
+
+
+@worker_process_init.connect
+def _start_adjunct_listener(**kwargs):
+    # Workers are long-lived and their Instances may be stale, so they
+    # rely on notifications to see changes to cached adjunct objects
+    object_caches.start_invalidation_listener()
+
+
+@task
+def async_benefit_summary(job_pk):
+    job = BenefitSummaryJob.objects.select_related('instance')\
+                                   .get(pk=job_pk)
+
+    try:
+        filter = Filter(job.filterstr, job.displaystr, job.instance)
+
+        # This also stores the summary in the filter benefit cache, so
+        # web processes sharing that cache can use it directly
+        benefits, basis, margins = get_benefits_for_filter(filter)
+
+        with translation.override(job.language):
+            benefits = _with_translated_labels(benefits)
+
+        job.complete_with(benefits, basis, margins)
+    except:
+        job.fail()
+        job.save()
+        raise
+
+    job.save()
+
+
+@task
+def rebuild_benefit_aggregates(instance_id):
+    benefit_aggregates.rebuild_stale_aggregates(
+        instance_id, TreeBenefitsCalculator().raw_benefits_for_trees)
+
+
+@task(max_retries=5, default_retry_delay=2)
+def create_udf_search_index(udf_def_id):
+    try:
+        udf_def = UserDefinedFieldDefinition.objects.get(pk=udf_def_id)
+    except UserDefinedFieldDefinition.DoesNotExist:
+        # The transaction which created it may not have committed yet
+        create_udf_search_index.retry()
+
+    udf_indexes.create_index(udf_def)
+
+
+def _with_translated_labels(benefits):
+    # Benefit labels are lazily translated, so they must be forced to
+    # text before the benefits can be stored as JSON
+    translated = {}
+
+    for group, group_benefits in benefits.iteritems():
+        translated[group] = {}
+
+        for key, benefit in group_benefits.iteritems():
+            benefit = dict(benefit)
+            if 'label' in benefit:
+                benefit['label'] = force_text(benefit['label'])
+            translated[group][key] = benefit
+
+    return translated
@@ -33,6 +33,8 @@ otm.settings.staticUrl = '{{ STATIC_URL }}';
 
 otm.settings.exportCheckUrl = '{{ SITE_ROOT }}{{ request.instance.url_name }}/export/check';
 
+otm.settings.asyncBenefitSummaries = {{ settings.ECO_ASYNC_SUMMARIES|yesno:"true,false" }};
+
 otm.settings.geocoder = {
     maxLocations: 20,
     errorString: '{% trans "That address was not found near this map. You may need to include a city and state." %}',
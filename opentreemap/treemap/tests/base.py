@@ -1,6 +1,8 @@
 from django.test import TestCase
 from django.test.utils import override_settings
 
+from treemap.lib import itree_region_index, search_results
+
 _test_settings = {
     # Use a faster password hasher for unit tests to improve performance
     'PASSWORD_HASHERS': ('django.contrib.auth.hashers.MD5PasswordHasher',),
@@ -17,4 +19,12 @@ class OTMTestCase(TestCase):
     """
     Base class for OTM2 tests.
     """
-    pass
+    def _pre_setup(self):
+        super(OTMTestCase, self)._pre_setup()
+
+        # Regions created by earlier tests were rolled back without
+        # sending delete signals
+        itree_region_index.clear()
+
+        # Start each test without search results cached by earlier tests
+        search_results.clear()
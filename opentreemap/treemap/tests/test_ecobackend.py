@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import httplib
+import json
+import threading
+import time
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from django.test.utils import override_settings
+
+from treemap import ecobackend
+from treemap.ecobackend import CircuitBreaker
+from treemap.tests.base import OTMTestCase
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # Needed for keep-alive connections
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.n_connections += 1
+
+    def do_GET(self):
+        self._respond()
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length', 0))
+        self.server.bodies.append(self.rfile.read(length))
+        self._respond()
+
+    def _respond(self):
+        self.server.paths.append(self.path)
+
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        status, body = self.server.response
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, (str('127.0.0.1'), 0), _StubHandler)
+        self.n_connections = 0
+        self.paths = []
+        self.bodies = []
+        self.delay = 0
+        self.response = (200, json.dumps({'Benefits': {'electricity': 1}}))
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s' % self.server_address[1]
+
+
+class EcobackendTest(OTMTestCase):
+    def setUp(self):
+        self.server = _StubServer()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.override = override_settings(
+            ECO_SERVICE_URL=self.server.url,
+            ECO_SERVICE_READ_TIMEOUT=0.5,
+            ECO_SERVICE_FAILURE_THRESHOLD=2,
+            ECO_SERVICE_RESET_TIMEOUT=60)
+        self.override.enable()
+
+        ecobackend._client = None
+        ecobackend.reset_latency_histograms()
+
+    def tearDown(self):
+        ecobackend._get_client().close()
+        ecobackend._client = None
+        self.override.disable()
+
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get(self):
+        result, err = ecobackend.json_benefits_call(
+            'eco.json', [('otmcode', 'CEAT'), ('diameter', 12)])
+
+        self.assertIsNone(err)
+        self.assertEqual(result, {'Benefits': {'electricity': 1}})
+        self.assertEqual(self.server.paths,
+                         ['/eco.json?otmcode=CEAT&diameter=12'])
+
+    def test_post(self):
+        ecobackend.json_benefits_call(
+            'eco_summary.json', [('region', 'NoEastXXX')], post=True)
+
+        self.assertEqual(self.server.paths, ['/eco_summary.json'])
+        self.assertEqual(json.loads(self.server.bodies[0]),
+                         {'region': 'NoEastXXX'})
+
+    def test_connections_are_reused(self):
+        for __ in xrange(3):
+            __, err = ecobackend.json_benefits_call('eco.json', [])
+            self.assertIsNone(err)
+
+        self.assertEqual(len(self.server.paths), 3)
+        self.assertEqual(self.server.n_connections, 1)
+
+    def test_error_body_is_parsed(self):
+        self.server.response = (
+            500, 'iTree code not found for otmcode CEAT in region Nowhere\n')
+
+        __, err = ecobackend.json_benefits_call('eco.json', [])
+
+        self.assertEqual(err, ecobackend.BAD_CODE_PAIR)
+        self.assertEqual(ecobackend.circuit_breaker_state(),
+                         CircuitBreaker.CLOSED)
+
+    def test_read_timeout(self):
+        self.server.delay = 1
+
+        __, err = ecobackend.json_benefits_call('eco.json', [])
+
+        self.assertEqual(err, ecobackend.UNKNOWN_ECOBENEFIT_ERROR)
+
+    def test_connection_refused(self):
+        with self.settings(ECO_SERVICE_URL='http://127.0.0.1:1'):
+            __, err = ecobackend.json_benefits_call('eco.json', [])
+
+        self.assertEqual(err, ecobackend.UNKNOWN_ECOBENEFIT_ERROR)
+
+    def test_circuit_opens_after_failures(self):
+        self.server.response = (503, 'Unavailable')
+
+        for __ in xrange(3):
+            __, err = ecobackend.json_benefits_call('eco.json', [])
+            self.assertEqual(err, ecobackend.UNKNOWN_ECOBENEFIT_ERROR)
+
+        # The third call fails without reaching the service
+        self.assertEqual(len(self.server.paths), 2)
+        self.assertEqual(ecobackend.circuit_breaker_state(),
+                         CircuitBreaker.OPEN)
+
+    def test_circuit_closes_after_successful_trial(self):
+        self.server.response = (503, 'Unavailable')
+
+        with self.settings(ECO_SERVICE_RESET_TIMEOUT=0):
+            for __ in xrange(2):
+                ecobackend.json_benefits_call('eco.json', [])
+
+            self.assertEqual(ecobackend.circuit_breaker_state(),
+                             CircuitBreaker.HALF_OPEN)
+
+            self.server.response = (200, '{}')
+            __, err = ecobackend.json_benefits_call('eco.json', [])
+
+            self.assertIsNone(err)
+            self.assertEqual(ecobackend.circuit_breaker_state(),
+                             CircuitBreaker.CLOSED)
+
+    def test_unexpected_error_in_trial_allows_another_trial(self):
+        self.server.response = (503, 'Unavailable')
+
+        with self.settings(ECO_SERVICE_RESET_TIMEOUT=0):
+            for __ in xrange(2):
+                ecobackend.json_benefits_call('eco.json', [])
+
+            client = ecobackend._get_client()
+
+            def fail(*args, **kwargs):
+                raise ValueError('Unexpected')
+
+            client.request = fail
+            try:
+                self.assertRaises(ValueError, ecobackend.json_benefits_call,
+                                  'eco.json', [])
+            finally:
+                del client.request
+
+            self.assertTrue(client.breaker.allows_request())
+
+    def test_latency_histograms(self):
+        ecobackend.json_benefits_call('eco.json', [])
+        ecobackend.json_benefits_call('eco.json', [])
+        ecobackend.json_benefits_call('itree_codes.json', [])
+
+        histograms = ecobackend.latency_histograms()
+
+        self.assertEqual(set(histograms), {'eco.json', 'itree_codes.json'})
+        self.assertEqual(histograms['eco.json']['count'], 2)
+        self.assertEqual(histograms['eco.json']['buckets'][-1], ['+Inf', 2])
+
+
+class EcoserviceClientTest(OTMTestCase):
+    def _client(self, url):
+        return ecobackend._EcoserviceClient(
+            url, pool_size=1, connect_timeout=1, read_timeout=1,
+            breaker=CircuitBreaker(failure_threshold=1, reset_timeout=1))
+
+    def test_https_url_uses_https(self):
+        client = self._client('https://eco.example.com:8443/api/')
+
+        self.assertIs(client.connection_class, httplib.HTTPSConnection)
+        self.assertEqual((client.host, client.port, client.path),
+                         ('eco.example.com', 8443, '/api'))
+
+    def test_http_url_uses_http(self):
+        client = self._client('http://localhost:13000')
+
+        self.assertIs(client.connection_class, httplib.HTTPConnection)
+
+
+class CircuitBreakerTest(OTMTestCase):
+    def test_half_open_allows_one_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+
+        self.assertTrue(breaker.allows_request())
+        self.assertFalse(breaker.allows_request())
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        breaker.failures = 3
+        breaker.opened_at = time.time() - 60
+
+        self.assertTrue(breaker.allows_request())
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
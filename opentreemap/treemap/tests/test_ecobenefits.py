@@ -4,47 +4,85 @@ from __future__ import unicode_literals
 from __future__ import division
 
 import json
+import os
+import shutil
+import tempfile
 
-from treemap.models import Plot, Tree, Species, ITreeRegion
+import numpy as np
+
+from django.contrib.gis.geos import MultiPolygon
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from treemap.models import (Instance, Plot, Tree, Species, ITreeRegion,
+                            ITreeCodeOverride, Boundary, BenefitAggregate,
+                            BenefitSummaryJob)
 from treemap.tests import make_instance, make_commander_user, make_request
+from treemap.tests.base import OTMTestCase
 from treemap.tests.test_urls import UrlTestCase
 
-from treemap import ecobackend
+from treemap import ecobackend, ecoengine
 from treemap.ecobenefits import (TreeBenefitsCalculator,
+                                 get_benefits_for_filter,
                                  _combine_benefit_basis,
                                  _annotate_basis_with_extra_stats,
-                                 _combine_grouped_benefits)
+                                 _combine_grouped_benefits,
+                                 _combine_margins)
 
 from treemap.ecobenefits import BenefitCategory
-from treemap.views.tree import search_tree_benefits
+from treemap.ecoengine import LocalEcoEngine
+from treemap.lib import (benefit_aggregates, benefit_caches,
+                         benefit_sampling)
+from treemap.search import Filter
+from treemap.species.codes import otm_codes_by_itree_code
+from treemap.views.tree import (search_tree_benefits,
+                                begin_search_tree_benefits,
+                                check_search_tree_benefits)
+
+# Responses recorded from the ecoservice with
+# 'manage.py export_eco_tables <dir> --record <file>'
+RECORDED_RESPONSES_DIR = os.path.join(
+    os.path.dirname(__file__), 'resources', 'eco', 'recorded')
+
+# Example url for
+# CEAT, 1630 dbh, NoEastXXX
+# eco.json?otmcode=CEAT&diameter=1630&region=NoEastXXX
+RECORDED_BENEFITS = {
+    "aq_nox_avoided": 0.6792,
+    "aq_nox_dep": 0.371,
+    "aq_ozone_dep": 0.775,
+    "aq_pm10_avoided": 0.0436,
+    "aq_pm10_dep": 0.491,
+    "aq_sox_avoided": 0.372,
+    "aq_sox_dep": 0.21,
+    "aq_voc_avoided": 0.0254,
+    "bvoc": -0.077,
+    "co2_avoided": 255.5,
+    "co2_sequestered": 0,
+    "co2_storage": 6575,
+    "electricity": 187,
+    "hydro_interception": 12.06,
+    "natural_gas": 5834.1
+}
 
 
 class EcoTest(UrlTestCase):
+    """
+    Replaces the ecoservice with mock_benefits, recording the endpoint and
+    parameters of each call in self.endpoints and self.calls
+    """
+    # Whether eco_summary.json calls return the sum of the recorded
+    # benefits of every tree in the query, instead of a single tree's
+    sum_summary_queries = False
+
     def setUp(self):
-        # Example url for
-        # CEAT, 1630 dbh, NoEastXXX
-        # eco.json?otmcode=CEAT&diameter=1630&region=NoEastXXX
-        def mockbenefits(*args, **kwargs):
-            benefits = {
-                "Benefits": {
-                    "aq_nox_avoided": 0.6792,
-                    "aq_nox_dep": 0.371,
-                    "aq_ozone_dep": 0.775,
-                    "aq_pm10_avoided": 0.0436,
-                    "aq_pm10_dep": 0.491,
-                    "aq_sox_avoided": 0.372,
-                    "aq_sox_dep": 0.21,
-                    "aq_voc_avoided": 0.0254,
-                    "bvoc": -0.077,
-                    "co2_avoided": 255.5,
-                    "co2_sequestered": 0,
-                    "co2_storage": 6575,
-                    "electricity": 187,
-                    "hydro_interception": 12.06,
-                    "natural_gas": 5834.1
-                }
-            }
-            return (benefits, None)
+        benefit_caches.clear_caches()
+
+        self.endpoints = []
+        self.calls = []
+        self.data_dirs = []
 
         region = ITreeRegion.objects.get(code='NoEastXXX')
         p = region.geometry.point_on_surface
@@ -74,10 +112,47 @@ class EcoTest(UrlTestCase):
         self.tree.save_with_user(self.user)
 
         self.origBenefitFn = ecobackend.json_benefits_call
-        ecobackend.json_benefits_call = mockbenefits
+        ecobackend.json_benefits_call = self._record_benefits_call
 
     def tearDown(self):
         ecobackend.json_benefits_call = self.origBenefitFn
+        for data_dir in self.data_dirs:
+            shutil.rmtree(data_dir)
+
+    def export_local_tables(self):
+        """
+        Returns a temporary directory with the local engine's table for
+        NoEastXXX, exported from the mocked ecoservice
+        """
+        data_dir = tempfile.mkdtemp()
+        self.data_dirs.append(data_dir)
+
+        call_command('export_eco_tables', data_dir,
+                     regions=['NoEastXXX'])
+
+        self.endpoints = []
+        self.calls = []
+
+        return data_dir
+
+    def _record_benefits_call(self, endpoint, params, *args, **kwargs):
+        params = dict(params)
+        self.endpoints.append(endpoint)
+        self.calls.append(params)
+        return self.mock_benefits(endpoint, params)
+
+    def mock_benefits(self, endpoint, params):
+        if endpoint == 'eco_summary.json' and self.sum_summary_queries:
+            # Sum the benefits of every tree in the query
+            cursor = connection.cursor()
+            cursor.execute(params['query'])
+            n_trees = len(cursor.fetchall())
+            benefits = {key: value * n_trees
+                        for key, value in RECORDED_BENEFITS.iteritems()}
+            benefits['n_trees'] = n_trees
+            return ({'Benefits': benefits}, None)
+
+        return ({'Benefits': dict(RECORDED_BENEFITS)}, None)
 
     def assert_benefit_value(self, bens, benefit, unit, value):
         self.assertEqual(bens[benefit]['unit'], unit)
@@ -109,6 +184,17 @@ class EcoTest(UrlTestCase):
 
         self.assertTrue(len(benefits) > 0)
 
+    def test_combine_margins(self):
+        margins = {'plot': {'energy': {'value': 3, 'currency': None}}}
+
+        _combine_margins(margins, {
+            'plot': {'energy': {'value': 4, 'currency': 2}},
+            'resource': {'water': {'value': 1, 'currency': None}}})
+
+        self.assertEqual(margins, {
+            'plot': {'energy': {'value': 5, 'currency': 2}},
+            'resource': {'water': {'value': 1, 'currency': None}}})
+
     def test_group_basis_empty(self):
         basis = {}
         example = {
@@ -326,3 +412,805 @@ class EcoTest(UrlTestCase):
         _annotate_basis_with_extra_stats(basis)
 
         self.assertEqual(basis, target)
+
+
+class BenefitsForObjectsTest(EcoTest):
+    def setUp(self):
+        super(BenefitsForObjectsTest, self).setUp()
+
+        self.plots = [self.plot]
+        for diameter in (1630, 1630, None, 20):
+            plot = Plot(geom=self.plot.geom, instance=self.instance)
+            plot.save_with_user(self.user)
+            Tree(plot=plot, instance=self.instance, species=self.species,
+                 diameter=diameter).save_with_user(self.user)
+            self.plots.append(plot)
+
+        empty_plot = Plot(geom=self.plot.geom, instance=self.instance)
+        empty_plot.save_with_user(self.user)
+        self.plots.append(empty_plot)
+
+    def test_matches_benefits_for_object(self):
+        calculator = TreeBenefitsCalculator()
+        results = calculator.benefits_for_objects(self.instance, self.plots)
+
+        self.assertEqual(len(results), len(self.plots))
+        for plot, result in zip(self.plots, results):
+            self.assertEqual(
+                calculator.benefits_for_object(self.instance, plot), result)
+
+    def test_one_call_per_distinct_tree(self):
+        results = TreeBenefitsCalculator().benefits_for_objects(
+            self.instance, self.plots)
+
+        self.assertEqual({call['diameter'] for call in self.calls},
+                         {1630, 20})
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual([error for __, __, error in results],
+                         [None, None, None, 'MISSING_DBH', None, 'NO_TREE'])
+
+    def test_uses_tree_cache(self):
+        TreeBenefitsCalculator().benefits_for_object(self.instance,
+                                                     self.plot)
+        TreeBenefitsCalculator().benefits_for_objects(self.instance,
+                                                      self.plots)
+
+        self.assertEqual(len(self.calls), 2)
+
+
+class RegionFanOutTest(EcoTest):
+    def setUp(self):
+        super(RegionFanOutTest, self).setUp()
+
+        # Pretend the instance crosses a region boundary
+        self.instance.itree_region_codes = \
+            lambda: ['NoEastXXX', 'PiedmtCLT']
+
+    def mock_benefits(self, endpoint, params):
+        if params['region'] == 'NoEastXXX':
+            benefits = dict(RECORDED_BENEFITS, n_trees=1)
+        else:
+            benefits = dict.fromkeys(RECORDED_BENEFITS, 0)
+            benefits['n_trees'] = 0
+        return ({'Benefits': benefits}, None)
+
+    def get_filter_benefits(self):
+        filter = Filter('', '', self.instance)
+        return TreeBenefitsCalculator().benefits_for_filter(
+            self.instance, filter)
+
+    @override_settings(ECO_BENEFIT_AGGREGATES=False)
+    def test_one_call_per_region(self):
+        self.get_filter_benefits()
+
+        self.assertEqual({call['region'] for call in self.calls},
+                         {'NoEastXXX', 'PiedmtCLT'})
+        for call in self.calls:
+            self.assertIn(call['region'], call['query'])
+            self.assertNotIn('ST_X', call['query'])
+
+    @override_settings(ECO_BENEFIT_AGGREGATES=False)
+    def test_region_results_are_combined(self):
+        rslt, basis, __ = self.get_filter_benefits()
+
+        self.assertEqual(basis['plot']['n_objects_used'], 1)
+        self.assert_benefit_value(rslt['plot'], BenefitCategory.CO2STORAGE,
+                                  'lbs', 6575)
+
+    @override_settings(ECO_BENEFIT_AGGREGATES=False,
+                       ECO_REGION_FAN_OUT_WORKERS=0)
+    def test_fan_out_can_be_disabled(self):
+        self.get_filter_benefits()
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.calls[0]['region'], '')
+        self.assertIn('ST_X', self.calls[0]['query'])
+
+
+@override_settings(ECO_BENEFITS_ENGINE='local')
+class LocalEcoEngineTest(EcoTest):
+    """
+    Runs the ecoservice tests against the local engine, with tables
+    exported from the mocked ecoservice, and checks that both engines
+    produce the same results
+    """
+    def setUp(self):
+        super(LocalEcoEngineTest, self).setUp()
+        ecoengine._engine = None
+
+        self.override = override_settings(
+            ECO_LOCAL_ENGINE_DATA_DIR=self.export_local_tables())
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        super(LocalEcoEngineTest, self).tearDown()
+        ecoengine._engine = None
+
+    def assert_benefits_equal(self, expected, actual):
+        self.assertEqual(set(expected['plot']), set(actual['plot']))
+        for group, benefit in expected['plot'].iteritems():
+            self.assertAlmostEqual(benefit['value'],
+                                   actual['plot'][group]['value'])
+            self.assertEqual(benefit['unit'], actual['plot'][group]['unit'])
+
+    def test_object_matches_ecoservice(self):
+        with self.settings(ECO_BENEFITS_ENGINE='ecoservice'):
+            expected, __, __ = TreeBenefitsCalculator()\
+                .benefits_for_object(self.instance, self.plot)
+
+        actual, __, error = TreeBenefitsCalculator()\
+            .benefits_for_object(self.instance, self.plot)
+
+        self.assertIsNone(error)
+        self.assert_benefits_equal(expected, actual)
+
+    def test_filter_matches_ecoservice(self):
+        filter = Filter('', '', self.instance)
+
+        with self.settings(ECO_BENEFITS_ENGINE='ecoservice'):
+            expected, expected_basis, __ = TreeBenefitsCalculator()\
+                .benefits_for_filter(self.instance, filter)
+
+        actual, basis, __ = TreeBenefitsCalculator()\
+            .benefits_for_filter(self.instance, filter)
+
+        self.assert_benefits_equal(expected, actual)
+        self.assertEqual(expected_basis, basis)
+
+    def test_objects_match_ecoservice(self):
+        with self.settings(ECO_BENEFITS_ENGINE='ecoservice'):
+            expected = TreeBenefitsCalculator()\
+                .benefits_for_objects(self.instance, [self.plot])
+
+        actual = TreeBenefitsCalculator()\
+            .benefits_for_objects(self.instance, [self.plot])
+
+        self.assertIsNone(actual[0][2])
+        self.assert_benefits_equal(expected[0][0], actual[0][0])
+
+    def test_missing_itree_code(self):
+        self.species.otm_code = 'NOTACODE'
+        self.species.save_with_user(self.user)
+
+        rslt, __, error = TreeBenefitsCalculator()\
+            .benefits_for_object(self.instance, self.plot)
+
+        self.assertEqual(error, ecobackend.BAD_CODE_PAIR)
+
+    def test_interpolates_between_breakpoints(self):
+        engine = LocalEcoEngine({
+            'Region': {
+                'dbh_breakpoints': [2.54, 25.4],
+                'species': {'CODE': {'electricity': [1, 10]}}}})
+
+        # 1 inch is on the first breakpoint, 5.5 inches is halfway
+        # between the breakpoints and 20 inches is past the last one
+        rows = [(1, None, 'OTM', 'Region'),
+                (5.5, None, 'OTM', 'Region'),
+                (20, None, 'OTM', 'Region')]
+        overrides = {(None, 'Region'): 'CODE'}
+
+        rawb, err = engine.summary_benefits(overrides, rows)
+
+        self.assertIsNone(err)
+        self.assertAlmostEqual(rawb['Benefits']['electricity'], 16.5)
+        self.assertEqual(rawb['Benefits']['n_trees'], 3)
+
+
+class ExportEcoTablesTest(OTMTestCase):
+    """
+    Exports tables from a mocked ecoservice whose benefits vary with the
+    species, region and diameter, and are linear between the breakpoints
+    unless self.curved is set
+    """
+    def setUp(self):
+        self.curved = False
+        self.data_dir = tempfile.mkdtemp()
+
+        def mockbenefits(endpoint, params, *args, **kwargs):
+            return self.mock_benefits(**dict(params))
+
+        self.origBenefitFn = ecobackend.json_benefits_call
+        ecobackend.json_benefits_call = mockbenefits
+
+    def tearDown(self):
+        ecobackend.json_benefits_call = self.origBenefitFn
+        shutil.rmtree(self.data_dir)
+
+    def mock_benefits(self, otmcode, diameter, region):
+        diameter_cm = diameter * ecoengine.CM_PER_INCH
+        scale = len(otmcode) + len(region)
+
+        if self.curved:
+            electricity = scale * diameter_cm ** 2
+        else:
+            breakpoints = ecoengine.ITREE_DBH_CLASS_MIDPOINTS_CM
+            electricity = np.interp(
+                diameter_cm, breakpoints,
+                [scale * i ** 2 for i in range(len(breakpoints))])
+
+        return ({'Benefits': {'electricity': float(electricity),
+                              'co2_storage': scale}}, None)
+
+    def export(self, *regions):
+        call_command('export_eco_tables', self.data_dir,
+                     regions=list(regions))
+
+    def test_tables_match_ecoservice_between_breakpoints(self):
+        self.export('NoEastXXX', 'PiedmtCLT')
+        engine = LocalEcoEngine.from_directory(self.data_dir)
+
+        for region_code in ('NoEastXXX', 'PiedmtCLT'):
+            for otm_code in sorted(
+                    otm_codes_by_itree_code(region_code).values())[:5]:
+                for diameter in (1, 2.5, 7, 16.3, 30, 60):
+                    expected, __ = self.mock_benefits(
+                        otm_code, diameter, region_code)
+                    actual, error = engine.tree_benefits(
+                        {}, None, otm_code, diameter, region_code)
+
+                    self.assertIsNone(error)
+                    for factor, value in expected['Benefits'].iteritems():
+                        self.assertAlmostEqual(
+                            actual['Benefits'][factor], value)
+
+    def test_export_fails_when_ecoservice_differs_between_breakpoints(self):
+        self.curved = True
+
+        with self.assertRaises(CommandError):
+            self.export('NoEastXXX')
+
+
+class RecordedEcoserviceTest(OTMTestCase):
+    """
+    Checks the local engine against responses recorded from the
+    ecoservice, by exporting tables from the responses at the breakpoints
+    and comparing the engine with the responses between them
+    """
+    def get_recordings(self):
+        if not os.path.isdir(RECORDED_RESPONSES_DIR):
+            return []
+
+        recordings = []
+        for filename in sorted(os.listdir(RECORDED_RESPONSES_DIR)):
+            if filename.endswith('.json'):
+                path = os.path.join(RECORDED_RESPONSES_DIR, filename)
+                with open(path) as f:
+                    recordings.append(json.load(f))
+
+        return recordings
+
+    def test_engine_matches_recorded_responses(self):
+        recordings = self.get_recordings()
+        if not recordings:
+            self.skipTest('No recorded ecoservice responses in %s'
+                          % RECORDED_RESPONSES_DIR)
+
+        for recording in recordings:
+            for region_code, region in recording.iteritems():
+                responses = {
+                    (response['otmcode'], round(response['diameter'], 6)):
+                    response['benefits']
+                    for response in region['responses']}
+
+                def tree_benefits(otm_code, diameter, region_code):
+                    benefits = responses.get(
+                        (otm_code, round(diameter, 6)))
+                    if benefits is None:
+                        return (None, ecobackend.UNKNOWN_ECOBENEFIT_ERROR)
+                    return ({'Benefits': benefits}, None)
+
+                breakpoints = region['dbh_breakpoints']
+                table, __ = ecoengine.export_region_table(
+                    region_code, tree_benefits, breakpoints)
+                engine = LocalEcoEngine({region_code: table})
+
+                differences = ecoengine.compare_with_ecoservice(
+                    engine, region_code, tree_benefits,
+                    ecoengine.diameters_between_breakpoints(breakpoints),
+                    0.01)
+
+                self.assertEqual(differences, [])
+
+
+@override_settings(ECO_BENEFIT_AGGREGATES=False)
+class BenefitCacheTest(EcoTest):
+    def get_benefits(self):
+        rslt, __, error = TreeBenefitsCalculator()\
+            .benefits_for_object(self.instance, self.plot)
+        self.assertIsNone(error)
+        return rslt
+
+    def test_repeated_lookup_uses_cache(self):
+        first = self.get_benefits()
+        second = self.get_benefits()
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(first, second)
+
+        stats = benefit_caches.tree_benefits_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_diameter_is_bucketed(self):
+        self.get_benefits()
+        self.tree.diameter = 1630.01
+        self.tree.save_with_user(self.user)
+        self.get_benefits()
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.calls[0]['diameter'], 1630.0)
+
+    def test_new_diameter_misses_cache(self):
+        self.get_benefits()
+        self.tree.diameter = 1000
+        self.tree.save_with_user(self.user)
+        self.get_benefits()
+
+        self.assertEqual(len(self.calls), 2)
+
+    def test_override_change_invalidates_cache(self):
+        self.get_benefits()
+        ITreeCodeOverride(
+            instance_species=self.species,
+            region=ITreeRegion.objects.get(code='NoEastXXX'),
+            itree_code='CEL OTHER'
+        ).save_base()
+        self.get_benefits()
+
+        self.assertEqual(len(self.calls), 2)
+
+    def test_instance_save_keeps_override_revision(self):
+        stale_instance = Instance.objects.get(pk=self.instance.pk)
+
+        ITreeCodeOverride(
+            instance_species=self.species,
+            region=ITreeRegion.objects.get(code='NoEastXXX'),
+            itree_code='CEL OTHER'
+        ).save_base()
+        stale_instance.save()
+
+        self.assertEqual(
+            Instance.objects.get(pk=self.instance.pk).eco_override_rev, 1)
+
+    def test_errors_are_not_cached(self):
+        self.mock_benefits = lambda endpoint, params: \
+            (None, ecobackend.UNKNOWN_ECOBENEFIT_ERROR)
+
+        __, __, error = TreeBenefitsCalculator()\
+            .benefits_for_object(self.instance, self.plot)
+
+        self.assertEqual(error, ecobackend.UNKNOWN_ECOBENEFIT_ERROR)
+        self.assertEqual(benefit_caches.tree_benefits_stats()['size'], 0)
+
+    def get_filter_benefits(self, filter_str, display_str=''):
+        filter = Filter(filter_str, display_str, self.instance)
+        return get_benefits_for_filter(filter)
+
+    def test_repeated_search_uses_cache(self):
+        first = self.get_filter_benefits('{"tree.diameter": {"MIN": 1}}')
+        second = self.get_filter_benefits('{ "tree.diameter":{"MIN":1} }')
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(first, second)
+        self.assertEqual(benefit_caches.filter_benefits_stats()['hits'], 1)
+
+    def test_cached_search_results_are_copies(self):
+        benefits, basis, __ = self.get_filter_benefits('')
+        basis['plot']['n_plots'] = 12
+        __, basis, __ = self.get_filter_benefits('')
+
+        self.assertNotIn('n_plots', basis['plot'])
+
+    def test_display_filter_is_part_of_key(self):
+        self.get_filter_benefits('', '["Plot"]')
+        self.get_filter_benefits('', '["Tree"]')
+
+        self.assertEqual(len(self.calls), 2)
+
+    def test_cache_hit_does_not_query(self):
+        trees = [(self.species, 1630, 'NoEastXXX')]
+        compute = lambda trees: [({'Benefits': {'electricity': 1}}, None)]
+        benefit_caches.get_many_tree_benefits(self.instance, trees, compute)
+
+        with self.assertNumQueries(0):
+            benefit_caches.get_many_tree_benefits(
+                self.instance, trees, compute)
+
+    def test_map_feature_types_are_part_of_key(self):
+        filter = Filter('', '', self.instance)
+        key = benefit_caches.filter_benefits_key(filter)
+
+        self.instance.config['map_feature_types'] = ['Plot', 'RainBarrel']
+
+        self.assertNotEqual(benefit_caches.filter_benefits_key(filter), key)
+
+    def test_edit_invalidates_search_cache(self):
+        self.get_filter_benefits('')
+        self.tree.diameter = 1000
+        self.tree.save_with_user(self.user)
+        self.get_filter_benefits('')
+
+        self.assertEqual(len(self.calls), 2)
+
+
+class BenefitAggregateTest(EcoTest):
+    sum_summary_queries = True
+
+    def setUp(self):
+        super(BenefitAggregateTest, self).setUp()
+
+        self.boundary = Boundary(geom=MultiPolygon(self.plot.geom.buffer(5)),
+                                 name='Around the tree',
+                                 category='Unknown',
+                                 sort_order=1)
+        self.boundary.save()
+
+    def get_filter_benefits(self, filter_str, display_str=''):
+        filter = Filter(filter_str, display_str, self.instance)
+        return TreeBenefitsCalculator().benefits_for_filter(
+            self.instance, filter)
+
+    def get_aggregate(self, boundary=None):
+        return BenefitAggregate.objects.get(instance=self.instance,
+                                            boundary=boundary)
+
+    def add_tree(self, point):
+        plot = Plot(geom=point, instance=self.instance)
+        plot.save_with_user(self.user)
+        tree = Tree(plot=plot, instance=self.instance,
+                    species=self.species, diameter=1630)
+        tree.save_with_user(self.user)
+        return tree
+
+    def test_unfiltered_search_builds_aggregate(self):
+        self.get_filter_benefits('')
+        self.get_filter_benefits('{}', '["Plot"]')
+
+        self.assertIn('eco_summary.json', self.endpoints)
+
+        aggregate = self.get_aggregate()
+        self.assertEqual(aggregate.n_trees_total, 1)
+        self.assertEqual(aggregate.n_trees_computed, 1)
+        self.assertAlmostEqual(aggregate.benefits['electricity'],
+                               RECORDED_BENEFITS['electricity'])
+
+    def test_boundary_search_builds_boundary_aggregate(self):
+        self.get_filter_benefits(
+            json.dumps({'plot.geom': {'IN_BOUNDARY': self.boundary.pk}}))
+
+        self.assertEqual(self.get_aggregate(self.boundary).n_trees_total, 1)
+
+    def test_filtered_search_does_not_use_aggregate(self):
+        self.get_filter_benefits('{"tree.diameter": {"MIN": 1}}')
+        self.get_filter_benefits('', '["EmptyPlot"]')
+
+        self.assertFalse(BenefitAggregate.objects.exists())
+
+    def test_new_tree_updates_aggregates(self):
+        self.get_filter_benefits('')
+        self.get_filter_benefits(
+            json.dumps({'plot.geom': {'IN_BOUNDARY': self.boundary.pk}}))
+
+        outside_boundary = self.plot.geom.clone()
+        outside_boundary.x += 100
+        self.add_tree(outside_boundary)
+
+        # Only the new tree's benefits are computed
+        self.assertEqual(self.endpoints.count('eco_summary.json'), 2)
+        self.assertEqual(self.endpoints.count('eco.json'), 1)
+
+        aggregate = self.get_aggregate()
+        self.assertFalse(aggregate.is_stale)
+        self.assertEqual(aggregate.n_trees_total, 2)
+        self.assertEqual(aggregate.n_trees_computed, 2)
+        self.assertAlmostEqual(aggregate.benefits['electricity'],
+                               2 * RECORDED_BENEFITS['electricity'])
+
+        self.assertEqual(self.get_aggregate(self.boundary).n_trees_total, 1)
+
+    def test_aggregate_matches_full_summary(self):
+        self.get_filter_benefits('')
+        self.add_tree(self.plot.geom)
+
+        rslt, basis, __ = self.get_filter_benefits('')
+        with self.settings(ECO_BENEFIT_AGGREGATES=False):
+            expected, expected_basis, __ = self.get_filter_benefits('')
+
+        self.assertEqual(basis, expected_basis)
+        for group, benefit in expected['plot'].iteritems():
+            self.assertAlmostEqual(benefit['value'],
+                                   rslt['plot'][group]['value'])
+
+    def test_tree_without_species_is_not_computed(self):
+        self.get_filter_benefits('')
+        self.tree.species = None
+        self.tree.save_with_user(self.user)
+
+        aggregate = self.get_aggregate()
+        self.assertEqual(aggregate.n_trees_total, 1)
+        self.assertEqual(aggregate.n_trees_computed, 0)
+        self.assertAlmostEqual(aggregate.benefits['electricity'], 0)
+
+    def test_unchanged_benefits_are_not_computed(self):
+        self.get_filter_benefits('')
+        self.tree.height = 10
+        self.tree.save_with_user(self.user)
+
+        self.assertEqual(self.endpoints, ['eco_summary.json'])
+
+    def test_deleting_tree_updates_aggregate(self):
+        self.get_filter_benefits('')
+        self.tree.delete_with_user(self.user)
+
+        aggregate = self.get_aggregate()
+        self.assertEqual(aggregate.n_trees_total, 0)
+        self.assertEqual(aggregate.n_trees_computed, 0)
+
+    def test_moving_plot_updates_boundary_aggregate(self):
+        self.get_filter_benefits(
+            json.dumps({'plot.geom': {'IN_BOUNDARY': self.boundary.pk}}))
+
+        self.plot.geom.x += 100
+        self.plot.save_with_user(self.user)
+
+        self.assertEqual(self.get_aggregate(self.boundary).n_trees_total, 0)
+
+    def test_stale_aggregate_is_not_used(self):
+        self.get_filter_benefits('')
+        BenefitAggregate.objects.update(is_stale=True, n_trees_total=5)
+
+        rslt, basis, __ = self.get_filter_benefits('')
+
+        self.assertEqual(basis['plot']['n_objects_used'], 1)
+        self.assertEqual(basis['plot']['n_objects_discarded'], 0)
+
+    def test_failed_update_rebuilds_aggregates(self):
+        self.get_filter_benefits('')
+        benefit_caches.clear_caches()
+        self.mock_benefits = lambda endpoint, params: \
+            (None, ecobackend.UNKNOWN_ECOBENEFIT_ERROR)
+
+        self.tree.diameter = 1000
+        self.tree.save_with_user(self.user)
+
+        # Celery runs tasks eagerly in tests, so the rebuild is done, and
+        # it failed too
+        self.assertEqual(self.endpoints.count('eco_summary.json'), 2)
+        self.assertFalse(BenefitAggregate.objects.exists())
+
+    def test_update_of_stale_aggregate_rebuilds_it_again(self):
+        self.get_filter_benefits('')
+        BenefitAggregate.objects.update(is_stale=True)
+        revision = self.get_aggregate().revision
+
+        self.add_tree(self.plot.geom)
+
+        aggregate = self.get_aggregate()
+        self.assertTrue(aggregate.is_stale)
+        self.assertEqual(aggregate.revision, revision + 1)
+        self.assertEqual(aggregate.n_trees_total, 1)
+
+    def test_change_during_rebuild_rebuilds_again(self):
+        self.get_filter_benefits('')
+        BenefitAggregate.objects.update(is_stale=True)
+        compute = TreeBenefitsCalculator().raw_benefits_for_trees
+        calls = []
+
+        def changing_compute(instance, trees):
+            calls.append(instance)
+            if len(calls) == 1:
+                # As if a tree were saved while the rebuild was running
+                benefit_aggregates.invalidate_aggregates(instance.pk)
+            return compute(instance, trees)
+
+        benefit_aggregates.rebuild_stale_aggregates(self.instance.pk,
+                                                    changing_compute)
+
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(self.get_aggregate().is_stale)
+
+    def test_override_change_rebuilds_aggregates(self):
+        self.get_filter_benefits('')
+        ITreeCodeOverride(
+            instance_species=self.species,
+            region=ITreeRegion.objects.get(code='NoEastXXX'),
+            itree_code='CEL OTHER'
+        ).save_base()
+
+        self.assertEqual(self.endpoints.count('eco_summary.json'), 2)
+        self.assertFalse(self.get_aggregate().is_stale)
+
+    def test_species_change_rebuilds_aggregates(self):
+        self.get_filter_benefits('')
+        self.species.otm_code = 'CEL OTHER'
+        self.species.save_with_user(self.user)
+
+        self.assertEqual(self.endpoints.count('eco_summary.json'), 2)
+        self.assertFalse(self.get_aggregate().is_stale)
+
+    def test_batched_changes_are_applied_on_exit(self):
+        self.get_filter_benefits('')
+
+        with benefit_aggregates.batched_updates():
+            self.add_tree(self.plot.geom)
+            self.add_tree(self.plot.geom)
+            self.assertEqual(self.get_aggregate().n_trees_total, 1)
+
+        aggregate = self.get_aggregate()
+        self.assertFalse(aggregate.is_stale)
+        self.assertEqual(aggregate.n_trees_total, 3)
+        self.assertEqual(aggregate.n_trees_computed, 3)
+        self.assertAlmostEqual(aggregate.benefits['electricity'],
+                               3 * RECORDED_BENEFITS['electricity'])
+
+        # The trees are alike, so their benefits are computed once
+        self.assertEqual(self.endpoints.count('eco_summary.json'), 1)
+        self.assertEqual(self.endpoints.count('eco.json'), 1)
+
+    def test_batched_invalidation_replaces_changes(self):
+        self.get_filter_benefits('')
+
+        with benefit_aggregates.batched_updates():
+            self.add_tree(self.plot.geom)
+            benefit_aggregates.invalidate_aggregates(self.instance.pk)
+
+        self.assertNotIn('eco.json', self.endpoints)
+        self.assertEqual(self.endpoints.count('eco_summary.json'), 2)
+        self.assertEqual(self.get_aggregate().n_trees_total, 2)
+
+
+@override_settings(ECO_BENEFIT_AGGREGATES=False,
+                   ECO_SAMPLING_THRESHOLD=1)
+class SampledBenefitsTest(EcoTest):
+    sum_summary_queries = True
+
+    def setUp(self):
+        super(SampledBenefitsTest, self).setUp()
+
+        for diameter in (12, 30, None):
+            plot = Plot(geom=self.plot.geom, instance=self.instance)
+            plot.save_with_user(self.user)
+            Tree(plot=plot, instance=self.instance, species=self.species,
+                 diameter=diameter).save_with_user(self.user)
+
+    def get_filter_benefits(self):
+        filter = Filter('', '', self.instance)
+        return TreeBenefitsCalculator().benefits_for_filter(
+            self.instance, filter)
+
+    def test_matches_full_summary(self):
+        rslt, basis, margins = self.get_filter_benefits()
+
+        with self.settings(ECO_SAMPLING_THRESHOLD=None):
+            full_rslt, full_basis, __ = self.get_filter_benefits()
+
+        for group, benefit in full_rslt['plot'].iteritems():
+            self.assertAlmostEqual(rslt['plot'][group]['value'],
+                                   benefit['value'])
+
+    def test_ecoservice_and_local_engine_sample_alike(self):
+        rslt, basis, margins = self.get_filter_benefits()
+
+        # The sampled trees are computed one by one, like the local
+        # engine's, rather than summarized together
+        self.assertNotIn('eco_summary.json', self.endpoints)
+        self.assertIn('eco.json', self.endpoints)
+
+        ecoengine._engine = None
+        try:
+            data_dir = self.export_local_tables()
+            with self.settings(ECO_BENEFITS_ENGINE='local',
+                               ECO_LOCAL_ENGINE_DATA_DIR=data_dir):
+                benefit_caches.clear_caches()
+                local_rslt, local_basis, local_margins = \
+                    self.get_filter_benefits()
+        finally:
+            ecoengine._engine = None
+
+        self.assertEqual(basis, local_basis)
+        self.assertEqual(set(margins['plot']), set(local_margins['plot']))
+
+    def test_margins_are_returned_beside_basis(self):
+        rslt, basis, margins = self.get_filter_benefits()
+
+        self.assertEqual(basis['plot']['n_objects_used'], 3)
+        self.assertEqual(basis['plot']['n_objects_discarded'], 1)
+
+        # Basis values are summed across calculators, so are all numbers
+        for value in basis['plot'].itervalues():
+            self.assertIsInstance(value, (int, long, float))
+
+        # Every tree with data was sampled, so the estimate is exact
+        self.assertAlmostEqual(
+            margins['plot'][BenefitCategory.ENERGY]['value'], 0)
+
+    def test_not_sampled_below_threshold(self):
+        with self.settings(ECO_SAMPLING_THRESHOLD=4):
+            rslt, basis, margins = self.get_filter_benefits()
+
+        self.assertIn('eco_summary.json', self.endpoints)
+        self.assertEqual(margins, {})
+
+
+class StratifiedEstimateTest(OTMTestCase):
+    def test_estimate_and_variance(self):
+        estimates, variances = benefit_sampling._stratified_estimate(
+            [(10, [{'a': 1}, {'a': 3}]),
+             (4, [{'a': 5}, {'a': 5}, {'a': 5}, {'a': 5}])])
+
+        self.assertAlmostEqual(estimates['a'], 10 * 2 + 4 * 5)
+        # 10^2 * (1 - 2/10) * 2 / 2, and nothing for the fully
+        # sampled stratum
+        self.assertAlmostEqual(variances['a'], 80)
+
+    def test_sparse_strata_are_pooled(self):
+        strata = benefit_sampling._collapse_strata(
+            {'big': 10, 'small1': 3, 'small2': 2},
+            {'big': [{'a': 1}, {'a': 3}], 'small1': [{'a': 7}]})
+
+        strata = sorted((size, sorted(v['a'] for v in values))
+                        for size, values in strata)
+
+        # Too few samples in the small strata, so the whole sample is used
+        self.assertEqual(strata, [(5, [1, 3, 7]), (10, [1, 3])])
+
+
+class AsyncBenefitSummaryTest(EcoTest):
+    def setUp(self):
+        super(AsyncBenefitSummaryTest, self).setUp()
+        self.query = json.dumps({'tree.readonly': {'IS': False}})
+
+    def make_request(self):
+        request = make_request({'q': self.query}, instance=self.instance)
+        request.instance_supports_ecobenefits = True
+        return request
+
+    def begin(self):
+        return begin_search_tree_benefits(self.make_request(), self.instance)
+
+    def test_job_result_is_rendered(self):
+        # Celery runs tasks eagerly in tests, so the job is already done
+        job_id = self.begin()['job_id']
+        status = check_search_tree_benefits(
+            self.make_request(), self.instance, job_id)
+
+        self.assertEqual(status['status'], 'COMPLETE')
+        self.assertIn('benefit-values', status['html'])
+
+    def test_cached_summary_is_returned_immediately(self):
+        self.begin()
+        status = self.begin()
+
+        self.assertEqual(status['status'], 'COMPLETE')
+        self.assertIsNone(status['job_id'])
+        self.assertEqual(BenefitSummaryJob.objects.count(), 1)
+
+    def test_identical_searches_share_a_job(self):
+        job_id = self.begin()['job_id']
+        benefit_caches.clear_caches()
+
+        status = self.begin()
+
+        self.assertEqual(status['job_id'], job_id)
+        self.assertEqual(status['status'], 'COMPLETE')
+        self.assertEqual(BenefitSummaryJob.objects.count(), 1)
+
+    def test_edit_starts_new_job(self):
+        job_id = self.begin()['job_id']
+
+        self.tree.diameter = 1000
+        self.tree.save_with_user(self.user)
+
+        self.assertNotEqual(self.begin()['job_id'], job_id)
+
+    def test_stale_pending_job_fails(self):
+        job = BenefitSummaryJob.objects.create(
+            instance=self.instance, key='stale', language='en')
+
+        with self.settings(ECO_ASYNC_SUMMARY_TIMEOUT=-1):
+            status = check_search_tree_benefits(
+                self.make_request(), self.instance, job.pk)
+
+        self.assertEqual(status['status'], 'FAILED')
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from django.test.utils import override_settings
+
+from treemap import ecobackend
+from treemap.lib import itree_codes
+from treemap.tests.base import OTMTestCase
+
+SERVICE_CODES = {'NoEastXXX': ['CEAT', 'ACRU'], 'PiedmtCLT': ['QURU']}
+
+
+class ITreeCodesTest(OTMTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'itree-codes.json')
+        self.override = override_settings(ITREE_CODES_CACHE_FILE=self.path)
+        self.override.enable()
+
+        self.calls = 0
+        self.service_up = True
+
+        def mockcodes(endpoint, params, *args, **kwargs):
+            self.calls += 1
+            if self.service_up:
+                return ({'Codes': SERVICE_CODES}, None)
+            else:
+                return (None, ecobackend.UNKNOWN_ECOBENEFIT_ERROR)
+
+        self.origBenefitFn = ecobackend.json_benefits_call
+        ecobackend.json_benefits_call = mockcodes
+
+        itree_codes.clear()
+
+    def tearDown(self):
+        itree_codes.warm_up(wait=True)
+        itree_codes.clear()
+        ecobackend.json_benefits_call = self.origBenefitFn
+        self.override.disable()
+        shutil.rmtree(self.dir)
+
+    def write_cache_file(self, codes, age=0):
+        with open(self.path, 'w') as f:
+            json.dump(codes, f)
+        mtime = time.time() - age
+        os.utime(self.path, (mtime, mtime))
+
+    def test_falls_back_to_shipped_codes(self):
+        self.service_up = False
+
+        self.assertTrue(itree_codes.has_itree_code('NoEastXXX', 'CEL OTHER'))
+        self.assertIn('CEL OTHER', itree_codes.all_itree_codes())
+
+        itree_codes.warm_up(wait=True)
+
+        self.assertEqual(self.calls, 1)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(itree_codes.has_itree_code('NoEastXXX', 'CEL OTHER'))
+
+    def test_warm_up_fetches_and_writes_file(self):
+        itree_codes.warm_up(wait=True)
+
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(itree_codes.has_itree_code('PiedmtCLT', 'QURU'))
+        self.assertFalse(itree_codes.has_itree_code('NoEastXXX', 'QURU'))
+
+        with open(self.path) as f:
+            self.assertEqual(json.load(f), SERVICE_CODES)
+
+    def test_refresh_creates_cache_directory(self):
+        path = os.path.join(self.dir, 'var', 'itree-codes.json')
+        with override_settings(ITREE_CODES_CACHE_FILE=path):
+            self.assertTrue(itree_codes.refresh())
+
+            with open(path) as f:
+                self.assertEqual(json.load(f), SERVICE_CODES)
+
+    def test_fresh_file_is_used_without_fetching(self):
+        self.write_cache_file(SERVICE_CODES)
+
+        self.assertEqual(itree_codes.all_itree_codes(),
+                         {'CEAT', 'ACRU', 'QURU'})
+        itree_codes.warm_up(wait=True)
+
+        self.assertEqual(self.calls, 0)
+
+    def test_stale_file_is_used_while_refreshing(self):
+        self.write_cache_file({'NoEastXXX': ['OLD']}, age=60 * 60 * 48)
+
+        self.assertTrue(itree_codes.has_itree_code('NoEastXXX', 'OLD'))
+        itree_codes.warm_up(wait=True)
+
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(itree_codes.has_itree_code('NoEastXXX', 'CEAT'))
+
+    def test_failed_refresh_is_not_retried_immediately(self):
+        self.service_up = False
+
+        itree_codes.warm_up(wait=True)
+        itree_codes.warm_up(wait=True)
+
+        self.assertEqual(self.calls, 1)
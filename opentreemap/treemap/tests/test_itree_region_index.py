@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+from django.contrib.gis.geos import Point, MultiPolygon
+
+from treemap.lib import itree_region_index, object_caches
+from treemap.models import ITreeRegion
+from treemap.tests.base import OTMTestCase
+
+
+class ITreeRegionIndexTest(OTMTestCase):
+    def setUp(self):
+        ITreeRegion.objects.create(
+            code='Region1', geometry=MultiPolygon(Point(0, 0).buffer(10)))
+        ITreeRegion.objects.create(
+            code='Region2', geometry=MultiPolygon(Point(100, 0).buffer(10)))
+
+    def test_point_in_region(self):
+        self.assertEqual(
+            itree_region_index.region_code_for_point(Point(1, 1, srid=3857)),
+            'Region1')
+
+    def test_point_outside_regions(self):
+        self.assertIsNone(
+            itree_region_index.region_code_for_point(Point(50, 0)))
+
+    def test_many_points_use_no_queries(self):
+        itree_region_index.region_code_for_point(Point(0, 0))  # loads index
+
+        with self.assertNumQueries(0):
+            codes = itree_region_index.region_codes_for_points(
+                [Point(100, 1), None, Point(-5, 0), Point(50, 50)])
+
+        self.assertEqual(codes, ['Region2', None, 'Region1', None])
+
+    def test_new_region_is_seen(self):
+        point = Point(200, 0)
+        self.assertIsNone(itree_region_index.region_code_for_point(point))
+
+        ITreeRegion.objects.create(
+            code='Region3', geometry=MultiPolygon(point.buffer(10)))
+
+        self.assertEqual(itree_region_index.region_code_for_point(point),
+                         'Region3')
+
+    def test_region_changed_elsewhere_is_seen_when_notified(self):
+        point = Point(200, 0)
+        self.assertIsNone(itree_region_index.region_code_for_point(point))
+
+        # Simulate another process adding a region, which this process
+        # only learns of through the notification channel
+        ITreeRegion.objects.bulk_create([ITreeRegion(
+            code='Region3', geometry=MultiPolygon(point.buffer(10)))])
+        self.assertIsNone(itree_region_index.region_code_for_point(point))
+
+        object_caches._handle_notification('itree_regions')
+
+        self.assertEqual(itree_region_index.region_code_for_point(point),
+                         'Region3')
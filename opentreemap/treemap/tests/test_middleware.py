@@ -7,6 +7,9 @@ from django.conf import settings
 from django.http import HttpResponseRedirect
 from django.test.utils import override_settings
 from opentreemap.middleware import InternetExplorerRedirectMiddleware
+from treemap.lib import request_memo
+from treemap.lib.request_memo import RequestMemoMiddleware
+from treemap.tests import make_instance, make_commander_user
 from treemap.tests.base import OTMTestCase
 
 
@@ -91,3 +94,37 @@ class InternetExplorerRedirectMiddlewareTests(OTMTestCase):
         req, res = self._request_with_agent(USER_AGENT_STRINGS.IE_8,
                                             other_params=params)
         self.assertIsNone(res, 'Expected middleware to return None for JSON')
+
+
+class RequestMemoMiddlewareTests(OTMTestCase):
+    def setUp(self):
+        self.instance = make_instance()
+        self.user = make_commander_user(self.instance)
+        self.request = MockRequest()
+
+    def tearDown(self):
+        request_memo.end()
+
+    def test_instance_user_is_queried_once_per_request(self):
+        RequestMemoMiddleware().process_request(self.request)
+
+        iuser = self.user.get_instance_user(self.instance)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.user.get_instance_user(self.instance),
+                             iuser)
+            self.assertTrue(self.instance.is_accessible_by(self.user))
+
+        RequestMemoMiddleware().process_response(self.request, None)
+
+        with self.assertNumQueries(1):
+            self.user.get_instance_user(self.instance)
+
+    def test_saving_instance_user_is_seen(self):
+        RequestMemoMiddleware().process_request(self.request)
+
+        iuser = self.user.get_instance_user(self.instance)
+        iuser.admin = True
+        iuser.save_with_user(self.user)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(self.user.get_instance_user(self.instance).admin)
@@ -364,6 +364,41 @@ class InstanceTest(OTMTestCase):
 
         self.assertEqual(instance.has_itree_region(), True)
 
+    def test_itree_region_codes_are_stored(self):
+        p1 = Point(0, 0)
+        ITreeRegion.objects.create(code='Region1',
+                                   geometry=MultiPolygon((p1.buffer(10))))
+        instance = make_instance(point=p1)
+
+        self.assertEqual(instance.itree_region_codes(), ['Region1'])
+
+        instance = Instance.objects.get(pk=instance.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(instance.itree_region_codes(), ['Region1'])
+
+    def test_itree_region_codes_follow_bounds(self):
+        p1, p2 = Point(0, 0), Point(10000, 10000)
+        ITreeRegion.objects.create(code='Region1',
+                                   geometry=MultiPolygon((p1.buffer(10))))
+        instance = make_instance(point=p1)
+        self.assertEqual(instance.itree_region_codes(), ['Region1'])
+
+        instance.bounds = MultiPolygon((p2.buffer(10)))
+        instance.save()
+
+        self.assertEqual(instance.itree_region_codes(), [])
+
+    def test_new_itree_region_resets_stored_codes(self):
+        p1 = Point(0, 0)
+        instance = make_instance(point=p1)
+        self.assertEqual(instance.itree_region_codes(), [])
+
+        ITreeRegion.objects.create(code='Region1',
+                                   geometry=MultiPolygon((p1.buffer(10))))
+
+        instance = Instance.objects.get(pk=instance.pk)
+        self.assertEqual(instance.itree_region_codes(), ['Region1'])
+
     @override_settings(FEATURE_BACKEND_FUNCTION='treemap.plugin.always_false')
     def test_advanced_search_fields(self):
         instance = make_instance()
@@ -382,3 +417,14 @@ class InstanceTest(OTMTestCase):
                                   'tree':
                                   {'fields': [],
                                    'udfd': None}}}})
+
+    @override_settings(FEATURE_BACKEND_FUNCTION='treemap.plugin.always_true')
+    def test_advanced_search_fields_are_copies(self):
+        instance = make_instance()
+        instance.advanced_search_fields['standard'].append({})
+        instance.advanced_search_fields['missing'][0]['label'] = 'Changed'
+
+        fields = instance.advanced_search_fields
+        self.assertEqual(len(fields['standard']), 3)
+        self.assertEqual(fields['missing'][0]['label'],
+                         'Show missing species')
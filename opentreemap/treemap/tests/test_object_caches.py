@@ -5,9 +5,15 @@ from django.test import TestCase
 from django.test.utils import override_settings
 
 from treemap.audit import FieldPermission
+from treemap.lib import object_caches
 from treemap.lib.object_caches import (clear_caches, role_permissions,
-                                       permissions, udf_defs)
-from treemap.models import InstanceUser
+                                       permissions, udf_defs,
+                                       LocalAdjunctStore, set_store,
+                                       load_adjuncts, adjunct_cache_stats,
+                                       compiled_permissions,
+                                       compiled_role_permissions,
+                                       instance_by_url_name)
+from treemap.models import Instance, InstanceUser
 from treemap.tests import (make_instance, make_commander_user,
                            make_user)
 from treemap.udf import UserDefinedFieldDefinition
@@ -150,6 +156,70 @@ class PermissionsCacheTest(TestCase):
         self.instance.save()
         self.assert_role_permission(self.role, READ)
 
+    def test_role_perm_sees_notified_update(self):
+        self.assert_role_permission(self.role, WRITE)  # loads cache
+        self.set_permission_silently(self.role, READ)
+
+        # self.instance is now stale, as it would be in a celery worker
+        object_caches._handle_notification(
+            '%s:%s' % (self.instance.pk, self.instance.adjuncts_timestamp + 1))
+
+        self.assert_role_permission(self.role, READ)
+
+    def test_notified_timestamp_is_required(self):
+        object_caches._handle_notification(
+            '%s:%s' % (self.instance.pk, self.instance.adjuncts_timestamp + 1))
+        self.assert_role_permission(self.role, WRITE)  # loads cache
+        self.set_permission_silently(self.role, READ)
+
+        # The timestamp was already seen, so the cache is still used
+        object_caches._handle_notification(
+            '%s:%s' % (self.instance.pk, self.instance.adjuncts_timestamp + 1))
+
+        with self.assertNumQueries(0):
+            self.assert_role_permission(self.role, WRITE)
+
+    def test_bad_notification_is_ignored(self):
+        self.assert_role_permission(self.role, WRITE)  # loads cache
+        self.set_permission_silently(self.role, READ)
+
+        object_caches._handle_notification('garbage')
+
+        self.assert_role_permission(self.role, WRITE)
+
+    def test_compiled_perms(self):
+        compiled = compiled_role_permissions(self.role, self.instance, 'Plot')
+
+        self.assertEqual(compiled.level('geom'), WRITE)
+        self.assertTrue(compiled.allows_write('geom'))
+        self.assertIsNone(compiled.level('bar'))
+        self.assertFalse(compiled.allows_read('bar'))
+
+        self.assertIs(
+            compiled,
+            compiled_role_permissions(self.role, self.instance, 'Plot'))
+
+    def test_compiled_perms_see_perm_update(self):
+        compiled = compiled_permissions(self.user, self.instance, 'Plot')
+        self.assertIn('geom', compiled.direct_writable)
+
+        self.set_permission(self.role, READ)
+
+        compiled = compiled_permissions(self.user, self.instance, 'Plot')
+        self.assertEqual(compiled.level('geom'), READ)
+        self.assertIn('geom', compiled.readable)
+        self.assertNotIn('geom', compiled.writable)
+
+    def test_cached_perms_are_shared_and_frozen(self):
+        perms = role_permissions(self.role, self.instance, 'Plot')
+        perms_again = role_permissions(self.role, self.instance, 'Plot')
+
+        self.assertIsNot(perms, perms_again)
+        self.assertIs(perms[0], perms_again[0])
+
+        with self.assertRaises(AttributeError):
+            perms[0].permission_level = READ
+
 
 @override_settings(USE_OBJECT_CACHES=True)
 class UDFDefinitionCacheTest(TestCase):
@@ -209,3 +279,219 @@ class UDFDefinitionCacheTest(TestCase):
         self.instance.adjuncts_timestamp += 1
         self.instance.save()
         self.assert_udf_name('Tree', 'c')
+
+    def test_cached_defs_are_shared_and_frozen(self):
+        defs = udf_defs(self.instance, 'Tree')
+        defs_again = udf_defs(self.instance, 'Tree')
+
+        self.assertIsNot(defs, defs_again)
+        self.assertIs(defs[0], defs_again[0])
+
+        with self.assertRaises(AttributeError):
+            defs[0].name = 'c'
+        self.assert_udf_name('Tree', 'a')
+
+
+@override_settings(USE_OBJECT_CACHES=True)
+class SharedAdjunctStoreTest(TestCase):
+    def setUp(self):
+        self.store = LocalAdjunctStore()
+        set_store(self.store)
+        clear_caches()
+
+        self.instance = make_instance()
+        self.user = make_commander_user(self.instance)
+        self.role = self.user.get_role(self.instance)
+
+    def tearDown(self):
+        set_store(None)
+        clear_caches()
+
+    def clear_local_caches(self):
+        # Simulates a request to another process
+        object_caches._adjuncts.clear()
+
+    def get_permission_level(self):
+        perms = [p for p in permissions(self.user, self.instance, 'Plot')
+                 if p.field_name == 'geom']
+        return perms[0].permission_level
+
+    def test_loaded_once_for_all_processes(self):
+        self.assertEqual(self.get_permission_level(), WRITE)
+        self.clear_local_caches()
+        sets = self.store.sets
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_permission_level(), WRITE)
+            udf_defs(self.instance, 'Plot')
+
+        self.assertEqual(self.store.sets, sets)
+
+    def test_stale_entry_is_reloaded(self):
+        self.get_permission_level()
+        self.clear_local_caches()
+        sets = self.store.sets
+
+        FieldPermission.objects\
+            .filter(role=self.role, model_name='Plot', field_name='geom')\
+            .update(permission_level=READ)
+        self.instance.adjuncts_timestamp += 1
+        self.instance.save()
+
+        self.assertEqual(self.get_permission_level(), READ)
+        self.assertEqual(self.store.sets, sets + 1)
+
+    def test_stats_are_published(self):
+        clear_caches()
+        udf_defs(self.instance, 'Plot')
+        udf_defs(self.instance, 'Tree')
+
+        # Done by the publisher thread in a running process
+        object_caches._publish_stats()
+
+        all_stats = object_caches.published_adjunct_cache_stats()
+        self.assertEqual(len(all_stats), 1)
+
+        stats = all_stats.values()[0]
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['instances'].keys(), [self.instance.pk])
+        self.assertNotIn('bytes', stats['instances'][self.instance.pk])
+
+        self.assertGreater(
+            object_caches.shared_adjunct_bytes(self.instance.pk), 0)
+
+    def test_processes_publish_separately(self):
+        udf_defs(self.instance, 'Plot')
+        object_caches._publish_stats()
+
+        # Simulate another process, which gets its own slot
+        object_caches._stats_slot = None
+        object_caches._publish_stats()
+
+        self.assertEqual(len(self.store.get_stats()), 2)
+
+    def test_lookup_does_not_publish_stats(self):
+        udf_defs(self.instance, 'Plot')
+        udf_defs(self.instance, 'Plot')
+
+        self.assertEqual(self.store.get_stats(), [])
+
+    def test_update_removes_entry(self):
+        self.get_permission_level()
+
+        fp = FieldPermission.objects.get(
+            role=self.role, model_name='Plot', field_name='geom')
+        fp.permission_level = READ
+        fp.save()
+
+        self.assertIsNone(self.store.get(self.instance.pk))
+
+
+@override_settings(USE_OBJECT_CACHES=True, OBJECT_CACHES_MAX_INSTANCES=1)
+class AdjunctCacheLimitTest(TestCase):
+    def setUp(self):
+        self.instance1 = make_instance()
+        self.instance2 = make_instance()
+        clear_caches()
+
+    def tearDown(self):
+        clear_caches()
+
+    def test_least_recently_used_instance_is_evicted(self):
+        udf_defs(self.instance1, 'Plot')
+        udf_defs(self.instance2, 'Plot')
+
+        stats = adjunct_cache_stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['instances'].keys(), [self.instance2.pk])
+
+    def test_stats(self):
+        load_adjuncts(self.instance1)
+        udf_defs(self.instance1, 'Plot')
+        udf_defs(self.instance1, 'Tree')
+
+        stats = adjunct_cache_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+
+        entry = stats['instances'][self.instance1.pk]
+        self.assertEqual(entry['hits'], 2)
+        self.assertEqual(entry['permissions'], FieldPermission.objects.filter(
+            instance=self.instance1).count())
+        self.assertNotIn('bytes', entry)
+
+        entry = adjunct_cache_stats(include_bytes=True)['instances'][
+            self.instance1.pk]
+        self.assertGreater(entry['bytes'], 0)
+
+
+@override_settings(USE_OBJECT_CACHES=True)
+class InstanceCacheTest(TestCase):
+    def setUp(self):
+        self.instance = make_instance()
+        clear_caches()
+
+    def tearDown(self):
+        clear_caches()
+
+    def test_cached_instance_is_copied(self):
+        instance, __ = instance_by_url_name(self.instance.url_name)
+
+        with self.assertNumQueries(1):
+            instance_again, __ = instance_by_url_name(
+                self.instance.url_name.upper())
+
+        self.assertEqual(instance_again.pk, self.instance.pk)
+        self.assertIsNot(instance_again, instance)
+
+    def test_saved_instance_is_reloaded(self):
+        instance_by_url_name(self.instance.url_name)
+
+        self.instance.name = 'renamed'
+        self.instance.save()
+
+        instance, __ = instance_by_url_name(self.instance.url_name)
+        self.assertEqual(instance.name, 'renamed')
+
+    def test_unchanged_save_keeps_cached_instance(self):
+        timestamp = self.instance.adjuncts_timestamp
+        self.instance.save()
+
+        self.assertEqual(self.instance.adjuncts_timestamp, timestamp)
+
+    def test_stale_copy_does_not_write_back_old_values(self):
+        stale = Instance.objects.get(pk=self.instance.pk)
+        self.instance.name = 'renamed'
+        self.instance.save()
+
+        stale.is_public = not stale.is_public
+        stale.save()
+
+        saved = Instance.objects.get(pk=self.instance.pk)
+        self.assertEqual(saved.name, 'renamed')
+        self.assertEqual(saved.is_public, stale.is_public)
+        self.assertGreater(saved.adjuncts_timestamp,
+                           self.instance.adjuncts_timestamp)
+
+    def test_config_changed_in_place_is_saved(self):
+        instance_by_url_name(self.instance.url_name)
+
+        self.instance.config['scss_variables'] = {'primary-color': '#fff'}
+        self.instance.save()
+
+        instance, __ = instance_by_url_name(self.instance.url_name)
+        self.assertEqual(instance.config['scss_variables'],
+                         {'primary-color': '#fff'})
+
+    def test_geo_rev_is_current(self):
+        instance_by_url_name(self.instance.url_name)
+        self.instance.update_geo_rev()
+
+        instance, __ = instance_by_url_name(self.instance.url_name)
+        self.assertEqual(instance.geo_rev, self.instance.geo_rev)
+
+    def test_unknown_url_name(self):
+        with self.assertRaises(Instance.DoesNotExist):
+            instance_by_url_name('nowhere')
@@ -3,9 +3,11 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import division
 
+from treemap.audit import FieldPermission
 from treemap.models import Role
 from treemap.lib import perms
 
+from treemap.tests import make_instance, make_commander_user
 from treemap.tests.base import OTMTestCase
 
 
@@ -15,3 +17,33 @@ class PermTestCase(OTMTestCase):
                          perms._allows_perm(Role(),
                                             'NonExistentModel',
                                             any, 'allows_reads'))
+
+
+class AllowsPermTest(OTMTestCase):
+    def setUp(self):
+        self.instance = make_instance()
+        self.role = make_commander_user(self.instance).get_role(self.instance)
+
+        fp = FieldPermission.objects.get(
+            role=self.role, model_name='Plot', field_name='geom')
+        fp.permission_level = FieldPermission.READ_ONLY
+        fp.save()
+
+    def test_field(self):
+        self.assertTrue(perms.allows_read(self.role, 'Plot', field='geom'))
+        self.assertFalse(perms.allows_write(self.role, 'Plot', field='geom'))
+
+    def test_fields(self):
+        fields = {'geom', 'width'}
+
+        self.assertTrue(perms.allows_write(self.role, 'Plot', fields=fields))
+        self.assertFalse(perms.allows_write(self.role, 'Plot', fields=fields,
+                                            predicate=all))
+        self.assertTrue(perms.allows_read(self.role, 'Plot', fields=fields,
+                                          predicate=all))
+
+    def test_fields_without_perms_are_ignored(self):
+        self.assertFalse(perms.allows_read(self.role, 'Plot', field='bar'))
+        self.assertTrue(perms.allows_write(self.role, 'Plot',
+                                           fields={'width', 'bar'},
+                                           predicate=all))
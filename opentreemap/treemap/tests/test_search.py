@@ -20,8 +20,9 @@ from treemap.tests import (make_instance, make_commander_user,
                            make_simple_polygon, set_write_permissions)
 from treemap.tests.base import OTMTestCase
 from treemap.tests.test_udfs import make_collection_udf
-from treemap.models import (Tree, Plot, Boundary, Species)
-from treemap.udf import UserDefinedFieldDefinition
+from treemap.models import (Tree, Plot, Boundary, Species, MapFeaturePhoto)
+from treemap.udf import UserDefinedFieldDefinition, TypedUDFValue
+from treemap.lib import udf_indexes
 from treemap import search
 
 COLLECTION_UDF_DATATYPE = [{'type': 'choice',
@@ -424,6 +425,72 @@ class FilterParserTests(OTMTestCase):
         self.assertEqual(search._parse_value("2013-04-01 12:00:00"), date)
 
 
+class NormalizeFilterStringTests(OTMTestCase):
+    def test_equivalent_filters_are_equal(self):
+        self.assertEqual(
+            search.normalize_filter_string(
+                '{"tree.diameter": {"MIN": 1, "MAX": 2}, "plot.id": 3}'),
+            search.normalize_filter_string(
+                '{"plot.id":3,"tree.diameter":{"MAX":2,"MIN":1}}'))
+
+    def test_empty_filter(self):
+        self.assertEqual(search.normalize_filter_string(None), '')
+        self.assertEqual(search.normalize_filter_string(''), '')
+
+    def test_invalid_filter_is_unchanged(self):
+        self.assertEqual(search.normalize_filter_string('{bad'), '{bad')
+
+
+class CompiledFilterTests(OTMTestCase):
+    def setUp(self):
+        search.clear_compiled_filters()
+
+    def test_filter_is_compiled_once(self):
+        filterstr = '{"tree.diameter": {"MIN": 1, "MAX": 2}}'
+        node = search.compile_filter(filterstr, search.DEFAULT_MAPPING)
+
+        self.assertIs(search.compile_filter(filterstr,
+                                            search.DEFAULT_MAPPING), node)
+        self.assertIsNot(search.compile_filter(filterstr,
+                                               search.TREE_MAPPING), node)
+        self.assertEqual(node, search.PredicateNode(
+            'tree', (('tree__diameter__gte', 1), ('tree__diameter__lte', 2))))
+
+    def test_nested_combinators_are_flattened(self):
+        node = search.compile_filter(
+            '["AND", {"plot.width": 1, "tree.height": 2},'
+            ' ["AND", {"species.id": 3}]]',
+            search.DEFAULT_MAPPING)
+
+        self.assertEqual(node.combinator, 'AND')
+        self.assertEqual(
+            {child.lookups for child in node.children},
+            {(('width', 1),), (('tree__height', 2),),
+             (('tree__species__id', 3),)})
+
+    def test_invalid_filters_raise_every_time(self):
+        for __ in xrange(2):
+            self.assertRaises(search.ParseException, search.compile_filter,
+                              '["XOR", {"plot.width": 1}]',
+                              search.DEFAULT_MAPPING)
+
+    def test_boundary_is_read_when_q_is_built(self):
+        boundary = Boundary.objects.create(
+            geom=MultiPolygon(make_simple_polygon(0)),
+            name='whatever',
+            category='whatever',
+            sort_order=1)
+        filterstr = json.dumps({'plot.geom': {'IN_BOUNDARY': boundary.pk}})
+
+        search.create_filter(None, filterstr, search.DEFAULT_MAPPING)
+
+        boundary.geom = MultiPolygon(make_simple_polygon(10))
+        boundary.save()
+
+        q = search.create_filter(None, filterstr, search.DEFAULT_MAPPING)
+        self.assertEqual(q.children, [('geom__within', boundary.geom)])
+
+
 class SearchTests(OTMTestCase):
     def setUp(self):
         self.p1 = Point(0, 0)
@@ -923,3 +990,231 @@ class SearchTests(OTMTestCase):
                            {'IS': 'prune'},
                            'udf:plot:%s.date' % self.plotstew.pk:
                            {'MIN': '2013-09-15 00:00:00'}}))
+
+    def test_cudf_numeric_search(self):
+        heights = make_collection_udf(self.instance, name='Alerts')
+        set_write_permissions(self.instance, self.commander, 'Plot',
+                              [heights.canonical_name])
+
+        p1, __ = self.create_tree_and_plot(
+            plotudfs={heights.name: [{'action': 'water', 'height': 3},
+                                     {'action': 'prune', 'height': 12}]})
+        p2, __ = self.create_tree_and_plot(
+            plotudfs={heights.name: [{'action': 'water', 'height': 9}]})
+
+        self.assertEqual(
+            {p2.pk},
+            self._execute_and_process_filter(
+                {'udf:plot:%s.height' % heights.pk: {'MIN': 5, 'MAX': 10}}))
+
+        self.assertEqual(
+            {p1.pk, p2.pk},
+            self._execute_and_process_filter(
+                {'udf:plot:%s.height' % heights.pk: {'MIN': 8.5}}))
+
+    def test_udf_numeric_search_with_int_value(self):
+        p1, p2, p3 = self._setup_udfs()
+
+        self.assertEqual(
+            {p1, p2},
+            self._execute_and_process_filter(
+                {'tree.udf:Test float': {'MIN': 9, 'MAX': 12.5}}))
+
+    def test_udf_search_ignores_values_which_cant_be_cast(self):
+        p1, p2, p3 = self._setup_udfs()
+        __, tree = self.create_tree_and_plot()
+
+        # Other instances and MapFeature types may store anything under
+        # the same name
+        cursor = connection.cursor()
+        cursor.execute(
+            "UPDATE treemap_tree SET udfs = udfs || hstore(%s, 'n/a') "
+            "WHERE id = %s", ['Test float', tree.pk])
+
+        self.assertEqual(
+            {p1, p2, p3},
+            self._execute_and_process_filter(
+                {'tree.udf:Test float': {'MIN': 1}}))
+
+        udf_def = UserDefinedFieldDefinition.objects.get(
+            instance=self.instance, name='Test float')
+        udf_indexes.drop_index(udf_def)
+        self.assertTrue(udf_indexes.create_index(udf_def))
+
+    def test_udf_date_search_ignores_dates_not_in_iso_format(self):
+        p1, p2, p3 = self._setup_udfs()
+
+        # 'now' and ambiguous formats depend on the database's settings,
+        # so can't be indexed
+        cursor = connection.cursor()
+        cursor.execute(
+            "UPDATE treemap_mapfeature SET udfs = udfs || hstore(%s, %s) "
+            "WHERE id = %s", ['Test date', 'now', p1])
+        cursor.execute(
+            "UPDATE treemap_mapfeature SET udfs = udfs || hstore(%s, %s) "
+            "WHERE id = %s", ['Test date', '01/02/2011', p2])
+
+        self.assertEqual(
+            {p3},
+            self._execute_and_process_filter(
+                {'plot.udf:Test date': {'MIN': "2000-01-01 00:00:00"}}))
+
+    def test_udf_search_casts_values(self):
+        self._setup_udfs()
+
+        self.assertEqual(
+            search._type_udf_value('udf:Test float__lt', 10.0, 'tree',
+                                   self.instance),
+            TypedUDFValue(10.0, 'float8', self.instance.pk))
+        self.assertEqual(
+            search._type_udf_value('udf:Test string', 'baz', 'plot',
+                                   self.instance),
+            'baz')
+        self.assertEqual(
+            search._type_udf_value('udf:Test date__lt', 'baz', 'plot',
+                                   self.instance),
+            'baz')
+
+    def test_udf_search_indexes(self):
+        self._setup_udfs()
+
+        indexes = {udf_def.name: udf_indexes.index_name(udf_def)
+                   for udf_def in UserDefinedFieldDefinition.objects.filter(
+                       instance=self.instance)}
+
+        def index_exists(name):
+            cursor = connection.cursor()
+            cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s',
+                           [indexes[name]])
+            return cursor.fetchone() is not None
+
+        self.assertTrue(index_exists('Test float'))
+        self.assertTrue(index_exists('Test date'))
+        self.assertFalse(index_exists('Test string'))
+
+        UserDefinedFieldDefinition.objects.get(
+            instance=self.instance, name='Test float').delete()
+
+        self.assertFalse(index_exists('Test float'))
+
+
+class SearchOptimizerTests(OTMTestCase):
+    def setUp(self):
+        self.instance = make_instance(point=Point(0, 0))
+        self.commander = make_commander_user(self.instance)
+
+    def _optimize(self, filter):
+        return search.optimize_filter(
+            search._compile_filter(filter, search.DEFAULT_MAPPING))
+
+    def _create_plot(self, diameter=None, n_photos=0):
+        plot = Plot(geom=self.instance.center, instance=self.instance)
+        plot.save_with_user(self.commander)
+
+        if diameter is not None:
+            tree = Tree(plot=plot, instance=self.instance, diameter=diameter)
+            tree.save_with_user(self.commander)
+
+        MapFeaturePhoto.objects.bulk_create([
+            MapFeaturePhoto(map_feature=plot, instance=self.instance,
+                            image='photo.jpg', thumbnail='photo.jpg')
+            for __ in xrange(n_photos)])
+
+        return plot.pk
+
+    def _search(self, filter):
+        filterstr = json.dumps(filter)
+        return [p.pk for p in
+                search.Filter(filterstr, '', self.instance).get_objects(Plot)]
+
+    def test_range_predicates_are_merged(self):
+        node = self._optimize(
+            ['AND',
+             {'tree.diameter': {'MIN': 1}},
+             {'tree.diameter': {'MIN': 3, 'MAX': 10}},
+             {'tree.height': 2}])
+
+        self.assertEqual(node, search.PredicateNode(
+            'tree', (('tree__diameter__gte', 3),
+                     ('tree__diameter__lte', 10),
+                     ('tree__height', 2))))
+
+    def test_conflicting_predicates_are_not_merged(self):
+        node = self._optimize(
+            ['AND', {'plot.width': 1}, {'plot.width': 2}])
+
+        self.assertEqual(node.combinator, 'AND')
+        self.assertEqual(len(node.children), 2)
+
+    def test_duplicate_predicates_are_removed(self):
+        node = self._optimize(
+            ['OR', {'plot.width': 1}, {'plot.width': 1}])
+
+        self.assertEqual(node, search.PredicateNode('plot', (('width', 1),)))
+
+    def test_one_to_many_predicates_use_subqueries(self):
+        node = self._optimize({'mapFeaturePhoto.id': {'ISNULL': False}})
+
+        self.assertEqual(node, search.RelatedPredicateNode(
+            'mapFeaturePhoto', 'pk', MapFeaturePhoto, 'map_feature',
+            ((('id__isnull', False),),)))
+
+        node = self._optimize({'mapFeaturePhoto.id': {'ISNULL': True}})
+
+        self.assertEqual(node, search.PredicateNode(
+            'mapFeaturePhoto', (('mapfeaturephoto__id__isnull', True),)))
+
+    def test_unmerged_one_to_many_predicates_share_a_subquery(self):
+        node = self._optimize(
+            ['AND', {'mapFeaturePhoto.id': 1}, {'mapFeaturePhoto.id': 2}])
+
+        self.assertEqual(node, search.RelatedPredicateNode(
+            'mapFeaturePhoto', 'pk', MapFeaturePhoto, 'map_feature',
+            ((('id', 1),), (('id', 2),))))
+
+    def test_one_to_many_predicates_in_nested_combinators_are_joined(self):
+        node = self._optimize(
+            ['AND',
+             {'mapFeaturePhoto.id': {'MIN': 1}},
+             ['OR', {'mapFeaturePhoto.id': 2}, {'tree.diameter': 2}]])
+
+        self.assertNotIn(search.RelatedPredicateNode,
+                         [type(child) for child in node.children])
+
+    def test_results_match_unoptimized_filters(self):
+        self._create_plot(diameter=2, n_photos=2)
+        self._create_plot(diameter=5, n_photos=1)
+        self._create_plot(diameter=8)
+        self._create_plot()
+        photo_ids = list(MapFeaturePhoto.objects.order_by('pk')
+                         .values_list('pk', flat=True))
+
+        filters = [
+            ['AND',
+             {'tree.diameter': {'MIN': 1}},
+             {'tree.diameter': {'MIN': 3, 'MAX': 10}}],
+            ['OR', {'tree.diameter': 2}, {'tree.diameter': 2}],
+            {'mapFeaturePhoto.id': {'ISNULL': False}},
+            {'mapFeaturePhoto.id': {'ISNULL': True}},
+            ['AND',
+             {'mapFeaturePhoto.id': {'ISNULL': False}},
+             {'tree.diameter': {'MAX': 6}}],
+            # No single photo has both ids
+            ['AND',
+             {'mapFeaturePhoto.id': photo_ids[0]},
+             {'mapFeaturePhoto.id': photo_ids[1]}],
+            ['AND',
+             {'mapFeaturePhoto.id': {'MIN': photo_ids[1]}},
+             ['OR',
+              {'mapFeaturePhoto.id': photo_ids[0]},
+              {'tree.diameter': 8}]],
+        ]
+
+        for filter in filters:
+            optimized = self._search(filter)
+            with self.settings(SEARCH_OPTIMIZE_FILTERS=False):
+                unoptimized = self._search(filter)
+
+            self.assertEqual(set(optimized), set(unoptimized))
+            # Plots with several photos are no longer repeated
+            self.assertEqual(len(optimized), len(set(optimized)))
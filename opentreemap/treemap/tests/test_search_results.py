@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import json
+
+from django.contrib.gis.geos import MultiPolygon, Point
+
+from treemap.instance import Instance
+from treemap.lib import search_results
+from treemap.models import Plot, Tree
+from treemap.search import Filter
+from treemap.tests import (make_instance, make_commander_user,
+                           make_simple_boundary)
+from treemap.tests.base import OTMTestCase
+
+
+class SearchResultsTest(OTMTestCase):
+    def setUp(self):
+        self.instance = make_instance(point=Point(0, 0))
+        self.user = make_commander_user(self.instance)
+
+        self.plot_ids = [self.create_plot(diameter).pk
+                         for diameter in (1, 5, 10, None)]
+
+    def create_plot(self, diameter=None):
+        plot = Plot(geom=self.instance.center, instance=self.instance)
+        plot.save_with_user(self.user)
+
+        if diameter is not None:
+            tree = Tree(plot=plot, instance=self.instance, diameter=diameter)
+            tree.save_with_user(self.user)
+
+        return plot
+
+    def make_filter(self, filterstr='{"tree.diameter": {"MIN": 2}}'):
+        return Filter(filterstr, '', self.instance)
+
+    def test_count_is_cached(self):
+        self.assertEqual(self.make_filter().get_object_count(Plot), 2)
+
+        # Deleting without an audit record doesn't change the search hash
+        Plot.objects.filter(pk=self.plot_ids[1]).delete()
+
+        self.assertEqual(self.make_filter().get_object_count(Plot), 2)
+        self.assertEqual(search_results.search_result_stats()['hits'], 1)
+
+    def test_edit_invalidates_results(self):
+        self.assertEqual(self.make_filter().get_object_count(Plot), 2)
+
+        self.create_plot(diameter=20)
+
+        self.assertEqual(self.make_filter().get_object_count(Plot), 3)
+
+    def test_equivalent_filters_share_results(self):
+        self.make_filter('{"tree.diameter": {"MIN": 2}}')\
+            .get_object_count(Plot)
+        self.make_filter('{ "tree.diameter":{"MIN":2} }')\
+            .get_object_count(Plot)
+
+        self.assertEqual(search_results.search_result_stats()['hits'], 1)
+
+    def test_boundary_edit_invalidates_results(self):
+        boundary = make_simple_boundary('Around the plots')
+        boundary.geom = MultiPolygon(self.instance.center.buffer(5))
+        boundary.save()
+        self.instance.boundaries.add(boundary)
+
+        filterstr = json.dumps({'plot.geom': {'IN_BOUNDARY': boundary.pk}})
+        self.assertEqual(self.make_filter(filterstr).get_object_count(Plot),
+                         4)
+
+        elsewhere = self.instance.center.clone()
+        elsewhere.x += 100
+        boundary.geom = MultiPolygon(elsewhere.buffer(5))
+        boundary.save()
+
+        # A request would load the instance with its new geo_rev
+        self.instance = Instance.objects.get(pk=self.instance.pk)
+        self.assertEqual(self.make_filter(filterstr).get_object_count(Plot),
+                         0)
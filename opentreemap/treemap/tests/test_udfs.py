@@ -21,7 +21,8 @@ from treemap.tests import (make_instance, make_commander_user,
 from treemap.lib.object_caches import role_permissions
 from treemap.lib.udf import udf_create
 
-from treemap.udf import UserDefinedFieldDefinition
+from treemap.udf import (UserDefinedFieldDefinition,
+                         UserDefinedCollectionSearchValue)
 from treemap.models import (Plot, User)
 from treemap.audit import (AuthorizeException, FieldPermission, Role,
                            approve_or_reject_audit_and_apply,
@@ -1007,6 +1008,38 @@ class CollectionUDFTest(OTMTestCase):
         self.assertEqual(newest_stews[0]['action'], 'prune')
         self.assertEqual(newest_stews[0]['height'], 12)
 
+    def _search_values(self):
+        return set(UserDefinedCollectionSearchValue.objects
+                   .filter(model_id=self.plot.pk)
+                   .values_list('key', 'value', 'number_value'))
+
+    def test_search_values_follow_changes(self):
+        self.plot.udfs['Stewardship'] = [{'action': 'water', 'height': 42},
+                                         {'action': 'prune', 'height': 12}]
+        self.plot.save_with_user(self.commander_user)
+
+        self.assertEqual(self._search_values(),
+                         {('action', 'water', None),
+                          ('height', None, 42.0),
+                          ('action', 'prune', None),
+                          ('height', None, 12.0)})
+
+        plot = Plot.objects.get(pk=self.plot.pk)
+        stews = plot.udfs['Stewardship']
+        stews[1]['height'] = 15
+        plot.udfs['Stewardship'] = stews[1:]
+        plot.save_with_user(self.commander_user)
+
+        self.assertEqual(self._search_values(),
+                         {('action', 'prune', None),
+                          ('height', None, 15.0)})
+
+        self.udf.update_choice('prune', 'trim', name='action')
+
+        self.assertEqual(self._search_values(),
+                         {('action', 'trim', None),
+                          ('height', None, 15.0)})
+
     # Collection fields used the same validation logic as scalar
     # udfs the point of this section is prove that the code is hooked
     # up, not to exhaustively test datatype validation
@@ -3,10 +3,17 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import division
 
+import numpy as np
+
 from django.test.utils import override_settings
 
 from treemap.units import (is_convertible, is_formattable, get_display_value,
-                           is_convertible_or_formattable, get_storage_value)
+                           is_convertible_or_formattable, get_storage_value,
+                           get_conversion_table, get_conversion_factor,
+                           UnitConversionException, get_converted_values,
+                           get_display_values, get_storage_values,
+                           convert_all_to_display_units)
+from treemap.DotDict import DotDict
 from treemap.models import Plot, Tree
 from treemap.json_field import set_attr_on_json_field
 from treemap.tests import make_instance, make_commander_user
@@ -95,6 +102,93 @@ class UnitConverterTest(OTMTestCase):
         self.assertEqual(val, 1)
         self.assertEqual(display_val, '1.0')
 
+    def test_config_view_is_reused(self):
+        get_display_value(self.instance, 'test', 'both', 1)
+        view = self.instance.config_view
+
+        get_display_value(self.instance, 'test', 'both', 1)
+        self.assertIs(self.instance.config_view, view)
+
+    def test_config_view_sees_config_changes(self):
+        val, __ = get_display_value(self.instance, 'test', 'both', 1)
+        self.assertEqual(val, 1)
+
+        set_attr_on_json_field(
+            self.instance, 'config.value_display.test.both.units', 'in')
+        val, __ = get_display_value(self.instance, 'test', 'both', 1)
+        self.assertAlmostEqual(val, 12)
+
+        self.instance.config = '{}'
+        val, __ = get_display_value(self.instance, 'test', 'both', 1)
+        self.assertEqual(val, 1)
+
+    def test_config_view_ignores_other_dotdicts(self):
+        get_display_value(self.instance, 'test', 'both', 1)
+        view = self.instance.config_view
+
+        other = DotDict({'value_display': {'test': {}}})
+        other['value_display.test.both'] = {'units': 'in'}
+        self.assertIs(self.instance.config_view, view)
+
+    def test_config_view_sees_nested_changes(self):
+        set_attr_on_json_field(
+            self.instance, 'config.value_display.test.both.units', 'ft')
+        both = self.instance.config['value_display.test.both']
+        val, __ = get_display_value(self.instance, 'test', 'both', 1)
+        self.assertEqual(val, 1)
+
+        both['units'] = 'in'
+        val, __ = get_display_value(self.instance, 'test', 'both', 1)
+        self.assertAlmostEqual(val, 12)
+
+    def test_conversion_table(self):
+        set_attr_on_json_field(
+            self.instance, 'config.value_display.test.both.units', 'in')
+        table = get_conversion_table(self.instance)['test']
+
+        self.assertEqual(table['both'], ('in', 3, 12))
+        self.assertEqual(table['digit_only'], (None, 2, None))
+        self.assertAlmostEqual(table['separate_units'].factor, 1 / 12)
+
+    def test_conversion_table_skips_invalid_units(self):
+        set_attr_on_json_field(
+            self.instance, 'config.value_display.test.both.units', 'kg')
+        table = get_conversion_table(self.instance)['test']
+        self.assertEqual(table['both'], ('kg', 3, None))
+
+        self.assertRaises(UnitConversionException, get_conversion_factor,
+                          self.instance, 'test', 'both')
+
+    def test_get_converted_values(self):
+        set_attr_on_json_field(
+            self.instance, 'config.value_display.test.both.units', 'in')
+
+        values = get_converted_values(
+            self.instance, 'test', 'both', [1, None, 2.5])
+        self.assertEqual(values, [12, None, 30])
+
+        values = get_converted_values(
+            self.instance, 'test', 'both', np.array([1, np.nan]))
+        self.assertEqual(values[0], 12)
+        self.assertTrue(np.isnan(values[1]))
+
+    def test_get_storage_values(self):
+        set_attr_on_json_field(
+            self.instance, 'config.value_display.test.unit_only.units', 'in')
+        values = get_storage_values(
+            self.instance, 'test', 'unit_only', [12, 'a'])
+        self.assertEqual(values, [1, 'a'])
+
+    def test_get_display_values_matches_get_display_value(self):
+        set_attr_on_json_field(
+            self.instance, 'config.value_display.test.both.units', 'in')
+        values = [1, 2.25, None]
+
+        self.assertEqual(
+            get_display_values(self.instance, 'test', 'both', values),
+            [get_display_value(self.instance, 'test', 'both', value)
+             for value in values])
+
 
 INTEGRATION_TEST_DISPLAY_DEFAULTS = {
     'plot': {
@@ -155,3 +249,19 @@ class ConvertibleTest(OTMTestCase):
 
         updated_tree = Tree.objects.get(pk=self.tree.pk)
         self.assertEqual(1, updated_tree.diameter)
+
+    def test_convert_all_matches_convert_one(self):
+        set_attr_on_json_field(
+            self.instance, 'config.value_display.tree.diameter.units', 'ft')
+        self.tree.diameter = 12
+        other_tree = Tree(instance=self.instance, plot=self.plot)
+
+        convert_all_to_display_units([self.tree, other_tree])
+
+        self.assertAlmostEqual(1, self.tree.diameter)
+        self.assertIsNone(other_tree.diameter)
+        self.assertEqual('display', other_tree.unit_status)
+
+        # Already converted objects are left alone
+        self.tree.convert_to_display_units()
+        self.assertAlmostEqual(1, self.tree.diameter)
@@ -10,7 +10,8 @@ from django.test.utils import override_settings
 
 from treemap.models import Plot
 from treemap.tests import (make_instance, make_commander_user, login,
-                           make_simple_boundary, RequestTestCase)
+                           make_plain_user, make_simple_boundary,
+                           RequestTestCase)
 from treemap.tests.base import OTMTestCase
 
 from opentreemap.settings import STATIC_ROOT
@@ -133,6 +134,18 @@ class RootUrlTests(UrlTestCase):
     def test_point_within_itree_regions(self):
         self.assert_200('/eco/benefit/within_itree_regions/')
 
+    def test_eco_service_stats(self):
+        user = make_plain_user('admin')
+        user.is_superuser = True
+        user.save()
+        login(self.client, user.username)
+        self.assert_200('/eco/benefit/stats/')
+
+    def test_eco_service_stats_forbidden(self):
+        username = make_commander_user().username
+        login(self.client, username)
+        self.assert_403('/eco/benefit/stats/')
+
 
 @override_settings(FEATURE_BACKEND_FUNCTION=None)
 class TreemapUrlTests(UrlTestCase):
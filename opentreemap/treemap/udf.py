@@ -7,6 +7,8 @@ import json
 import copy
 import re
 
+from datetime import datetime
+
 from django.core.exceptions import ValidationError, FieldError
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.gis.db import models
@@ -23,12 +25,15 @@ from django_hstore.fields import DictionaryField, HStoreDict
 from django_hstore.managers import HStoreManager, HStoreGeoManager
 from django_hstore.query import HStoreGeoQuerySet, HStoreGeoWhereNode
 
+from south.signals import post_migrate
+
 from treemap.instance import Instance
 from treemap.audit import (UserTrackable, Audit, UserTrackingException,
                            _reserve_model_id, FieldPermission,
                            AuthorizeException, Authorizable, Auditable)
+from treemap.lib import udf_indexes
 from treemap.lib.object_caches import permissions, invalidate_adjuncts, \
-    udf_defs
+    udf_defs, Freezable
 from treemap.lib.dates import (parse_date_string_with_or_without_time,
                                DATETIME_FORMAT)
 from treemap.util import safe_get_model_class, to_object_name
@@ -45,6 +50,26 @@ _UDF_NAME_REGEX = re.compile(r'^[^_%.]+$')
 UDFC_MODELS = ('Tree', 'Plot')
 UDFC_NAMES = ('Stewardship', 'Alerts')
 
+# Scalar UDFs of these types are searched by casting their values to an
+# SQL type, with the given lookups, and have an index on the cast value
+# (see treemap/lib/udf_indexes.py)
+UDF_SEARCH_TYPES = {
+    'float': ('float8', {'exact', 'gt', 'gte', 'lt', 'lte'}),
+    'int': ('float8', {'exact', 'gt', 'gte', 'lt', 'lte'}),
+    'date': ('timestamp', {'gt', 'gte', 'lt', 'lte'}),
+    'choice': ('text', {'exact'}),
+}
+
+# Subfields of collection UDFs of these types are copied to the given
+# column of UserDefinedCollectionSearchValue, so they can be searched
+# using its indexes
+UDF_COLLECTION_SEARCH_COLUMNS = {
+    'float': 'number_value',
+    'int': 'number_value',
+    'date': 'date_value',
+    'choice': 'value',
+}
+
 
 def safe_get_udf_model_class(model_string):
     """
@@ -258,7 +283,82 @@ class UserDefinedCollectionValue(UserTrackable, models.Model):
                 requires_auth=pending)
 
 
-class UserDefinedFieldDefinition(models.Model):
+class UserDefinedCollectionSearchValue(models.Model):
+    """
+    A copy of one subfield of a UserDefinedCollectionValue, converted to
+    the type of the subfield, so that collection UDFs can be searched with
+    indexes instead of scanning the hstore data of every value.
+
+    Only subfields with a type in UDF_COLLECTION_SEARCH_COLUMNS are
+    copied. The copies are replaced whenever a collection value is saved
+    and are deleted along with it, so they should never be changed
+    directly.
+    """
+    collection_value = models.ForeignKey(UserDefinedCollectionValue)
+    field_definition = models.ForeignKey('UserDefinedFieldDefinition')
+    model_id = models.IntegerField()
+    key = models.CharField(max_length=255)
+    value = models.TextField(null=True)
+    number_value = models.FloatField(null=True)
+    date_value = models.DateField(null=True)
+
+    def __unicode__(self):
+        return '%s: %s' % (self.key, self.value)
+
+
+def _collection_search_values(collection_value):
+    field_definition = collection_value.field_definition
+    search_values = []
+
+    for key, value in collection_value.data.iteritems():
+        datatype = field_definition.datatype_by_field.get(key, {})
+        column = UDF_COLLECTION_SEARCH_COLUMNS.get(datatype.get('type'))
+
+        if column is None:
+            continue
+
+        search_value = UserDefinedCollectionSearchValue(
+            collection_value=collection_value,
+            field_definition=field_definition,
+            model_id=collection_value.model_id,
+            key=key)
+
+        try:
+            if value is None:
+                pass
+            elif column == 'number_value':
+                search_value.number_value = float(value)
+            elif column == 'date_value':
+                if not isinstance(value, datetime):
+                    value = parse_date_string_with_or_without_time(value)
+                search_value.date_value = value.date()
+            else:
+                search_value.value = unicode(value)
+        except (TypeError, ValueError):
+            # Values which don't convert can't match a typed search
+            pass
+
+        search_values.append(search_value)
+
+    return search_values
+
+
+def update_collection_search_values(sender, **kwargs):
+    # Called by 'save' signal handler for UserDefinedCollectionValue
+    collection_value = kwargs['instance']  # 'instance' is a Django term here
+
+    UserDefinedCollectionSearchValue.objects\
+        .filter(collection_value=collection_value)\
+        .delete()
+    UserDefinedCollectionSearchValue.objects.bulk_create(
+        _collection_search_values(collection_value))
+
+
+post_save.connect(update_collection_search_values,
+                  sender=UserDefinedCollectionValue)
+
+
+class UserDefinedFieldDefinition(Freezable, models.Model):
     """
     These models represent user defined fields that are attached to
     specific model types. For instance, if a user wanted to record
@@ -436,6 +536,17 @@ class UserDefinedFieldDefinition(models.Model):
             else:
                 vals.hupdate('data', {name: new_choice_value})
 
+            # hremove and hupdate don't send save signals, so update the
+            # copies used for searching here
+            search_values = UserDefinedCollectionSearchValue.objects\
+                .filter(field_definition=self, key=name,
+                        value=old_choice_value)
+
+            if new_choice_value is None:
+                search_values.delete()
+            else:
+                search_values.update(value=new_choice_value)
+
             audits = Audit.objects.filter(
                 model='udf:%s' % self.pk,
                 field='udf:%s' % name)
@@ -739,9 +850,25 @@ class UserDefinedFieldDefinition(models.Model):
     def full_name(self):
         return to_object_name(self.model_type) + '.' + self.canonical_name
 
+    @property
+    def search_sql_type(self):
+        """
+        The SQL type this UDF's values are cast to when searching, or None
+        if they are searched without a cast
+        """
+        if self.iscollection:
+            return None
+        sql_type, __ = UDF_SEARCH_TYPES.get(
+            self.datatype_dict['type'], (None, None))
+        return sql_type
+
 
 post_save.connect(invalidate_adjuncts, sender=UserDefinedFieldDefinition)
 post_delete.connect(invalidate_adjuncts, sender=UserDefinedFieldDefinition)
+post_save.connect(udf_indexes.udf_def_saved, sender=UserDefinedFieldDefinition)
+post_delete.connect(udf_indexes.udf_def_deleted,
+                    sender=UserDefinedFieldDefinition)
+post_migrate.connect(udf_indexes.create_missing_indexes)
 
 
 class UDFDictionary(HStoreDict):
@@ -1217,6 +1344,61 @@ def _is_scalar_udf(lvalue):
     return isinstance(lvalue.col, tuple) and lvalue.col[0] == 'udf'
 
 
+class TypedUDFValue(object):
+    """
+    A value to compare with the value of a scalar UDF cast to sql_type,
+    e.g. filter(**{'udf:Height__gt': TypedUDFValue(3, 'float8', 1)})
+
+    The comparison is limited to objects of the given instance, so that
+    it can use the UDF's search index (see treemap/lib/udf_indexes.py).
+    """
+    def __init__(self, value, sql_type, instance_id):
+        self.value = value
+        self.sql_type = sql_type
+        self.instance_id = instance_id
+
+    def __eq__(self, other):
+        return (isinstance(other, TypedUDFValue) and
+                (self.value, self.sql_type, self.instance_id) ==
+                (other.value, other.sql_type, other.instance_id))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'TypedUDFValue(%r, %r, %r)' % (
+            self.value, self.sql_type, self.instance_id)
+
+
+class _TypedUDFCondition(object):
+    _OPERATORS = {'exact': '=', 'gt': '>', 'gte': '>=', 'lt': '<',
+                  'lte': '<='}
+
+    def __init__(self, alias, hstore_key, lookup, typed_value):
+        self.alias = alias
+        self.hstore_key = hstore_key
+        self.lookup = lookup
+        self.typed_value = typed_value
+
+    def as_sql(self, qn=None, connection=None):
+        table = qn(self.alias)
+        # The same expression as the UDF's search index
+        value = udf_indexes.search_expression('%s.udfs' % table,
+                                              self.typed_value.sql_type)
+        sql = '(%s.instance_id = %%s AND %s %s %%s)' % (
+            table, value, self._OPERATORS[self.lookup])
+        params = [self.typed_value.instance_id, self.hstore_key,
+                  self.typed_value.value]
+        return (sql, params)
+
+    def relabel_aliases(self, change_map):
+        self.alias = change_map.get(self.alias, self.alias)
+
+    def clone(self):
+        return _TypedUDFCondition(self.alias, self.hstore_key, self.lookup,
+                                  self.typed_value)
+
+
 class UDFWhereNode(HStoreGeoWhereNode):
     """
     This class allows us to write the where clauses for a
@@ -1242,6 +1424,11 @@ class UDFWhereNode(HStoreGeoWhereNode):
             return super(UDFWhereNode, self).add(child, *args, **kwargs)
         lvalue, lookup, param = child
 
+        if _is_scalar_udf(lvalue) and isinstance(param, TypedUDFValue):
+            condition = _TypedUDFCondition(
+                lvalue.alias, lvalue.col[1], lookup, param)
+            return super(UDFWhereNode, self).add(condition, *args, **kwargs)
+
         # contains and icontains are handled below in make_atom
         if _is_scalar_udf(lvalue) and lookup not in ('contains', 'icontains'):
             # For exact searches on scalar UDFs, we actually want contains,
@@ -3,15 +3,21 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import division
 
+from collections import namedtuple
 from functools import partial
 from numbers import Number
 
+import numpy as np
+
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from django.utils.formats import number_format
 
 from treemap.json_field import get_attr_from_json_field
-from treemap.DotDict import DotDict
+
+
+class UnitConversionException(Exception):
+    pass
 
 
 class Convertible(object):
@@ -21,20 +27,15 @@ class Convertible(object):
         super(Convertible, self).__init__(*args, **kwargs)
 
     def _mutate_convertable_fields(self, f):
-        model = self._meta.object_name.lower()
-        for field in self._meta.get_all_field_names():
-            if self.instance and is_convertible(model, field):
-                value = getattr(self, field)
+        if not self.instance:
+            return
 
-                try:
-                    value = float(value)
-                except Exception:
-                    # These will be caught later in the cleaning process
-                    pass
-
-                converted_value = f(self.instance, model, field, value)
+        model = self._meta.object_name.lower()
+        for field in _convertible_field_names(self):
+            value = _parse_number(getattr(self, field))
+            converted_value = f(self.instance, model, field, value)
 
-                setattr(self, field, converted_value)
+            setattr(self, field, converted_value)
 
     def convert_to_display_units(self):
         if self.unit_status != 'display':
@@ -50,6 +51,44 @@ class Convertible(object):
             self._mutate_convertable_fields(get_storage_value)
 
 
+def convert_all_to_display_units(convertibles):
+    """
+    Does convert_to_display_units for a list of objects of one model and
+    instance, converting all the objects' values of each field at once
+    """
+    convertibles = [c for c in convertibles
+                    if c.instance and c.unit_status != 'display']
+    if not convertibles:
+        return
+
+    first = convertibles[0]
+    model = first._meta.object_name.lower()
+    for field in _convertible_field_names(first):
+        values = get_converted_values(
+            first.instance, model, field,
+            [_parse_number(getattr(c, field)) for c in convertibles])
+        for convertible, value in zip(convertibles, values):
+            setattr(convertible, field, value)
+
+    for convertible in convertibles:
+        convertible.unit_status = 'display'
+
+
+def _convertible_field_names(convertible):
+    model = convertible._meta.object_name.lower()
+    conversions = get_conversion_table(convertible.instance).get(model, {})
+    return [field for field in convertible._meta.get_all_field_names()
+            if field in conversions and conversions[field].units]
+
+
+def _parse_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        # These will be caught later in the cleaning process
+        return value
+
+
 _unit_names = {
     "in": _("inches"),
     "ft": _("feet"),
@@ -102,10 +141,11 @@ def _get_storage_units(category_name, value_name):
     # We may specify a storage unit separately from display units
     # We do this for area, since GEOS returns m² but we want to display ft²
     # If there are no storage units specified, use the display units
-    storage_defaults = DotDict(settings.STORAGE_UNITS)
-    return storage_defaults.get(
-        category_name + '.' + value_name,
-        default=_get_display_default(category_name, value_name, 'units'))
+    storage_units = settings.STORAGE_UNITS.get(category_name, {})
+    if value_name in storage_units:
+        return storage_units[value_name]
+    else:
+        return _get_display_default(category_name, value_name, 'units')
 
 
 def get_value_display_attr(instance, category_name, value_name, key):
@@ -116,9 +156,14 @@ def get_value_display_attr(instance, category_name, value_name, key):
     # Make e.g. 'config.value_display.plot.width.units'
     field_name = 'config.value_display.%s.%s.%s' \
                  % (category_name, value_name, key)
-    # Get value from instance.config, or from defaults if not set
-    value = get_attr_from_json_field(instance, field_name) \
-        or _get_display_default(category_name, value_name, key)
+
+    def get_value():
+        # Get value from instance.config, or from defaults if not set
+        return get_attr_from_json_field(instance, field_name) \
+            or _get_display_default(category_name, value_name, key)
+
+    value = instance.config_view.memoized(
+        ('value_display', category_name, value_name, key), get_value)
     identifier = 'instance.' + field_name
     return identifier, value
 
@@ -164,18 +209,101 @@ is_convertible = partial(_is_configured_for, {'units'})
 is_formattable = partial(_is_configured_for, {'digits'})
 
 
+# How to display the values of one field. 'units' and 'digits' are None
+# if the field isn't convertible or formattable, and 'factor' is None if
+# the field's values can't be converted to the display units.
+UnitConversion = namedtuple('UnitConversion', ['units', 'digits', 'factor'])
+
+
+def get_conversion_table(instance):
+    """
+    Returns a dictionary mapping category names to dictionaries mapping
+    value names to a UnitConversion, for every value in DISPLAY_DEFAULTS.
+
+    The table is built once for each version of the instance's config.
+    It is shared, so must not be modified.
+    """
+    return instance.config_view.memoized(
+        'conversion_table', lambda: _build_conversion_table(instance))
+
+
+def _build_conversion_table(instance):
+    from treemap.ecobenefits import BenefitCategory
+
+    table = {}
+    for category_name, values in settings.DISPLAY_DEFAULTS.iteritems():
+        table[category_name] = {}
+        for value_name, defaults in values.iteritems():
+            if (category_name == 'eco'
+                    and value_name not in BenefitCategory.GROUPS):
+                continue
+
+            units, digits, factor = None, None, None
+            if 'units' in defaults:
+                units = get_units(instance, category_name, value_name)
+                try:
+                    factor = _get_conversion_factor(
+                        instance, category_name, value_name)
+                except UnitConversionException:
+                    pass
+            if 'digits' in defaults:
+                try:
+                    digits = int(
+                        get_digits(instance, category_name, value_name))
+                except (TypeError, ValueError):
+                    pass
+
+            table[category_name][value_name] = UnitConversion(
+                units, digits, factor)
+
+    return table
+
+
+def _get_conversion(instance, category_name, value_name):
+    return get_conversion_table(instance)\
+        .get(category_name, {}).get(value_name)
+
+
 def get_conversion_factor(instance, category_name, value_name):
+    conversion = _get_conversion(instance, category_name, value_name)
+    if conversion and conversion.factor is not None:
+        return conversion.factor
+    else:
+        # Raises the appropriate error
+        return _get_conversion_factor(instance, category_name, value_name)
+
+
+def _get_conversion_factor(instance, category_name, value_name):
     storage_unit = _get_storage_units(category_name, value_name)
     instance_unit = get_units(instance, category_name, value_name)
-    conversion_dict = _unit_conversions.get(storage_unit)
+    conversion_dict = _unit_conversions.get(storage_unit, {})
 
     if instance_unit not in conversion_dict.keys():
-        raise Exception("Cannot convert from [%s] to [%s]"
-                        % (storage_unit, instance_unit))
+        raise UnitConversionException("Cannot convert from [%s] to [%s]"
+                                      % (storage_unit, instance_unit))
 
     return conversion_dict[instance_unit]
 
 
+def _get_factor_if_convertible(instance, category_name, value_name):
+    if is_convertible(category_name, value_name):
+        return get_conversion_factor(instance, category_name, value_name)
+    else:
+        return 1
+
+
+def _get_digits_for_display(instance, category_name, value_name):
+    if not is_formattable(category_name, value_name):
+        return 1
+
+    conversion = _get_conversion(instance, category_name, value_name)
+    if conversion and conversion.digits is not None:
+        return conversion.digits
+    else:
+        # Raises the appropriate error
+        return int(get_digits(instance, category_name, value_name))
+
+
 def get_converted_value(instance, category_name, value_name, value):
     if isinstance(value, Number) and \
        is_convertible(category_name, value_name):
@@ -194,10 +322,7 @@ def get_display_value(instance, category_name, value_name, value):
     converted_value = get_converted_value(
         instance, category_name, value_name, value)
 
-    if is_formattable(category_name, value_name):
-        digits = int(get_digits(instance, category_name, value_name))
-    else:
-        digits = 1
+    digits = _get_digits_for_display(instance, category_name, value_name)
 
     rounded_value = round(converted_value, digits)
 
@@ -205,10 +330,7 @@ def get_display_value(instance, category_name, value_name, value):
 
 
 def format_value(instance, category_name, value_name, value):
-    if is_formattable(category_name, value_name):
-        digits = int(get_digits(instance, category_name, value_name))
-    else:
-        digits = 1
+    digits = _get_digits_for_display(instance, category_name, value_name)
 
     rounded_value = round(value, digits)
 
@@ -220,3 +342,59 @@ def get_storage_value(instance, category_name, value_name, value):
         return value
     return value / get_conversion_factor(instance, category_name,
                                          value_name)
+
+
+# ------------------------------------------------------------------------
+# Bulk conversion
+#
+# These convert a whole column of values (e.g. the diameters of every tree
+# on a page) with a single array operation. Given a numpy array they return
+# an array, in which missing values should be NaN. Given any other sequence
+# they return a list, in which values that aren't numbers are unchanged.
+
+
+def get_converted_values(instance, category_name, value_name, values):
+    factor = _get_factor_if_convertible(instance, category_name, value_name)
+    return _scale_values(values, factor)
+
+
+def get_storage_values(instance, category_name, value_name, values):
+    factor = get_conversion_factor(instance, category_name, value_name)
+    return _scale_values(values, 1 / factor)
+
+
+def get_display_values(instance, category_name, value_name, values):
+    """
+    Returns a list with a tuple of (converted value, formatted value) for
+    each value, as returned by get_display_value
+    """
+    converted = get_converted_values(
+        instance, category_name, value_name, values)
+    digits = _get_digits_for_display(instance, category_name, value_name)
+
+    if isinstance(converted, np.ndarray):
+        rounded = np.round(converted, digits).tolist()
+        converted = converted.tolist()
+    else:
+        rounded = [round(value, digits) if isinstance(value, Number)
+                   else value for value in converted]
+
+    return [(value, number_format(rounded_value, decimal_pos=digits))
+            if isinstance(value, Number) else (value, value)
+            for value, rounded_value in zip(converted, rounded)]
+
+
+def _scale_values(values, factor):
+    if isinstance(values, np.ndarray):
+        return values * factor
+
+    values = list(values)
+    positions = [i for i, value in enumerate(values)
+                 if isinstance(value, Number)]
+
+    if factor != 1 and positions:
+        numbers = np.array([values[i] for i in positions], dtype=float)
+        for i, value in zip(positions, (numbers * factor).tolist()):
+            values[i] = value
+
+    return values
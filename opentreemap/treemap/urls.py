@@ -81,6 +81,9 @@ urlpatterns = patterns(
     url(r'^config/settings.js$',
         routes.instance_settings_js, name='settings'),
     url(r'^benefit/search$', routes.search_tree_benefits),
+    url(r'^benefit/search/start$', routes.begin_search_tree_benefits),
+    url(r'^benefit/search/check/(?P<job_id>\d+)/$',
+        routes.check_search_tree_benefits),
     url(r'^users/%s/$' % USERNAME_PATTERN, routes.instance_user_page,
         name="user_profile"),
     url(r'^users/%s/edits/$' % USERNAME_PATTERN, routes.instance_user_audits),
@@ -3,21 +3,29 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import division
 
-import hashlib
+from datetime import timedelta
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
+from django.utils import timezone, translation
+from django.utils.encoding import force_text
 from django.utils.translation import ugettext as _
 from django.shortcuts import get_object_or_404
 from django.db import transaction
+from django.db.models import Q
 from django.http import HttpResponseRedirect
+from django.template import RequestContext
+from django.template.loader import render_to_string
 
-from treemap.search import Filter
-from treemap.models import Plot, Tree
-from treemap.audit import Audit
+from treemap.search import Filter, get_search_hash
+from treemap.models import Plot, Tree, BenefitSummaryJob
 from treemap.ecobenefits import get_benefits_for_filter
 from treemap.ecobenefits import BenefitCategory
 from treemap.lib import format_benefits
+from treemap.lib.benefit_caches import (filter_benefits_key,
+                                        peek_filter_benefits)
+from treemap.tasks import async_benefit_summary
 from treemap.lib.tree import add_tree_photo_helper
 from treemap.lib.photo import context_dict_for_photo
 
@@ -59,14 +67,21 @@ def search_tree_benefits(request, instance):
     filter_str = request.REQUEST.get('q', '')
     display_str = request.REQUEST.get('show', '')
 
+    filter = Filter(filter_str, display_str, instance)
+
+    benefits, basis, __ = get_benefits_for_filter(filter)
+
+    return _search_tree_benefits_context(
+        request, instance, filter, benefits, basis)
+
+
+def _search_tree_benefits_context(request, instance, filter, benefits,
+                                  basis):
     hide_summary_text = request.REQUEST.get('hide_summary', 'false')
     hide_summary = hide_summary_text.lower() == 'true'
 
-    filter = Filter(filter_str, display_str, instance)
     total_plots = filter.get_object_count(Plot)
 
-    benefits, basis = get_benefits_for_filter(filter)
-
     # Inject the plot count as a basis for tree benefit calcs
     basis.get('plot', {})['n_plots'] = total_plots
 
@@ -102,21 +117,104 @@ def search_tree_benefits(request, instance):
 
 
 def search_hash(request, instance):
-    audits = instance.scope_model(Audit)\
-                     .order_by('-updated')
+    return get_search_hash(instance)
 
-    try:
-        audit_id_str = str(audits[0].pk)
-    except IndexError:
-        audit_id_str = 'none'
 
-    eco_conversion = instance.eco_benefits_conversion
+def begin_search_tree_benefits(request, instance):
+    """
+    Starts computing the eco benefit summary of a search in a celery
+    worker. Returns the status of the job, which includes the rendered
+    summary if it is already available.
+    """
+    filter_str = request.REQUEST.get('q', '')
+    display_str = request.REQUEST.get('show', '')
+
+    filter = Filter(filter_str, display_str, instance)
+
+    result = peek_filter_benefits(filter)
+
+    if result is not None:
+        benefits, basis, __ = result
+        return _benefits_job_result(request, instance, filter, benefits,
+                                    basis)
+
+    key = filter_benefits_key(filter)
+    language = translation.get_language()
+
+    job = _find_benefit_summary_job(instance, key, language)
+
+    if job is None:
+        # Summaries are only shared while the search hash is unchanged,
+        # so older jobs are no longer useful
+        BenefitSummaryJob.objects\
+            .filter(instance=instance,
+                    created__lt=timezone.now() - timedelta(days=1))\
+            .delete()
+
+        job = BenefitSummaryJob.objects.create(instance=instance,
+                                               key=key,
+                                               language=language,
+                                               filterstr=filter_str,
+                                               displaystr=display_str)
 
-    if eco_conversion:
-        eco_str = eco_conversion.hash
+        async_benefit_summary.delay(job.pk)
+
+    return _benefit_summary_job_status(request, instance, job)
+
+
+def check_search_tree_benefits(request, instance, job_id):
+    job = get_object_or_404(BenefitSummaryJob, pk=job_id, instance=instance)
+
+    return _benefit_summary_job_status(request, instance, job)
+
+
+def _pending_job_cutoff():
+    return timezone.now() - timedelta(
+        seconds=settings.ECO_ASYNC_SUMMARY_TIMEOUT)
+
+
+def _find_benefit_summary_job(instance, key, language):
+    return BenefitSummaryJob.objects\
+        .filter(instance=instance, key=key, language=language)\
+        .filter(Q(status=BenefitSummaryJob.COMPLETE) |
+                Q(status=BenefitSummaryJob.PENDING,
+                  created__gte=_pending_job_cutoff()))\
+        .order_by('-created')\
+        .first()
+
+
+def _benefit_summary_job_status(request, instance, job):
+    if (job.status == BenefitSummaryJob.PENDING
+            and job.created < _pending_job_cutoff()):
+        # The worker died or the queue is backed up, so give up
+        job.fail()
+        job.save()
+
+    if job.status == BenefitSummaryJob.COMPLETE:
+        benefits, basis, __ = job.result
+        filter = Filter(job.filterstr, job.displaystr, instance)
+        rslt = _benefits_job_result(request, instance, filter, benefits,
+                                    basis)
     else:
-        eco_str = 'none'
+        rslt = _job_status(job.status)
+
+    rslt['job_id'] = job.pk
+
+    return rslt
+
+
+def _benefits_job_result(request, instance, filter, benefits, basis):
+    context = _search_tree_benefits_context(
+        request, instance, filter, benefits, basis)
+
+    html = render_to_string('treemap/partials/eco_benefits.html', context,
+                            RequestContext(request))
+
+    return _job_status(BenefitSummaryJob.COMPLETE, html)
 
-    string_to_hash = audit_id_str + ":" + eco_str
 
-    return hashlib.md5(string_to_hash).hexdigest()
+def _job_status(status, html=None):
+    return {'status': BenefitSummaryJob.STATUS_STRINGS[status],
+            'message': force_text(BenefitSummaryJob.STATUS_CHOICES[status]),
+            'job_id': None,
+            'html': html}
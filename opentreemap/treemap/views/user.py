@@ -15,9 +15,8 @@ from django.http import HttpResponseRedirect
 
 from opentreemap.util import json_from_request, dotted_split
 
-from treemap.decorators import get_instance_or_404
 from treemap.images import save_image_from_request
-from treemap.util import package_field_errors
+from treemap.util import package_field_errors, get_instance_or_404
 from treemap.models import User, Favorite, MapFeaturePhoto
 from treemap.util import get_filterable_audit_models
 from treemap.lib.user import get_audits, get_user_instances, get_audits_params